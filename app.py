@@ -2,7 +2,8 @@ import os
 import asyncio
 from quart import Quart, session
 from modules.database import db
-from modules.bot_manager import bot_engine_loop, close_all_exchanges
+from modules.bot_manager import bot_engine_loop, close_all_exchanges, stop_engine
+from modules.backtest_jobs import backtest_jobs
 from languages import TRANSLATIONS
 
 # 导入蓝图
@@ -37,6 +38,10 @@ async def startup():
 @app.after_serving
 async def shutdown():
     print("\n>>> 正在优雅退出，清理资源...")
+    await stop_engine()
+    await backtest_jobs.shutdown()
+    # 写后队列中尚未落库的状态/日志必须在关闭连接池前写入
+    await db.flush_writes()
     await close_all_exchanges()
     await db.close()
     print(">>> 资源已释放，安全退出。")
@@ -34,5 +34,83 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASS', ''),
     'db': os.getenv('DB_NAME', 'crypto_bot_db'),
     'charset': 'utf8mb4',
-    'autocommit': True
-}
\ No newline at end of file
+    'autocommit': True,
+    # 分片模式跨进程机器人锁 (GET_LOCK) 专用连接池大小，与业务连接池分开
+    'lock_pool_size': int(os.getenv('DB_LOCK_POOL_SIZE', 50)),
+}
+
+# 策略引擎配置
+# ENGINE_WORKERS = 0 表示单进程模式 (引擎与 Web 共用事件循环)
+# ENGINE_WORKERS = N 表示按机器人 ID 一致性哈希分片到 N 个 Worker 进程
+ENGINE_CONFIG = {
+    'workers': int(os.getenv('ENGINE_WORKERS', 0)),
+    'virtual_nodes': int(os.getenv('ENGINE_VIRTUAL_NODES', 64)),
+}
+
+# 后台回测任务队列
+# BACKTEST_WORKERS: 回测进程池大小；BACKTEST_MAX_PENDING: 排队 + 运行中的任务上限
+# SWEEP_WORKERS: 参数寻优进程数 (0 = CPU 核数)；SWEEP_MAX_COMBOS: 单次寻优最多参数组合数
+BACKTEST_CONFIG = {
+    'workers': int(os.getenv('BACKTEST_WORKERS', 2)),
+    'max_pending': int(os.getenv('BACKTEST_MAX_PENDING', 20)),
+    'sweep_workers': int(os.getenv('SWEEP_WORKERS', 0)),
+    'sweep_max_combos': int(os.getenv('SWEEP_MAX_COMBOS', 5000)),
+}
+
+# 共享 K 线仓库
+# KLINE_MAX_ENTRIES: 最多缓存的 (交易所, 市场, 交易对, 周期) 数；KLINE_MAX_BARS: 单个键最多保存根数
+# KLINE_MAX_AGE: 未收盘 K 线的最长缓存时间 (秒)
+KLINE_CONFIG = {
+    'max_entries': int(os.getenv('KLINE_MAX_ENTRIES', 500)),
+    'max_bars': int(os.getenv('KLINE_MAX_BARS', 1000)),
+    'max_age': int(os.getenv('KLINE_MAX_AGE', 50)),
+}
+
+# 行情流 (WebSocket)
+# STREAM_SYMBOLS_PER_CONN: 单个 watch_tickers 连接最多订阅的交易对数 (超出后拆分到新连接)
+# STREAM_STALE_AFTER: 推送价格超过该秒数未更新视为过期，机器人回退 REST
+# STREAM_BACKOFF_BASE / STREAM_BACKOFF_MAX: 断线重连的指数退避起点与上限 (秒，带随机抖动)
+STREAM_CONFIG = {
+    'symbols_per_conn': int(os.getenv('STREAM_SYMBOLS_PER_CONN', 100)),
+    'stale_after': float(os.getenv('STREAM_STALE_AFTER', 10)),
+    'backoff_base': float(os.getenv('STREAM_BACKOFF_BASE', 1)),
+    'backoff_max': float(os.getenv('STREAM_BACKOFF_MAX', 60)),
+}
+
+# Pionex REST
+# PIONEX_TICKER_INTERVAL: 全量行情快照的刷新间隔 (秒，所有用户/机器人共用一份)
+# PIONEX_CONN_LIMIT / PIONEX_CONN_PER_HOST: 共享连接池的总连接数 / 单主机连接数
+# PIONEX_DNS_TTL: DNS 缓存时间 (秒)；PIONEX_KEEPALIVE: 空闲连接保活时间 (秒)
+# PIONEX_RATE_LIMIT: 每秒请求数上限 (每次请求按权重 1 计)
+# PIONEX_WS_URL: 公共行情 WebSocket 地址 (测试时可指向本地模拟服务器，留空则退回 REST 行情快照轮询)
+PIONEX_CONFIG = {
+    'ws_url': os.getenv('PIONEX_WS_URL', 'wss://ws.pionex.com/wsPub'),
+    'ticker_interval': float(os.getenv('PIONEX_TICKER_INTERVAL', 1.0)),
+    'conn_limit': int(os.getenv('PIONEX_CONN_LIMIT', 100)),
+    'conn_per_host': int(os.getenv('PIONEX_CONN_PER_HOST', 50)),
+    'dns_ttl': int(os.getenv('PIONEX_DNS_TTL', 300)),
+    'keepalive': float(os.getenv('PIONEX_KEEPALIVE', 30)),
+    'rate_limit': float(os.getenv('PIONEX_RATE_LIMIT', 10)),
+}
+
+# 市场元数据 (精度/手续费/最小下单额/交易对列表)
+# MARKETS_CACHE_DIR: 精简快照的磁盘目录 (重启后直接使用)；MARKETS_REFRESH: 后台刷新间隔 (秒)
+MARKETS_CONFIG = {
+    'cache_dir': os.getenv('MARKETS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'markets')),
+    'refresh': int(os.getenv('MARKETS_REFRESH', 3600)),
+}
+
+# 交易所请求限流 (所有用户共享，按 交易所/市场/公共或签名 分桶)
+# RATE_LIMIT_HEADROOM: 只使用交易所额度的比例；RATE_LIMIT_BURST: 桶容量 (按速率计的秒数)
+# RATE_LIMIT_BAN_PAUSE: 收到 429/418 后该桶暂停的秒数
+RATE_LIMIT_CONFIG = {
+    'headroom': float(os.getenv('RATE_LIMIT_HEADROOM', 0.8)),
+    'burst': float(os.getenv('RATE_LIMIT_BURST', 2.0)),
+    'ban_pause': float(os.getenv('RATE_LIMIT_BAN_PAUSE', 30)),
+}
+
+# 看板快照 (每个用户的机器人盈亏/回撤/市价，引擎执行时更新)
+# PORTFOLIO_RESYNC: 快照从数据库全量重新加载的间隔 (秒，兜底引擎之外的修改)
+PORTFOLIO_CONFIG = {
+    'resync': float(os.getenv('PORTFOLIO_RESYNC', 30)),
+}
@@ -89,4 +89,74 @@ ALTER TABLE users ADD COLUMN binance_api_secret VARCHAR(255) DEFAULT NULL;
 -- 给 bots 表增加 mode 字段，默认为 'live' (实盘)
 ALTER TABLE bots ADD COLUMN mode VARCHAR(10) DEFAULT 'live';
 -- 建议加个索引方便查询
-CREATE INDEX idx_bot_mode ON bots(mode);
\ No newline at end of file
+CREATE INDEX idx_bot_mode ON bots(mode);
+-- [新增] 状态版本号 (乐观锁)，每次写 bots 行都会递增，用于内存状态缓存的一致性校验
+ALTER TABLE bots ADD COLUMN state_version INT NOT NULL DEFAULT 0;
+
+-- [新增] 机器人状态热/冷拆分: 高频变化的字段放定长列，挂单放独立表，state_json 只保存其余字段
+-- (旧数据无需手动迁移: 没有 bot_runtime 行的机器人继续读 state_json，下一次写入状态时自动拆分)
+CREATE TABLE IF NOT EXISTS bot_runtime (
+    bot_id INT PRIMARY KEY,
+    position_amt DOUBLE DEFAULT NULL,
+    avg_price DOUBLE DEFAULT NULL,
+    total_cost DOUBLE DEFAULT NULL,
+    balance DOUBLE DEFAULT NULL,
+    stage VARCHAR(20) DEFAULT NULL,
+    direction VARCHAR(20) DEFAULT NULL,
+    last_level_idx INT DEFAULT NULL,
+    current_so_index INT DEFAULT NULL,
+    is_trailing_active TINYINT(1) DEFAULT NULL,
+    highest_price_seen DOUBLE DEFAULT NULL,
+    lowest_price_seen DOUBLE DEFAULT NULL,
+    stop_loss_price DOUBLE DEFAULT NULL,
+    extreme_price DOUBLE DEFAULT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (bot_id) REFERENCES bots(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS bot_orders (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    bot_id INT NOT NULL,
+    level_idx INT NOT NULL,
+    price DOUBLE NOT NULL,
+    amount DOUBLE NOT NULL,
+    cost DOUBLE NOT NULL,
+    order_time DOUBLE NOT NULL COMMENT '下单时间 (秒级时间戳)',
+    INDEX idx_bot_orders_bot (bot_id, id),
+    FOREIGN KEY (bot_id) REFERENCES bots(id) ON DELETE CASCADE
+);
+
+-- [新增] 交易日志结构化类型 + 复合索引
+-- kind: open 开仓首单 / add 加仓 / close 平仓 / deposit 入金 / info 提示类日志 (新日志写入时由代码填写)
+ALTER TABLE trade_logs ADD COLUMN kind ENUM('open', 'add', 'close', 'deposit', 'info') NOT NULL DEFAULT 'info';
+-- 旧数据迁移: 按 action 文字推断类型 (规则与 modules/database.py 的 classify_log 一致)
+UPDATE trade_logs SET kind = CASE
+    WHEN profit <> 0 THEN 'close'
+    WHEN action LIKE '%Deposit%' OR action LIKE '%充值%' OR action LIKE '%儲值%' THEN 'deposit'
+    WHEN amount IS NULL OR amount = 0 THEN 'info'
+    WHEN action LIKE '%平仓%' OR action LIKE '%平倉%' OR action LIKE '%Close%' OR action LIKE '%Sell%'
+      OR action LIKE '%卖出%' OR action LIKE '%賣出%' OR action LIKE '%Stop Loss%' OR action LIKE '%Take Profit%'
+      OR action LIKE '%Trailing Hit%' OR action LIKE '%Trailing Profit%' OR action LIKE '%追踪止盈%' OR action LIKE '%追蹤止盈%' THEN 'close'
+    WHEN action LIKE '%首单%' OR action LIKE '%首單%' OR action LIKE '%Base%' THEN 'open'
+    ELSE 'add'
+END;
+-- 日志列表 / 回合按 (bot_id, id) 顺序读取；盈亏与手续费汇总只读覆盖索引
+CREATE INDEX idx_trade_logs_bot ON trade_logs(bot_id, id);
+CREATE INDEX idx_trade_logs_totals ON trade_logs(bot_id, kind, profit, fee);
+
+-- [新增] 已结束交易回合的物化表 (详情页不再每次读取全部日志重新分组)
+-- 每个回合记录汇总值和它覆盖的日志 id 区间 [first_log_id, last_log_id]；进行中的回合由之后的日志实时计算
+-- 旧数据无需手动迁移: 首次读取某个机器人的回合时自动补齐
+CREATE TABLE IF NOT EXISTS trade_rounds (
+    bot_id INT NOT NULL,
+    round_no INT NOT NULL COMMENT '从 1 开始连续编号',
+    first_log_id INT NOT NULL,
+    last_log_id INT NOT NULL COMMENT '平仓日志 id',
+    start_time DATETIME,
+    end_time DATETIME,
+    profit DOUBLE NOT NULL DEFAULT 0 COMMENT '回合内 profit 之和 (毛利)',
+    fees DOUBLE NOT NULL DEFAULT 0 COMMENT '回合内手续费之和',
+    trades INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bot_id, round_no),
+    FOREIGN KEY (bot_id) REFERENCES bots(id) ON DELETE CASCADE
+);
@@ -229,6 +229,7 @@ TRANSLATIONS = {
         "no_data_or_no_market_data": "暂无数据或未获取行情",
         "no_data_or_waiting_for_range": "暂无数据或请等待区间生成",
         "no_trade_records": "暂无交易记录",
+        "load_more_rounds": "加载更早的回合",
 
         # --- 12. 设置页 ---
         "settings_title": "⚙️ 系统设置",
@@ -400,6 +401,13 @@ TRANSLATIONS = {
         "network_error_simple": "网络错误",
         "no_data_fetched": "未获取到数据",
         "backtest_success_msg": "回测完成！",
+        "backtest_queued": "回测任务已提交，正在后台运行",
+        "backtest_queue_full": "回测队列已满，请稍后再试",
+        "backtest_job_not_found": "回测任务不存在或已过期",
+        "backtest_cancelled": "回测已取消",
+        "backtest_trades": "笔成交",
+        "optimize_queued": "参数寻优任务已提交，正在后台运行",
+        "optimize_invalid_params": "寻优参数无效",
 
         'organizing_data': '数据整理中...',
         'loading_layout': '正在渲染界面...'
@@ -633,6 +641,7 @@ TRANSLATIONS = {
         "no_data_or_no_market_data": "暫無數據或未獲取行情",
         "no_data_or_waiting_for_range": "暫無數據或請等待區間生成",
         "no_trade_records": "暫無交易記錄",
+        "load_more_rounds": "載入更早的回合",
 
         # --- 12. 設定頁 ---
         "settings_title": "⚙️ 系統設定",
@@ -803,6 +812,13 @@ TRANSLATIONS = {
         "network_error_simple": "網絡錯誤",
         "no_data_fetched": "未獲取到數據",
         "backtest_success_msg": "回測完成！",
+        "backtest_queued": "回測任務已提交，正在後台運行",
+        "backtest_queue_full": "回測隊列已滿，請稍後再試",
+        "backtest_job_not_found": "回測任務不存在或已過期",
+        "backtest_cancelled": "回測已取消",
+        "backtest_trades": "筆成交",
+        "optimize_queued": "參數尋優任務已提交，正在後台運行",
+        "optimize_invalid_params": "尋優參數無效",
 
         'organizing_data': '數據整理中...',
         'loading_layout': '正在渲染介面...'
@@ -1036,6 +1052,7 @@ TRANSLATIONS = {
         "no_data_or_no_market_data": "No data or market data unavailable",
         "no_data_or_waiting_for_range": "No data or waiting for range generation",
         "no_trade_records": "No trade records found",
+        "load_more_rounds": "Load older rounds",
 
         # --- 12. Settings ---
         "settings_title": "⚙️ System Settings",
@@ -1207,6 +1224,13 @@ TRANSLATIONS = {
         "network_error_simple": "Network Error",
         "no_data_fetched": "No data fetched",
         "backtest_success_msg": "Backtest Completed!",
+        "backtest_queued": "Backtest submitted and running in the background",
+        "backtest_queue_full": "Backtest queue is full, please try again later",
+        "backtest_job_not_found": "Backtest job not found or expired",
+        "backtest_cancelled": "Backtest cancelled",
+        "backtest_trades": "trades",
+        "optimize_queued": "Parameter sweep submitted and running in the background",
+        "optimize_invalid_params": "Invalid sweep parameters",
 
         'organizing_data': 'Organizing Data...',
         'loading_layout': 'Rendering Layout...'
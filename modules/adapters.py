@@ -5,6 +5,8 @@ import time
 import hmac
 import hashlib
 import urllib.parse
+from config import PIONEX_CONFIG
+from modules.rate_limiter import rate_limiter, PRIORITY_MARKET, PRIORITY_META, PRIORITY_ORDER
 
 class ExchangeAdapter:
     """交易所适配器基类"""
@@ -26,6 +28,94 @@ class ExchangeAdapter:
     async def close(self):
         pass
 
+# ================= Pionex 共享连接池 =================
+# 所有 PionexAdapter (各用户/各市场) 共用一个 ClientSession + 调优过的 TCPConnector:
+# keep-alive 复用连接、DNS 缓存、总连接数/单主机连接数上限
+
+_SHARED_SESSION = None
+
+async def get_pionex_session():
+    global _SHARED_SESSION
+    if _SHARED_SESSION is None or _SHARED_SESSION.closed:
+        connector = aiohttp.TCPConnector(
+            limit=PIONEX_CONFIG['conn_limit'],
+            limit_per_host=PIONEX_CONFIG['conn_per_host'],
+            ttl_dns_cache=PIONEX_CONFIG['dns_ttl'],
+            keepalive_timeout=PIONEX_CONFIG['keepalive'],
+        )
+        # trust_env=True 允许读取服务器的环境变量代理设置
+        _SHARED_SESSION = aiohttp.ClientSession(connector=connector, trust_env=True)
+    return _SHARED_SESSION
+
+async def close_pionex_session():
+    global _SHARED_SESSION
+    if _SHARED_SESSION is not None and not _SHARED_SESSION.closed:
+        await _SHARED_SESSION.close()
+    _SHARED_SESSION = None
+
+class PionexTickerSnapshot:
+    """
+    按市场类型 (SPOT / PERP) 共享的全量行情快照:
+    - 刷新间隔内直接返回，交易对查找 O(1)
+    - 同一市场同时只有一个刷新请求在途 (single-flight)，其余调用共用结果
+    - 刷新失败时返回旧快照
+    """
+    def __init__(self, base_url, interval=1.0):
+        self.base_url = base_url
+        self.interval = interval
+        self.snapshots = {}   # pionex_type -> {'prices': {BTC_USDT: price}, 'ts': 拉取时间}
+        self.inflight = {}    # pionex_type -> Task
+        self.fetches = 0
+        self.errors = 0
+
+    async def get(self, pionex_type):
+        snap = self.snapshots.get(pionex_type)
+        if snap is not None and time.time() - snap['ts'] < self.interval:
+            return snap['prices']
+        task = self.inflight.get(pionex_type)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(pionex_type))
+            self.inflight[pionex_type] = task
+        return await asyncio.shield(task)
+
+    async def _refresh(self, pionex_type):
+        self.fetches += 1
+        try:
+            venue = ('pionex', 'future' if pionex_type == 'PERP' else 'spot')
+            await rate_limiter.acquire(venue, 1, False, PRIORITY_MARKET, PIONEX_CONFIG['rate_limit'])
+            session = await get_pionex_session()
+            url = f"{self.base_url}/api/v1/market/tickers?type={pionex_type}"
+            async with session.get(url, timeout=10) as resp:
+                data = await resp.json() if resp.status == 200 else None
+            tickers = ((data or {}).get('data') or {}).get('tickers')
+            if not tickers:
+                raise Exception(f"HTTP {resp.status}")
+            prices = {}
+            for t in tickers:
+                try:
+                    prices[t['symbol']] = float(t['close'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.snapshots[pionex_type] = {'prices': prices, 'ts': time.time()}
+            return prices
+        except Exception as e:
+            self.errors += 1
+            print(f"[Pionex] Tickers Snapshot Error ({pionex_type}): {e}")
+            snap = self.snapshots.get(pionex_type)
+            return snap['prices'] if snap else {}
+        finally:
+            self.inflight.pop(pionex_type, None)
+
+    def get_stats(self):
+        now = time.time()
+        return {
+            'markets': {k: {'symbols': len(v['prices']), 'age_s': round(now - v['ts'], 2)} for k, v in self.snapshots.items()},
+            'fetches': self.fetches,
+            'errors': self.errors,
+        }
+
+pionex_tickers = PionexTickerSnapshot("https://api.pionex.com", interval=PIONEX_CONFIG['ticker_interval'])
+
 class PionexAdapter(ExchangeAdapter):
     """
     Pionex 官方 REST API 适配器 (已完善签名验证)
@@ -35,17 +125,18 @@ class PionexAdapter(ExchangeAdapter):
         super().__init__()
         self.source_name = "pionex"
         self.base_url = "https://api.pionex.com"
-        self.session = None
         self.api_key = api_key
         self.api_secret = api_secret
 
+        self.market_type = market_type
         self.pionex_type = 'PERP' if market_type == 'future' else 'SPOT'
 
+        # 行情流 (StreamManager) 使用: 未启用原生 WS (PIONEX_WS_URL 为空) 时 watch_tickers 按快照间隔读取全量行情
+        self.has = {'watchTickers': True, 'watchOHLCV': False}
+        self._last_ticker_poll = 0
+
     async def _get_session(self):
-        if self.session is None or self.session.closed:
-            # trust_env=True 允许读取服务器的环境变量代理设置
-            self.session = aiohttp.ClientSession(trust_env=True)
-        return self.session
+        return await get_pionex_session()
 
     def _symbol_to_pionex(self, symbol):
         """ 将 BTC/USDT 转换为 BTC_USDT """
@@ -90,8 +181,8 @@ class PionexAdapter(ExchangeAdapter):
         
         return signature
 
-    async def _request(self, method, endpoint, params=None, data=None):
-        """ 统一请求封装，自动处理签名 """
+    async def _request(self, method, endpoint, params=None, data=None, priority=None):
+        """ 统一请求封装，自动处理签名与全局限流 """
         if params is None: params = {}
         
         # 1. 注入必需的时间戳 (毫秒)
@@ -112,6 +203,13 @@ class PionexAdapter(ExchangeAdapter):
         query_string = urllib.parse.urlencode(sorted_params)
         url = f"{self.base_url}{endpoint}?{query_string}"
         
+        # 4. 全局限流: 公共行情与签名请求分桶，签名请求默认最高优先级
+        signed = bool(self.api_key and self.api_secret) and not endpoint.startswith('/api/v1/market/')
+        if priority is None:
+            priority = PRIORITY_ORDER if signed else PRIORITY_MARKET
+        venue = ('pionex', self.market_type)
+        await rate_limiter.acquire(venue, 1, signed, priority, PIONEX_CONFIG['rate_limit'])
+
         session = await self._get_session()
         
         try:
@@ -129,6 +227,9 @@ class PionexAdapter(ExchangeAdapter):
         if resp.status != 200:
             text = await resp.text()
             print(f"[Pionex] HTTP {resp.status} ({endpoint}): {text}")
+            if resp.status in (418, 429):
+                signed = 'PIONEX-KEY' in resp.request_info.headers
+                rate_limiter.penalize(('pionex', self.market_type), signed, PIONEX_CONFIG['rate_limit'])
             return None
             
         data = await resp.json()
@@ -141,20 +242,9 @@ class PionexAdapter(ExchangeAdapter):
         return data
 
     async def fetch_price(self, symbol):
-        """ 获取最新成交价 """
-        params = {
-            'type': self.pionex_type
-        }
-
-        # 获取所有 tickers
-        data = await self._request('GET', '/api/v1/market/tickers', params=params)
-        p_symbol = self._symbol_to_pionex(symbol)
-        
-        if data and 'data' in data and 'tickers' in data['data']:
-            for t in data['data']['tickers']:
-                if t['symbol'] == p_symbol:
-                    return float(t['close'])
-        return 0.0
+        """ 获取最新成交价 (读取共享行情快照) """
+        prices = await pionex_tickers.get(self.pionex_type)
+        return prices.get(self._symbol_to_pionex(symbol), 0.0)
 
     async def fetch_ticker(self, symbol):
         """ 模拟 CCXT 结构 """
@@ -166,6 +256,25 @@ class PionexAdapter(ExchangeAdapter):
             'timestamp': int(time.time() * 1000)
         }
 
+    async def watch_tickers(self, symbols):
+        """ 兼容 ccxt.pro 的 watch_tickers: 一次请求取回该市场全部行情，返回 {symbol: ticker} """
+        wait = self._last_ticker_poll + pionex_tickers.interval - time.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_ticker_poll = time.time()
+
+        prices = await pionex_tickers.get(self.pionex_type)
+        if not prices:
+            raise Exception("Pionex tickers unavailable")
+
+        tickers = {}
+        ts = int(time.time() * 1000)
+        for symbol in symbols:
+            price = prices.get(self._symbol_to_pionex(symbol))
+            if price:
+                tickers[symbol] = {'symbol': symbol, 'last': price, 'close': price, 'timestamp': ts}
+        return tickers
+
     async def fetch_ohlcv(self, symbol, timeframe='15m', limit=100):
         """ 获取 K 线数据 """
         p_symbol = self._symbol_to_pionex(symbol)
@@ -212,7 +321,7 @@ class PionexAdapter(ExchangeAdapter):
 
     async def fetch_symbols(self):
         """ 获取支持的交易对 """
-        data = await self._request('GET', '/api/v1/market/tickers')
+        data = await self._request('GET', '/api/v1/market/tickers', priority=PRIORITY_META)
         symbols = []
         if data and 'data' in data and 'tickers' in data['data']:
             for t in data['data']['tickers']:
@@ -223,9 +332,16 @@ class PionexAdapter(ExchangeAdapter):
         symbols.sort()
         return symbols
 
+    async def fetch_markets_info(self):
+        """ 交易对规则 (精度、最小下单额等)，返回原始列表 """
+        data = await self._request('GET', '/api/v1/common/symbols', params={'type': self.pionex_type}, priority=PRIORITY_META)
+        if data and 'data' in data and 'symbols' in data['data']:
+            return data['data']['symbols']
+        return []
+
     async def close(self):
-        if self.session:
-            await self.session.close()
+        # 连接池为所有适配器共用，由 close_pionex_session 在退出时统一关闭
+        pass
 
 # ================= 补充部分 (必须保留) =================
 
@@ -259,10 +375,45 @@ class BinanceAdapter(ExchangeAdapter):
         except:
             return []
 
+    async def load_markets(self):
+        return await self.exchange.load_markets()
+
     async def close(self):
         if self.exchange:
             await self.exchange.close()
 
+class BinanceSigner(ExchangeAdapter):
+    """
+    单个用户的轻量客户端:
+    - 行情/K 线/交易对等公共数据全部转给该市场唯一的共享公共客户端 (无需密钥，市场信息只加载一次)
+    - 只保存该用户的密钥，不再为每个用户创建完整的 ccxt 实例
+    """
+    def __init__(self, public, api_key=None, api_secret=None):
+        super().__init__()
+        self.source_name = "binance"
+        self.public = public              # 共享的 BinanceAdapter
+        self.api_key = api_key
+        self.api_secret = api_secret
+
+    async def fetch_price(self, symbol):
+        return await self.public.fetch_price(symbol)
+
+    async def fetch_ticker(self, symbol):
+        return await self.public.fetch_ticker(symbol)
+
+    async def fetch_ohlcv(self, symbol, timeframe, limit=100):
+        return await self.public.fetch_ohlcv(symbol, timeframe, limit=limit)
+
+    async def fetch_symbols(self):
+        return await self.public.fetch_symbols()
+
+    async def load_markets(self):
+        return await self.public.load_markets()
+
+    async def close(self):
+        # 公共客户端由 exchange_manager 统一关闭，这里没有自己的连接
+        pass
+
 class ExchangeFactory:
     """ 工厂类：根据名称创建适配器 """
     @staticmethod
@@ -0,0 +1,264 @@
+import time
+import uuid
+import asyncio
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from config import BACKTEST_CONFIG
+from modules.backtest_engine import (
+    BacktestCancelled, load_candles, simulate_backtest,
+    save_backtest_result, resolve_dry_run, backtest_bot_snapshot
+)
+from modules.backtest_optimizer import run_sweep, rank_results, expand_grid, RANK_FIELDS
+from modules.state_cache import bot_state_cache
+from modules.scheduler import bot_scheduler
+
+# ================= 后台回测任务队列 =================
+# /start_backtest 不再在 HTTP 请求里 await 整个回测:
+# 1. 提交后立即返回 job_id，模拟部分在独立的进程池中运行 (不占用事件循环，不拖慢实盘机器人)
+# 2. 子进程通过 Manager 共享字典上报进度 (已处理 K 线 / 总数 / 成交笔数)，并据此检查取消标记
+# 3. 模拟结束后由主进程落库，结果保存在内存结果表中 (按 TTL/数量淘汰)
+# 4. 参数寻优 (kind=sweep) 同样作为任务排队，同一时间只跑一个，自带独立进程池，只返回排名表不落库
+
+ACTIVE_STATES = ('queued', 'running')
+
+def _job_entry(bot, file_content, job_id, progress_map, cancel_map):
+    """ 子进程入口 (spawn 启动，必须是模块级函数)，返回 (state, ledger) """
+    def progress(done, total, trades):
+        progress_map[job_id] = (done, total, trades)
+        return not cancel_map.get(job_id, False)
+
+    df = load_candles(file_content)
+    return asyncio.run(simulate_backtest(bot, df, progress=progress))
+
+class BacktestJobManager:
+    def __init__(self, workers=2, max_pending=20, result_ttl=3600, max_results=200,
+                 sweep_workers=0, sweep_max_combos=5000):
+        self.workers = workers            # 进程池大小 (同时运行的回测数)
+        self.max_pending = max_pending    # 排队 + 运行中的任务上限
+        self.sweep_workers = sweep_workers or None     # 参数寻优进程数 (None = CPU 核数)
+        self.sweep_max_combos = sweep_max_combos
+        self.result_ttl = result_ttl      # 已结束任务的结果保留时间 (秒)
+        self.max_results = max_results    # 已结束任务最多保留条数
+
+        self.jobs = {}         # job_id -> 任务信息
+        self.futures = {}      # job_id -> concurrent.futures.Future
+        self.executor = None
+        self.manager = None
+        self.progress_map = None
+        self.cancel_map = None
+        self.sweep_stop = {}   # job_id -> 取消标记 (参数寻优在线程中轮询)
+        self._sweep_slot = None
+
+    def _ensure_pool(self):
+        if self.executor is not None: return
+        ctx = mp.get_context('spawn')
+        self.manager = ctx.Manager()
+        self.progress_map = self.manager.dict()
+        self.cancel_map = self.manager.dict()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+
+    def _evict(self):
+        now = time.time()
+        finished = sorted(
+            (j for j in self.jobs.values() if j['state'] not in ACTIVE_STATES),
+            key=lambda j: j['finished_at'] or 0
+        )
+        overflow = len(finished) - self.max_results
+        for k, job in enumerate(finished):
+            if k < overflow or now - (job['finished_at'] or now) > self.result_ttl:
+                self.jobs.pop(job['id'], None)
+
+    def active_count(self):
+        return sum(1 for j in self.jobs.values() if j['state'] in ACTIVE_STATES)
+
+    # ---------- 提交 / 查询 / 取消 ----------
+
+    async def submit(self, user_id, bot_id, file_content, dry_run=False):
+        """ 提交回测任务，返回 job_id；队列已满返回 None，机器人不存在抛出异常 """
+        self._evict()
+        if self.active_count() >= self.max_pending:
+            return None
+
+        bot = await bot_state_cache.get(bot_id)
+        if not bot: raise Exception("Bot not found")
+        bot = backtest_bot_snapshot(bot)
+        dry_run = resolve_dry_run(bot, dry_run)
+
+        self._ensure_pool()
+        job_id = self._new_job(user_id, bot['id'], 'backtest', dry_run)
+        future = self.executor.submit(_job_entry, bot, file_content, job_id, self.progress_map, self.cancel_map)
+        self.futures[job_id] = future
+        asyncio.create_task(self._watch(job_id, bot, future, dry_run))
+        print(f"🧪 回测任务 {job_id} 已提交 (Bot {bot['id']}, 排队/运行中 {self.active_count()})")
+        return job_id
+
+    def _new_job(self, user_id, bot_id, kind, dry_run):
+        job_id = uuid.uuid4().hex[:12]
+        self.jobs[job_id] = {
+            'id': job_id,
+            'kind': kind,
+            'user_id': user_id,
+            'bot_id': bot_id,
+            'dry_run': dry_run,
+            'state': 'queued',
+            'submitted_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'progress': {'done': 0, 'total': 0, 'pct': 0.0, 'trades': 0},
+            'result': None,
+            'error': None,
+        }
+        return job_id
+
+    async def submit_sweep(self, user_id, bot_id, file_content, ranges, rank_by='net_pnl', top=50):
+        """ 提交参数寻优任务，返回 job_id；队列已满返回 None，参数非法抛出 ValueError """
+        self._evict()
+        if self.active_count() >= self.max_pending:
+            return None
+        if rank_by not in RANK_FIELDS:
+            raise ValueError(f"invalid rank_by: {rank_by}")
+        # 提前校验组合数，避免排队后才失败
+        expand_grid(ranges, self.sweep_max_combos)
+
+        bot = await bot_state_cache.get(bot_id)
+        if not bot: raise Exception("Bot not found")
+        bot = backtest_bot_snapshot(bot)
+
+        job_id = self._new_job(user_id, bot['id'], 'sweep', True)
+        self.sweep_stop[job_id] = False
+        asyncio.create_task(self._run_sweep(job_id, bot, file_content, ranges, rank_by, top))
+        print(f"🧪 参数寻优任务 {job_id} 已提交 (Bot {bot['id']}, 排队/运行中 {self.active_count()})")
+        return job_id
+
+    async def _run_sweep(self, job_id, bot, file_content, ranges, rank_by, top):
+        job = self.jobs.get(job_id)
+        if self._sweep_slot is None:
+            self._sweep_slot = asyncio.Semaphore(1)
+
+        def progress(done, total):
+            job['progress'] = {'done': done, 'total': total, 'pct': round(done / total * 100, 1) if total else 0.0, 'trades': 0}
+
+        try:
+            async with self._sweep_slot:
+                if self.sweep_stop.get(job_id):
+                    raise asyncio.CancelledError()
+                job['state'] = 'running'
+                job['started_at'] = time.time()
+                results = await asyncio.to_thread(
+                    run_sweep, bot, file_content, ranges,
+                    workers=self.sweep_workers, max_combos=self.sweep_max_combos,
+                    progress=progress, should_stop=lambda: self.sweep_stop.get(job_id, False)
+                )
+            if self.sweep_stop.get(job_id):
+                raise asyncio.CancelledError()
+            job['result'] = {
+                'combos': len(results),
+                'rank_by': rank_by,
+                'ranked': rank_results(results, rank_by, top=top),
+            }
+            job['state'] = 'done'
+            print(f"✅ 参数寻优任务 {job_id} 完成，共 {len(results)} 组参数")
+        except asyncio.CancelledError:
+            job['state'] = 'cancelled'
+        except Exception as e:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            print(f"❌ 参数寻优任务 {job_id} 失败: {e}")
+        finally:
+            job['finished_at'] = time.time()
+            self.sweep_stop.pop(job_id, None)
+
+    def _refresh_progress(self, job):
+        if job['state'] not in ACTIVE_STATES or self.progress_map is None: return
+        data = self.progress_map.get(job['id'])
+        if not data: return
+        done, total, trades = data
+        if job['state'] == 'queued':
+            job['state'] = 'running'
+            job['started_at'] = time.time()
+        job['progress'] = {
+            'done': done,
+            'total': total,
+            'pct': round(done / total * 100, 1) if total else 0.0,
+            'trades': trades,
+        }
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job: self._refresh_progress(job)
+        return job
+
+    def list_user(self, user_id):
+        jobs = [j for j in self.jobs.values() if j['user_id'] == user_id]
+        for job in jobs:
+            self._refresh_progress(job)
+        return sorted(jobs, key=lambda j: j['submitted_at'], reverse=True)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job or job['state'] not in ACTIVE_STATES: return False
+        if job_id in self.sweep_stop:
+            self.sweep_stop[job_id] = True
+            return True
+        future = self.futures.get(job_id)
+        # 还在排队: 直接从进程池移除；已在运行: 设置取消标记，子进程在下一次上报进度时退出
+        if future is not None and future.cancel():
+            return True
+        self.cancel_map[job_id] = True
+        return True
+
+    @staticmethod
+    def public_view(job, with_result=True):
+        data = {k: v for k, v in job.items() if k != 'user_id'}
+        if not with_result: data.pop('result', None)
+        return data
+
+    # ---------- 完成处理 ----------
+
+    async def _watch(self, job_id, bot, future, dry_run):
+        job = self.jobs.get(job_id)
+        try:
+            state, ledger = await asyncio.wrap_future(future)
+            job['progress'].update({'done': job['progress']['total'], 'pct': 100.0, 'trades': len(ledger)})
+            job['result'] = await save_backtest_result(bot, state, ledger, dry_run)
+            job['state'] = 'done'
+            if not dry_run:
+                await bot_scheduler.refresh_bot(bot['id'])
+        except (BacktestCancelled, asyncio.CancelledError):
+            job['state'] = 'cancelled'
+        except Exception as e:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            print(f"❌ 回测任务 {job_id} 失败: {e}")
+        finally:
+            job['finished_at'] = time.time()
+            self.futures.pop(job_id, None)
+            try:
+                self.progress_map.pop(job_id, None)
+                self.cancel_map.pop(job_id, None)
+            except Exception:
+                pass
+
+    async def shutdown(self):
+        for job_id in list(self.sweep_stop.keys()):
+            self.sweep_stop[job_id] = True
+        if self.executor is None: return
+        for job_id in list(self.futures.keys()):
+            self.cancel(job_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+        self.executor = None
+        self.manager = None
+
+    def get_stats(self):
+        states = {}
+        for job in self.jobs.values():
+            states[job['state']] = states.get(job['state'], 0) + 1
+        return {'workers': self.workers, 'max_pending': self.max_pending, 'jobs': states}
+
+backtest_jobs = BacktestJobManager(
+    workers=BACKTEST_CONFIG['workers'],
+    max_pending=BACKTEST_CONFIG['max_pending'],
+    sweep_workers=BACKTEST_CONFIG['sweep_workers'],
+    sweep_max_combos=BACKTEST_CONFIG['sweep_max_combos']
+)
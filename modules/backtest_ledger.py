@@ -0,0 +1,123 @@
+from array import array
+import numpy as np
+
+# ================= 回测成交账本 =================
+# 回测过程中的成交不再逐笔 await db.add_log，而是记入内存中的列式账本:
+# 数值列用 array('d') 紧凑存储，收益曲线/回撤/回合统计直接在账本上计算，
+# 结束后一次性批量写库 (dry_run 时不写)
+
+SIDE_BUY = 0
+SIDE_SELL = 1
+
+class TradeLedger:
+    def __init__(self):
+        # 成交列
+        self.ts = array('d')
+        self.side = array('b')
+        self.price = array('d')
+        self.amount = array('d')
+        self.profit = array('d')
+        self.fee = array('d')
+        self.actions = []
+        self.notes = []
+        # 权益曲线 (每根 K 线一个点)
+        self.equity_ts = array('d')
+        self.equity = array('d')
+
+    def __len__(self):
+        return len(self.ts)
+
+    def record(self, ts, side, action, price, amount, profit=0.0, fee=0.0, note=""):
+        self.ts.append(ts)
+        self.side.append(side)
+        self.price.append(price)
+        self.amount.append(amount)
+        self.profit.append(profit)
+        self.fee.append(fee)
+        self.actions.append(action)
+        self.notes.append(note or "")
+
+    def mark(self, ts, equity):
+        self.equity_ts.append(ts)
+        self.equity.append(equity)
+
+    # ---------- 统计 ----------
+
+    def drawdown(self):
+        """ 返回 (最大回撤金额, 最大回撤比例%) """
+        if not self.equity: return 0.0, 0.0
+        eq = np.frombuffer(self.equity, dtype=float)
+        peak = np.maximum.accumulate(eq)
+        dd = peak - eq
+        i = int(np.argmax(dd))
+        pct = dd[i] / peak[i] * 100 if peak[i] > 0 else 0.0
+        return float(dd[i]), float(pct)
+
+    def round_stats(self):
+        """ 按回合统计 (每次平仓结束一个回合，净利润口径与 get_bot_rounds 一致: 回合内 profit 之和 - fee 之和) """
+        if not self.ts:
+            return {'rounds': 0, 'wins': 0, 'losses': 0, 'win_rate': 0.0, 'avg_net_profit': 0.0, 'profit_factor': 0.0}
+        side = np.frombuffer(self.side, dtype=np.int8)
+        net = np.frombuffer(self.profit, dtype=float) - np.frombuffer(self.fee, dtype=float)
+        closes = np.nonzero(side == SIDE_SELL)[0]
+        if not len(closes):
+            return {'rounds': 0, 'wins': 0, 'losses': 0, 'win_rate': 0.0, 'avg_net_profit': 0.0, 'profit_factor': 0.0}
+        # 每个回合的净利润 = 累计净额在平仓点的差分
+        cum = np.cumsum(net)[closes]
+        round_net = np.diff(np.concatenate([[0.0], cum]))
+        wins = int((round_net > 0).sum())
+        losses = int((round_net < 0).sum())
+        gross_win = float(round_net[round_net > 0].sum())
+        gross_loss = float(-round_net[round_net < 0].sum())
+        return {
+            'rounds': int(len(round_net)),
+            'wins': wins,
+            'losses': losses,
+            'win_rate': round(wins / len(round_net) * 100, 2),
+            'avg_net_profit': round(float(round_net.mean()), 8),
+            'profit_factor': round(gross_win / gross_loss, 4) if gross_loss > 0 else 0.0,
+        }
+
+    def equity_curve(self, max_points=500):
+        """ 降采样后的权益曲线 [[ts, equity], ...] (供前端绘图) """
+        n = len(self.equity)
+        if not n: return []
+        step = max(1, -(-n // max_points))
+        idx = list(range(0, n, step))
+        if idx[-1] != n - 1: idx.append(n - 1)
+        return [[self.equity_ts[i], round(self.equity[i], 4)] for i in idx]
+
+    def summary(self, initial_capital):
+        final_equity = self.equity[-1] if self.equity else float(initial_capital)
+        dd, dd_pct = self.drawdown()
+        data = {
+            'trades': len(self),
+            'realized_profit': round(float(sum(self.profit)), 8),
+            'total_fees': round(float(sum(self.fee)), 8),
+            'final_equity': round(final_equity, 8),
+            'return_pct': round((final_equity / initial_capital - 1) * 100, 4) if initial_capital else 0.0,
+            'max_drawdown': round(dd, 8),
+            'max_drawdown_pct': round(dd_pct, 4),
+        }
+        data.update(self.round_stats())
+        data['equity_curve'] = self.equity_curve()
+        return data
+
+    # ---------- 持久化 ----------
+
+    def to_rows(self):
+        """ 转成 trade_logs 行 (log_time 秒, action, price, amount, profit, fee, note, kind) """
+        rows = []
+        flat = True     # 回测只在平仓时清空持仓，平仓后的第一笔买入即为开仓
+        for k in range(len(self.ts)):
+            note = self.notes[k]
+            if len(note) > 250: note = note[:247] + "..."
+            if self.side[k] == SIDE_SELL:
+                kind, flat = 'close', True
+            else:
+                kind, flat = ('open' if flat else 'add'), False
+            rows.append((
+                self.ts[k], self.actions[k], self.price[k],
+                round(self.amount[k], 8), round(self.profit[k], 8), round(self.fee[k], 8), note, kind
+            ))
+        return rows
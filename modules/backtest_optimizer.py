@@ -0,0 +1,195 @@
+import os
+import time
+import copy
+import asyncio
+import itertools
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from modules.strategies import STRATEGY_MAP
+from modules.backtest_engine import load_candles, simulate_backtest
+from modules.backtest_precompute import BacktestSeries
+
+# ================= 参数寻优 (网格搜索) =================
+# 对 STRATEGY_MAP 中任意策略的配置参数做笛卡尔积扫描:
+# 1. K 线文件只读取一次、指标序列只预计算一次 (覆盖所有组合用到的指标)
+# 2. 进程池每个 Worker 启动时接收一份只读的 K 线 + 指标序列 (initializer)，之后只传参数组合
+# 3. 组合按块分发，Worker 只返回统计指标 (不回传账本)，主进程汇总排名
+
+# 排名字段 -> 是否越大越好
+RANK_FIELDS = {
+    'net_pnl': True,
+    'return_pct': True,
+    'win_rate': True,
+    'profit_factor': True,
+    'max_drawdown_pct': False,
+    'total_fees': False,
+}
+
+# Worker 进程内共享的只读数据
+_SHARED = {}
+
+def _param_values(spec):
+    """
+    单个参数的取值:
+    - 列表: [0.5, 1.0, 1.5]
+    - 区间: {"start": 0.5, "stop": 2.0, "step": 0.5} (包含 stop)
+    - 标量: 固定值
+    """
+    if isinstance(spec, (list, tuple)):
+        return list(spec)
+    if isinstance(spec, dict):
+        start, stop, step = float(spec['start']), float(spec['stop']), float(spec['step'])
+        if step <= 0: raise ValueError("step must be > 0")
+        count = int((stop - start) / step + 1e-9) + 1
+        values = [round(start + k * step, 10) for k in range(count)]
+        if all(float(v).is_integer() for v in (spec['start'], spec['stop'], spec['step'])):
+            values = [int(v) for v in values]
+        return values
+    return [spec]
+
+def expand_grid(ranges, max_combos=5000):
+    """ 参数区间 -> (参数名列表, 组合列表)，组合数超过上限抛出 ValueError """
+    if not isinstance(ranges, dict) or not ranges:
+        raise ValueError("empty parameter ranges")
+    names = list(ranges.keys())
+    values = [_param_values(ranges[k]) for k in names]
+    total = 1
+    for v in values:
+        if not v: raise ValueError("empty parameter values")
+        total *= len(v)
+    if total > max_combos:
+        raise ValueError(f"too many combinations: {total} > {max_combos}")
+    return names, [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+def sweep_metrics(state, ledger, capital):
+    """ 单组参数的排名指标 (不含权益曲线) """
+    summary = ledger.summary(capital)
+    return {
+        'net_pnl': round(summary['final_equity'] - capital, 8),
+        'return_pct': summary['return_pct'],
+        'max_drawdown': summary['max_drawdown'],
+        'max_drawdown_pct': summary['max_drawdown_pct'],
+        'win_rate': summary['win_rate'],
+        'rounds': summary['rounds'],
+        'trades': summary['trades'],
+        'total_fees': summary['total_fees'],
+        'profit_factor': summary['profit_factor'],
+    }
+
+def rank_results(rows, rank_by='net_pnl', top=None):
+    """ 按指定字段排序，失败的组合排在最后 """
+    desc = RANK_FIELDS.get(rank_by, True)
+    ok = [r for r in rows if not r.get('error')]
+    bad = [r for r in rows if r.get('error')]
+    ok.sort(key=lambda r: r[rank_by], reverse=desc)
+    ranked = ok + bad
+    for k, r in enumerate(ranked):
+        r['rank'] = k + 1
+    return ranked[:top] if top else ranked
+
+def _apply_params(bot, params):
+    run_bot = dict(bot)
+    run_bot['config'] = dict(copy.deepcopy(bot.get('config', {})), **params)
+    run_bot['state'] = copy.deepcopy(bot.get('state', {}))
+    return run_bot
+
+# ---------- Worker 进程 ----------
+
+def _worker_init(df, series):
+    _SHARED['df'] = df
+    _SHARED['series'] = series
+
+async def _run_chunk_async(bot, chunk):
+    df, series = _SHARED['df'], _SHARED['series']
+    out = []
+    for params in chunk:
+        run_bot = _apply_params(bot, params)
+        capital = float(run_bot['config'].get('capital', 1000.0))
+        try:
+            state, ledger = await simulate_backtest(run_bot, df, series=series, verbose=False)
+            row = sweep_metrics(state, ledger, capital)
+        except Exception as e:
+            row = {'error': str(e)}
+        row['params'] = params
+        out.append(row)
+    return out
+
+def _run_chunk(bot, chunk):
+    return asyncio.run(_run_chunk_async(bot, chunk))
+
+# ---------- 主进程 ----------
+
+def run_sweep(bot, file_content, ranges, workers=None, max_combos=5000, chunk_size=None,
+              progress=None, should_stop=None):
+    """
+    同步执行整次扫描 (调用方放到线程里跑)，返回未排序的结果列表
+    progress(done, total) 每完成一块回调一次；should_stop() 返回 True 时取消剩余块
+    """
+    strategy_type = bot.get('strategy_type', 'fvg')
+    if strategy_type not in STRATEGY_MAP:
+        raise ValueError(f"unknown strategy: {strategy_type}")
+    _, combos = expand_grid(ranges, max_combos)
+    total = len(combos)
+
+    df = load_candles(file_content)
+    # 指标序列只算一次: 基础配置 + 每个组合可能新增的指标
+    series = BacktestSeries(df, bot.get('config', {}))
+    for params in combos:
+        series.ensure(dict(bot.get('config', {}), **params))
+
+    workers = max(1, min(workers or os.cpu_count() or 1, total))
+    if chunk_size is None:
+        chunk_size = max(1, min(16, total // (workers * 4)))
+    chunks = [combos[k:k + chunk_size] for k in range(0, total, chunk_size)]
+
+    results = []
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_worker_init, initargs=(df, series)) as pool:
+        pending = {pool.submit(_run_chunk, bot, chunk) for chunk in chunks}
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.extend(future.result())
+            if progress: progress(len(results), total)
+            if should_stop and should_stop():
+                for future in pending: future.cancel()
+                break
+    return results
+
+# ================= 基准测试 =================
+# python -m modules.backtest_optimizer [rows] [workers]
+# 用随机游走 K 线对 grid_dca 做网格扫描，输出耗时与排名前 10 的组合
+
+if __name__ == '__main__':
+    import sys
+    import io
+    from modules.backtest_precompute import _synthetic_candles
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    buf = io.StringIO()
+    _synthetic_candles(rows).to_csv(buf, index=False)
+
+    bot = {
+        'id': 0, 'mode': 'sim', 'strategy_type': 'grid_dca', 'language': 'zh-CN',
+        'config': {'symbol': 'BTC/USDT', 'capital': 1000.0, 'direction': 'long'},
+        'state': {},
+    }
+    ranges = {
+        'grid_count': [5, 10, 20, 30],
+        'range_percent': {'start': 0.05, 'stop': 0.3, 'step': 0.05},
+        'tp_target': [0.5, 1.0, 1.5],
+    }
+
+    t0 = time.perf_counter()
+    results = run_sweep(bot, buf.getvalue().encode(), ranges, workers=workers,
+                        progress=lambda d, t: print(f"\r{d}/{t}", end="", flush=True))
+    elapsed = time.perf_counter() - t0
+    print(f"\nrows={rows} combos={len(results)} elapsed={elapsed:.2f}s ({elapsed / max(1, len(results)) * 1000:.1f} ms/combo)")
+    for r in rank_results(results, 'net_pnl', top=10):
+        if r.get('error'):
+            print(f"#{r['rank']:<3} {r['params']} error={r['error']}")
+            continue
+        print(f"#{r['rank']:<3} {r['params']} pnl={r['net_pnl']:.2f} dd={r['max_drawdown_pct']:.2f}% "
+              f"win={r['win_rate']:.1f}% fees={r['total_fees']:.2f} trades={r['trades']}")
@@ -0,0 +1,301 @@
+import time
+import numpy as np
+import pandas as pd
+
+from modules.indicators import (
+    rsi_series, ma_series, bollinger_series, stoch_rsi_k_series,
+    adx_series, volume_spike_series
+)
+
+# ================= 回测预计算 =================
+# 回测循环原来每根 K 线都要重新拼 data_15m、切片 closes_1h[:idx] 并从头计算 EMA/RSI，
+# 数据越长越慢。这里在循环开始前对每一列只算一次全部指标，循环内只按下标取值。
+# 所有序列都与原逻辑对齐: 15m 指标对应 "最近 lookback+1 根"，大周期指标对应 "截至当前已收盘的全部大周期 K 线"
+
+HIGHER_TFS = ('1h', '4h', '1d')
+
+def resample_candles(df_15m, target_tf):
+    """
+    将 K 线数据重采样为大周期
+    """
+    tf_map = {'1h': '1h', '4h': '4h', '1d': '1d', '4H': '4h', '1D': '1d'}
+    rule = tf_map.get(target_tf)
+    if not rule: return df_15m
+
+    df = df_15m.copy()
+    if 'dt' not in df.columns:
+        df['dt'] = pd.to_datetime(df['timestamp'], unit='ms')
+    df.set_index('dt', inplace=True)
+
+    # 确保 volume 也被正确聚合
+    resampled = df.resample(rule).agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'volume': 'sum',
+        'timestamp': 'last'
+    }).dropna()
+
+    resampled = resampled.reset_index(drop=True)
+    return resampled
+
+def prepare_fast_lookup(resampled_df):
+    """
+    将 DataFrame 转换为列表，方便在循环中极速查找
+    """
+    resampled_df = resampled_df.sort_values('timestamp')
+    ts_index = resampled_df['timestamp'].values # numpy array 用于二分查找
+    closes = resampled_df['close'].tolist()
+    # 缓存所有列数据 [ts, open, high, low, close, volume]
+    full_data = resampled_df[['timestamp','open','high','low','close','volume']].values.tolist()
+    return ts_index, closes, full_data
+
+def _align(values, idx, empty=np.nan):
+    """ 大周期序列按 "已收盘根数" 对齐到基础周期: 第 i 根取 values[idx[i]-1]，一根都没有时取 empty """
+    out = np.full(len(idx), empty, dtype=float)
+    has = idx > 0
+    if len(values):
+        out[has] = np.asarray(values, dtype=float)[idx[has] - 1]
+    return out
+
+class BacktestSeries:
+    """
+    回测所需的全部指标序列 (按基础周期下标对齐)
+    - rsi[tf][i]        : RSI 条件用，NaN 表示数据不足 (原逻辑跳过该条件)
+    - ma[(tf, p, t)][i] : 均线条件用，0 表示数据不足 (不拦截)，NaN 表示没有数据 (拦截)
+    - stoch_k / bb_upper / bb_lower / adx_4h / vol_spike
+    """
+    def __init__(self, df, cfg, lookback=200):
+        self.lookback = lookback
+        self.window = lookback + 1
+
+        ts = df['timestamp'].values
+        self.ts = ts.tolist()
+        self.close = df['close'].values.tolist()
+        # 策略需要原始 K 线行时 (coffin) 直接切片，不再逐根拼接
+        self.rows = [list(r) for r in zip(
+            self.ts, df['open'].values.tolist(), df['high'].values.tolist(),
+            df['low'].values.tolist(), self.close, df['volume'].values.tolist()
+        )]
+
+        if 'dt' not in df.columns:
+            df = df.assign(dt=pd.to_datetime(df['timestamp'], unit='ms'))
+        self.frames = {}
+        self.idx = {}
+        for tf in HIGHER_TFS:
+            frame = resample_candles(df, tf).sort_values('timestamp')
+            self.frames[tf] = frame
+            self.idx[tf] = np.searchsorted(frame['timestamp'].values, ts, side='right')
+
+        closes = df['close'].values.astype(float)
+        n = len(closes)
+        self.closes = closes
+        self.volume = df['volume'].values
+        self.rsi = {}
+        self.ma = {}
+
+        # 高级过滤默认值 (未启用时不拦截)，启用后由 ensure 补算
+        self.filters = set()
+        self.stoch_k = np.full(n, 50.0)
+        self.bb_upper = self.bb_lower = np.zeros(n)
+        self.vol_spike = np.zeros(n, dtype=bool)
+        self.adx_4h = np.full(n, np.nan)
+
+        self.ensure(cfg)
+
+    def ensure(self, cfg):
+        """ 补算 cfg 用到但尚未计算的指标 (已算过的直接跳过，参数寻优时多组配置共用一份序列) """
+        closes = self.closes
+
+        # RSI 条件 (只计算配置里用到的周期)
+        for c in cfg.get('rsi_conditions', []) or []:
+            if c.get('enabled'):
+                self._rsi_for(c.get('tf'), closes)
+
+        # 均线条件
+        for c in cfg.get('ma_conditions', []) or []:
+            if c.get('enabled', True):
+                self._ma_for(c.get('tf', '15m'), int(c.get('period', 50)), c.get('ma_type', 'ema'), closes)
+
+        # 高级过滤
+        if cfg.get('rsi_filter_stoch', False) and 'stoch' not in self.filters:
+            self.stoch_k = stoch_rsi_k_series(closes, window=self.window)
+            self.filters.add('stoch')
+        if cfg.get('rsi_filter_bb', False) and 'bb' not in self.filters:
+            self.bb_upper, _, self.bb_lower = bollinger_series(closes)
+            self.filters.add('bb')
+        if cfg.get('rsi_filter_vol', False) and 'vol' not in self.filters:
+            self.vol_spike = volume_spike_series(self.volume)
+            self.filters.add('vol')
+
+        # ADX 用 4h 已收盘 K 线，根数 <= 20 时原逻辑跳过 (NaN)
+        if cfg.get('rsi_filter_adx', False) and 'adx' not in self.filters:
+            f4 = self.frames['4h']
+            adx = adx_series(f4['high'].values, f4['low'].values, f4['close'].values)
+            self.adx_4h = _align(adx, self.idx['4h'])
+            self.adx_4h[self.idx['4h'] <= 20] = np.nan
+            self.filters.add('adx')
+
+    def _tf_closes(self, tf):
+        return self.frames[tf]['close'].values.astype(float)
+
+    def _rsi_for(self, tf, closes):
+        if tf in self.rsi: return
+        if tf in ('default', '15m'):
+            rsi = rsi_series(closes, window=self.window)
+            rsi[np.minimum(np.arange(1, len(closes) + 1), self.window) < 15] = np.nan
+        elif tf in HIGHER_TFS:
+            rsi = _align(rsi_series(self._tf_closes(tf)), self.idx[tf])
+            rsi[self.idx[tf] < 15] = np.nan
+        else:
+            rsi = np.full(len(closes), np.nan)
+        self.rsi[tf] = rsi
+
+    def _ma_for(self, tf, period, ma_type, closes):
+        key = (tf, period, ma_type)
+        if key in self.ma: return
+        if tf in ('default', '15m'):
+            ma = ma_series(closes, period=period, ma_type=ma_type, window=self.window)
+        elif tf in HIGHER_TFS:
+            ma = _align(ma_series(self._tf_closes(tf), period=period, ma_type=ma_type), self.idx[tf])
+        else:
+            ma = np.full(len(closes), np.nan)
+        self.ma[key] = ma
+
+    def get_ma(self, tf, period, ma_type, i):
+        ma = self.ma.get((tf, period, ma_type))
+        return float(ma[i]) if ma is not None else float('nan')
+
+    def check_rsi(self, rsi_configs, i):
+        """ 与实盘 check_rsi_conditions 输出格式一致: (是否全部通过, 状态描述) """
+        if not rsi_configs: return True, ""
+        active_conds = [c for c in rsi_configs if c.get('enabled')]
+        if not active_conds: return True, ""
+
+        status_details = []
+        all_passed = True
+        for c in active_conds:
+            tf = c['tf']
+            try: threshold = float(c['val'])
+            except: continue
+
+            rsi = self.rsi.get(tf)
+            if rsi is None or np.isnan(rsi[i]): continue
+            rsi_val = float(rsi[i])
+            op = c['op']
+            passed = (rsi_val < threshold) if op == '<' else (rsi_val > threshold)
+
+            icon = "✅" if passed else "❌"
+            status_details.append(f"{tf}({rsi_val:.1f}{op}{int(threshold)}){icon}")
+            if not passed: all_passed = False
+
+        return all_passed, " ".join(status_details)
+
+# ================= 对比 & 基准测试 =================
+# python -m modules.backtest_precompute [rows]
+# 用随机游走 K 线分别跑 "逐根切片重算" (原回测循环的做法) 与预计算查表，校验结果一致并比较耗时
+
+def _legacy_values(df, cfg, start, lookback=200):
+    from modules.indicators import (
+        calculate_ma, calculate_rsi_value, calculate_bollinger_bands,
+        calculate_stoch_rsi_k, calculate_adx, check_volume_spike
+    )
+    tfs = {}
+    for tf in HIGHER_TFS:
+        ts_tf, closes_tf, data_tf = prepare_fast_lookup(resample_candles(df, tf))
+        tfs[tf] = (ts_tf, closes_tf, data_tf)
+    close_arr = df['close'].values.tolist()
+    vol_arr = df['volume'].values.tolist()
+    ts_arr = df['timestamp'].values.tolist()
+
+    out = []
+    for i in range(start, len(df)):
+        s = max(0, i - lookback)
+        base = close_arr[s:i+1]
+        idx = {tf: np.searchsorted(tfs[tf][0], ts_arr[i], side='right') for tf in HIGHER_TFS}
+        prices = {'15m': base, **{tf: tfs[tf][1][:idx[tf]] for tf in HIGHER_TFS}}
+        row = {
+            'rsi_15m': calculate_rsi_value(base),
+            'rsi_1h': calculate_rsi_value(prices['1h']) if len(prices['1h']) >= 15 else np.nan,
+            'stoch': calculate_stoch_rsi_k(base),
+            'bb': calculate_bollinger_bands(base),
+            'vol': check_volume_spike(vol_arr[s:i+1])[0],
+        }
+        for c in cfg['ma_conditions']:
+            closes = prices[c['tf']]
+            row[('ma', c['tf'], c['period'], c['ma_type'])] = calculate_ma(closes, c['period'], c['ma_type']) if closes else np.nan
+        bars_4h = tfs['4h'][2][:idx['4h']]
+        if len(bars_4h) > 20:
+            row['adx'] = calculate_adx([x[2] for x in bars_4h], [x[3] for x in bars_4h], [x[4] for x in bars_4h])
+        else:
+            row['adx'] = np.nan
+        out.append(row)
+    return out
+
+def _synthetic_candles(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, rows)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, rows)) * close
+    return pd.DataFrame({
+        'timestamp': 1700000000000 + np.arange(rows, dtype=np.int64) * 15 * 60 * 1000,
+        'open': open_,
+        'high': np.maximum(open_, close) + spread,
+        'low': np.minimum(open_, close) - spread,
+        'close': close,
+        'volume': rng.gamma(2.0, 50.0, rows),
+    })
+
+if __name__ == '__main__':
+    import sys
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    df = _synthetic_candles(rows)
+    df['dt'] = pd.to_datetime(df['timestamp'], unit='ms')
+    cfg = {
+        'rsi_conditions': [{'enabled': True, 'tf': '15m', 'op': '<', 'val': 30}, {'enabled': True, 'tf': '1h', 'op': '>', 'val': 50}],
+        'ma_conditions': [
+            {'tf': '15m', 'period': 50, 'ma_type': 'ema'}, {'tf': '15m', 'period': 150, 'ma_type': 'ema'},
+            {'tf': '15m', 'period': 20, 'ma_type': 'sma'}, {'tf': '1h', 'period': 20, 'ma_type': 'ema'},
+            {'tf': '4h', 'period': 10, 'ma_type': 'sma'},
+        ],
+        'rsi_filter_stoch': True, 'rsi_filter_bb': True, 'rsi_filter_adx': True, 'rsi_filter_vol': True,
+    }
+    start = 2000 if rows > 2000 else 100
+
+    t0 = time.perf_counter()
+    legacy = _legacy_values(df, cfg, start)
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    series = BacktestSeries(df, cfg)
+    t_pre = time.perf_counter() - t0
+
+    def rel(a, b):
+        if np.isnan(a) and np.isnan(b): return 0.0
+        return abs(a - b) / max(1.0, abs(b))
+
+    worst = {}
+    for k, row in enumerate(legacy):
+        i = start + k
+        new = {
+            'rsi_15m': series.rsi['15m'][i],
+            'rsi_1h': series.rsi['1h'][i],
+            'stoch': series.stoch_k[i],
+            'bb': series.bb_lower[i],
+            'adx': series.adx_4h[i],
+        }
+        ref = dict(row, bb=row['bb'][2])
+        for c in cfg['ma_conditions']:
+            key = ('ma', c['tf'], c['period'], c['ma_type'])
+            new[key] = series.get_ma(c['tf'], c['period'], c['ma_type'], i)
+        for key, val in new.items():
+            worst[key] = max(worst.get(key, 0.0), rel(float(val), float(ref[key])))
+        if bool(series.vol_spike[i]) != bool(row['vol']):
+            worst['vol'] = worst.get('vol', 0) + 1
+
+    print(f"rows={rows} candles_checked={len(legacy)}")
+    print(f"legacy per-candle: {t_legacy:.3f}s | precompute: {t_pre:.3f}s | speedup x{t_legacy / max(t_pre, 1e-9):.1f}")
+    for key, err in worst.items():
+        print(f"  max rel err {key}: {err:.2e}")
@@ -4,15 +4,18 @@ import pandas as pd
 import traceback
 import numpy as np
 from decimal import Decimal, ROUND_DOWN
-from modules.database import db
+from modules.database import db, log_row
 from modules.strategies import get_strategy_class
 from languages import TRANSLATIONS
-from modules.globals import RUNTIME_CACHE, WS_PRICE_CACHE, get_bot_lock
-from modules.exchange_manager import get_cached_exchange
-
-from modules.indicators import (
-    calculate_ma, calculate_rsi_value, calculate_bollinger_bands,
-    calculate_stoch_rsi_k, calculate_adx, check_volume_spike
+from modules.globals import RUNTIME_CACHE, get_bot_lock
+from modules.exchange_manager import get_cached_exchange, get_stream_price
+from modules.kline_store import kline_store
+from modules.state_cache import bot_state_cache
+
+# 流式指标: 同一份 K 线快照只算一次，快照刷新时只增量喂入新收盘的 K 线
+from modules.indicator_stream import (
+    indicator_book, StreamMA, StreamRSI, StreamBollinger,
+    StreamStochRSI, StreamADX, StreamVolumeSpike
 )
 
 # ================= 辅助指标 =================
@@ -21,40 +24,18 @@ async def check_rsi_conditions(rsi_configs, exchange, symbol):
     active_conds = [c for c in rsi_configs if c.get('enabled')]
     if not active_conds: return True, ""
     
-    tfs = set(c['tf'] for c in active_conds)
-    tf_list = list(tfs)
-    
-    data_map = {}
-    tasks = []
-    fetch_needed_indices = []
+    tf_list = list(set(c['tf'] for c in active_conds))
+    # exchange 为共享 K 线仓库的包装 (KlineView)，同交易对同周期的请求在这里合并
+    market = (getattr(exchange, 'venue', None), symbol)
 
-    # 1. 检查缓存
-    now_ts = time.time()
-    for i, tf in enumerate(tf_list):
-        cache_key = f"rsi_data_{symbol}_{tf}"
-        cached = RUNTIME_CACHE.get(cache_key)
-        
-        # 缓存有效期设为 50 秒 (略小于K线周期)
-        if cached and (now_ts - cached['ts'] < 50):
-            data_map[tf] = cached['data']
+    data_map = {}
+    results = await asyncio.gather(*[exchange.fetch_ohlcv(symbol, timeframe=tf, limit=50) for tf in tf_list], return_exceptions=True)
+    for tf, res in zip(tf_list, results):
+        if isinstance(res, list) and len(res) > 0:
+            data_map[tf] = res
         else:
-            tasks.append(exchange.fetch_ohlcv(symbol, timeframe=tf, limit=50))
-            fetch_needed_indices.append(i)
-    
-    # 2. 仅请求未命中的数据
-    if tasks:
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for idx, res in enumerate(results):
-            original_idx = fetch_needed_indices[idx]
-            tf = tf_list[original_idx]
-            
-            if isinstance(res, list) and len(res) > 0:
-                data_map[tf] = res
-                # 写入缓存
-                RUNTIME_CACHE[f"rsi_data_{symbol}_{tf}"] = {'ts': now_ts, 'data': res}
-            else:
-                return False, f"RSI Fetch Error: {tf}"
-            
+            return False, f"RSI Fetch Error: {tf}"
+
     status_details = []
     all_passed = True
     for c in active_conds:
@@ -65,8 +46,7 @@ async def check_rsi_conditions(rsi_configs, exchange, symbol):
         bars = data_map.get(tf)
         if not bars or len(bars) < 15: return False, f"RSI Data Insufficient"
         
-        closes = [x[4] for x in bars]
-        rsi_val = calculate_rsi_value(closes)
+        rsi_val = indicator_book.value(market, tf, bars, StreamRSI)
         op = c['op']
         passed = (rsi_val < threshold) if op == '<' else (rsi_val > threshold)
         
@@ -149,6 +129,11 @@ async def run_bot_logic(bot_data):
         print(f"Exchange init error: {e}")
         return
 
+    # K 线统一走共享仓库 (同交易所/市场/交易对/周期的机器人共用一份)
+    market_type = cfg.get('market_type', 'future')
+    kline_ex = kline_store.view(exchange, (user_exchange_source, market_type))
+    market = (kline_ex.venue, symbol)
+
     # ============================================================
     # 1. 获取行情
     # ============================================================
@@ -156,16 +141,8 @@ async def run_bot_logic(bot_data):
         StrategyClass = get_strategy_class(strat_type)
         brain = StrategyClass(cfg, t_func=t, now_func=time.time)
         
-        current_price = 0.0
-        is_ws_allowed = (cfg.get('market_type', 'future') == 'future')
-        
-        if user_exchange_source == 'pionex':
-            is_ws_allowed = False 
-
-        if is_ws_allowed:
-            ws_data = WS_PRICE_CACHE.get(symbol)
-            if ws_data and (time.time() - ws_data['ts'] < 10):
-                current_price = ws_data['price']
+        # 每个 (交易所, 市场类型) 都有独立的行情流，推送价格过期 (或所在连接断开) 时才回退 REST
+        current_price = get_stream_price((user_exchange_source, market_type, symbol))
         
         if current_price <= 0:
             ticker = await exchange.fetch_ticker(symbol)
@@ -195,10 +172,10 @@ async def run_bot_logic(bot_data):
                 
                 # 分别检查
                 if long_configs:
-                    rsi_pass_long, rsi_msg_long = await check_rsi_conditions(long_configs, exchange, symbol)
+                    rsi_pass_long, rsi_msg_long = await check_rsi_conditions(long_configs, kline_ex, symbol)
                 
                 if short_configs:
-                    rsi_pass_short, rsi_msg_short = await check_rsi_conditions(short_configs, exchange, symbol)
+                    rsi_pass_short, rsi_msg_short = await check_rsi_conditions(short_configs, kline_ex, symbol)
                     
             except Exception as e:
                 print(f"RSI Check Error: {e}")
@@ -214,8 +191,8 @@ async def run_bot_logic(bot_data):
 
         if strat_type == 'coffin':
             try:
-                task_5m = exchange.fetch_ohlcv(symbol, '5m', limit=100)
-                task_15m = exchange.fetch_ohlcv(symbol, '15m', limit=100)
+                task_5m = kline_ex.fetch_ohlcv(symbol, '5m', limit=100)
+                task_15m = kline_ex.fetch_ohlcv(symbol, '15m', limit=100)
                 res = await asyncio.gather(task_5m, task_15m, return_exceptions=True)
                 
                 extra_data = {
@@ -226,7 +203,7 @@ async def run_bot_logic(bot_data):
                 pass 
 
         elif strat_type == 'fvg' or (strat_type == 'fib_grid' and cfg.get('use_fvg', False)):
-            await _update_fvgs_cache(bot_id, cfg, exchange, brain, symbol)
+            await _update_fvgs_cache(bot_id, cfg, kline_ex, brain, symbol)
             all_fvgs = RUNTIME_CACHE[bot_id].get('fvgs', [])
         
         # ============================================================
@@ -258,10 +235,15 @@ async def run_bot_logic(bot_data):
         # ============================================================
         # 4. 策略分析
         # ============================================================
+        RUNTIME_CACHE[bot_id]['price_triggers'] = None
         if strat_type == 'coffin':
             intent = brain.analyze_market(snapshot_state, current_price, extra_data=extra_data)
         else:
             intent = brain.analyze_market(snapshot_state, current_price, all_fvgs)
+
+        # 没有动作时登记下一次需要评估的价格区间，调度器据此跳过区间内的价格推送
+        if intent['action'] == 'none' and hasattr(brain, 'price_triggers'):
+            RUNTIME_CACHE[bot_id]['price_triggers'] = brain.price_triggers(snapshot_state, all_fvgs)
         
         has_position = float(snapshot_state.get('position_amt', 0)) != 0
         
@@ -293,11 +275,14 @@ async def run_bot_logic(bot_data):
         # ============================================================
         lock = get_bot_lock(bot_id)
         async with lock:
-            latest_bot = await db.get_bot_full_data(bot_id)
+            # 从状态缓存读取 (命中时无数据库往返)
+            latest_bot = await bot_state_cache.get(bot_id)
             if not latest_bot or not latest_bot['is_running']: return 
             
             fresh_state = latest_bot['state']
             save_needed = False
+            # 成交日志随带版本号的状态写入同一事务落库，版本冲突 (期间被手动操作/其他进程修改) 时一起丢弃，避免记录没有发生的成交
+            trade_logs = []
             
             current_pnl = 0
             direction = fresh_state.get('direction', cfg.get('direction', 'long'))
@@ -423,27 +408,11 @@ async def run_bot_logic(bot_data):
                     req_tfs.add(c.get('tf', '15m'))
                 
                 data_map = {}
-                tasks = []
-                fetch_indices = []
                 req_tfs_list = list(req_tfs)
-                now_ts = time.time()
-                
-                for i, tf in enumerate(req_tfs_list):
-                    cache_key = f"adv_filter_{symbol}_{tf}"
-                    cached = RUNTIME_CACHE.get(cache_key)
-                    if cached and (now_ts - cached['ts'] < 55):
-                        data_map[tf] = cached['data']
-                    else:
-                        tasks.append(exchange.fetch_ohlcv(symbol, timeframe=tf, limit=200))
-                        fetch_indices.append(i)
-                
-                if tasks:
-                    res_list = await asyncio.gather(*tasks, return_exceptions=True)
-                    for idx, res in enumerate(res_list):
-                        tf = req_tfs_list[fetch_indices[idx]]
-                        if isinstance(res, list) and len(res) > 20:
-                            data_map[tf] = res
-                            RUNTIME_CACHE[f"adv_filter_{symbol}_{tf}"] = {'ts': now_ts, 'data': res}
+                res_list = await asyncio.gather(*[kline_ex.fetch_ohlcv(symbol, timeframe=tf, limit=200) for tf in req_tfs_list], return_exceptions=True)
+                for tf, res in zip(req_tfs_list, res_list):
+                    if isinstance(res, list) and len(res) > 20:
+                        data_map[tf] = res
 
                 #MA 趋势过滤核心逻辑
                 if active_ma_conds:
@@ -454,8 +423,7 @@ async def run_bot_logic(bot_data):
                         
                         if ma_tf in data_map:
                             k_ma = data_map[ma_tf]
-                            closes_ma = [x[4] for x in k_ma]
-                            ma_val = calculate_ma(closes_ma, period=ma_period, ma_type=ma_type)
+                            ma_val = indicator_book.value(market, ma_tf, k_ma, StreamMA, period=ma_period, ma_type=ma_type)
                             
                             if ma_val > 0:
                                 # 顺势逻辑：做多要求价格 > MA，做空要求价格 < MA
@@ -477,7 +445,7 @@ async def run_bot_logic(bot_data):
                 if use_adx:
                     if '4h' in data_map:
                         k = data_map['4h']
-                        adx = calculate_adx([x[2] for x in k], [x[3] for x in k], [x[4] for x in k])
+                        adx = indicator_book.value(market, '4h', k, StreamADX)
                         if adx >= 25:
                             adv_pass = False
                             adv_msg_list.append(t('filter_wait_adx').format(adx=adx))
@@ -487,13 +455,11 @@ async def run_bot_logic(bot_data):
 
                 # 准备 15m 数据
                 k15 = data_map.get('15m', [])
-                closes_15m = [x[4] for x in k15] if k15 else []
-                volumes_15m = [x[5] for x in k15] if k15 else []
 
                 # [新增] 2. Volume Spike (15m)
                 if use_vol:
-                    if volumes_15m:
-                        is_spike, cur_v, target_v = check_volume_spike(volumes_15m, period=20, multiplier=1.5)
+                    if k15:
+                        is_spike, cur_v, target_v = indicator_book.value(market, '15m', k15, StreamVolumeSpike, period=20, multiplier=1.5)
                         if not is_spike:
                             adv_pass = False
                             adv_msg_list.append(t('filter_wait_vol').format(v=cur_v, t=target_v))
@@ -503,8 +469,8 @@ async def run_bot_logic(bot_data):
                 
                 # 3. StochRSI (15m)
                 if use_stoch:
-                    if closes_15m:
-                        stoch_k = calculate_stoch_rsi_k(closes_15m)
+                    if k15:
+                        stoch_k = indicator_book.value(market, '15m', k15, StreamStochRSI)
                         if target_dir == 'long' and stoch_k >= 20:
                             adv_pass = False
                             adv_msg_list.append(t('filter_wait_stoch').format(k=stoch_k))
@@ -517,8 +483,8 @@ async def run_bot_logic(bot_data):
 
                 # 4. Bollinger Bands (15m)
                 if use_bb:
-                    if closes_15m:
-                        bb_up, bb_mid, bb_low = calculate_bollinger_bands(closes_15m)
+                    if k15:
+                        bb_up, bb_mid, bb_low = indicator_book.value(market, '15m', k15, StreamBollinger)
                         if target_dir == 'long' and current_price >= bb_low:
                             adv_pass = False
                             adv_msg_list.append(t('filter_wait_bb').format(p=current_price, b=bb_low))
@@ -552,7 +518,7 @@ async def run_bot_logic(bot_data):
                     fresh_state['highest_price_seen'] = max(old_high, current_price)
                 
                 if intent.get('log_note'):
-                    await db.add_log(bot_id, t("log_trailing_active"), current_price, 0, 0, 0, intent['log_note'])
+                    trade_logs.append(log_row(bot_id, t("log_trailing_active"), current_price, 0, 0, 0, intent['log_note'], kind='info'))
                 save_needed = True
 
             elif action == 'buy':
@@ -588,7 +554,7 @@ async def run_bot_logic(bot_data):
                     amt = float(amt_d) 
                     
                     if amt <= 0:
-                        await db.add_log(bot_id, t("error"), current_price, 0, 0, 0, f"{t('err_qty_too_small')}: {raw_amt_d}")
+                        await db.add_log(bot_id, t("error"), current_price, 0, 0, 0, f"{t('err_qty_too_small')}: {raw_amt_d}", kind='info')
                         return
 
                     actual_notional_d = amt_d * current_price_d
@@ -631,7 +597,7 @@ async def run_bot_logic(bot_data):
                         else:
                             fresh_state['current_so_index'] += 1
 
-                    await db.add_log(bot_id, intent.get('log_action', t('log_buy')), current_price, amt, 0, float(actual_fee_d), intent['log_note'])
+                    trade_logs.append(log_row(bot_id, intent.get('log_action', t('log_buy')), current_price, amt, 0, float(actual_fee_d), intent['log_note'], kind='open' if pos_amt_d == 0 else 'add'))
                     save_needed = True
                 else:
                     status_msg = f"{t('status_insufficient_balance')} (Need {required_balance:.2f})"
@@ -661,7 +627,7 @@ async def run_bot_logic(bot_data):
                     
                     realized_profit = float(pnl_d - close_fee_d) 
                     
-                    await db.add_log(bot_id, intent.get('log_action', t('log_sell')), current_price, pos_amt, realized_profit, float(close_fee_d), intent['log_note'])
+                    trade_logs.append(log_row(bot_id, intent.get('log_action', t('log_sell')), current_price, pos_amt, realized_profit, float(close_fee_d), intent['log_note'], kind='close'))
                     
                     profit_arg += realized_profit
 
@@ -685,18 +651,20 @@ async def run_bot_logic(bot_data):
                         
                     save_needed = True
 
-            current_check = await db.get_bot_full_data(bot_id)
-            if not current_check or not current_check['is_running']:
+            current_check = bot_state_cache.peek(bot_id) or latest_bot
+            if not current_check['is_running']:
                 return 
 
+            # 带版本号写入: 期间如有其他写入方 (跨进程/外部) 修改过该行，本次放弃，下一轮重新读取
+            read_version = latest_bot.get('state_version')
             if save_needed or has_position:
-                await db.update_bot_state(bot_id, fresh_state, status_msg, profit_arg)
+                await bot_state_cache.save_state(bot_id, fresh_state, status_msg, profit_arg, version=read_version, logs=trade_logs)
                 RUNTIME_CACHE[bot_id]['last_db_write'] = time.time()
             elif status_msg != latest_bot['status_msg']:
                 now = time.time()
                 last_write = RUNTIME_CACHE[bot_id].get('last_db_write', 0)
                 if now - last_write > 3:
-                    await db.update_bot_state(bot_id, fresh_state, status_msg, profit_arg)
+                    await bot_state_cache.save_state(bot_id, fresh_state, status_msg, profit_arg, version=read_version)
                     RUNTIME_CACHE[bot_id]['last_db_write'] = now
 
     except Exception as e:
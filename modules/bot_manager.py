@@ -1,4 +1,3 @@
-import asyncio
 from modules.database import db
 
 # ================= 导入各子模块功能 =================
@@ -18,12 +17,23 @@ from modules.exchange_manager import (
 # 3. 从 Manual Ops 导入
 from modules.manual_ops import execute_manual_buy, execute_manual_close
 
-# 4. 从 Bot Logic 导入
-from modules.bot_logic import run_bot_logic
+# 4. 从 Scheduler 导入 (事件驱动调度器)
+from modules.scheduler import bot_scheduler
+from modules.state_cache import bot_state_cache
+from modules.indicator_stream import indicator_book
+from modules.kline_store import kline_store
+from modules.adapters import pionex_tickers
+from modules.rate_limiter import rate_limiter
+from modules.portfolio import portfolio
+from modules.markets_meta import markets_meta
 
-# 5. 特殊补充函数 (因为需要 db，放在这里或独立的 data_fetcher)
+# 5. 分片引擎 (多进程模式)
+from config import ENGINE_CONFIG
+from modules.sharding import engine_coordinator
+
+# 6. 特殊补充函数 (因为需要 db，放在这里或独立的 data_fetcher)
 async def get_bot_kline(bot_id, timeframe='15m', limit=100):
-    bot_data = await db.get_bot_full_data(bot_id)
+    bot_data = await bot_state_cache.get(bot_id)
     if not bot_data: return []
     cfg = bot_data.get('config', {})
     
@@ -42,8 +52,9 @@ async def get_bot_kline(bot_id, timeframe='15m', limit=100):
     if not exchange: return []
     
     try:
-        limit = int(limit)
-        ohlcv = await exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+        # 与引擎共用 K 线仓库: 机器人已在用的周期直接命中缓存
+        venue = (cfg['exchange_source'], cfg.get('market_type', 'future'))
+        ohlcv = await kline_store.get(exchange, venue, symbol, timeframe, limit=int(limit))
         return [{'time': int(c[0]/1000), 'open': c[1], 'high': c[2], 'low': c[3], 'close': c[4]} for c in ohlcv]
     except Exception as e:
         print(f"Kline Fetch Error: {e}")
@@ -52,45 +63,39 @@ async def get_bot_kline(bot_id, timeframe='15m', limit=100):
 # ================= 主引擎循环 =================
 
 async def bot_engine_loop():
-    print(">>> 启动高性能 Async 策略引擎 (Modularized)...")
+    print(">>> 启动高性能 Async 策略引擎 (Event-Driven Scheduler)...")
     await db.init_pool() 
     
-    # 启动 WebSocket
-    await stream_manager.start(source='binance')
+    # 启动行情流中心 (各交易所/市场的连接随机器人注册表按需建立)
+    await stream_manager.start()
+    # 市场元数据后台刷新 (已有磁盘快照的市场重启后立即可用)
+    await markets_meta.start()
     
-    while True:
-        try:
-            all_bots = await db.get_all_bots_for_engine()
-            
-            if all_bots:
-                # 动态管理 WebSocket 订阅
-                target_symbols = set()
-                current_ws_source = stream_manager.current_source
-                
-                for bot in all_bots:
-                    bot_source = bot.get('exchange_source', 'binance')
-                    if bot.get('symbol') and bot_source == current_ws_source:
-                        target_symbols.add(bot['symbol'])
-                
-                stream_manager.update_symbols(target_symbols)
-                
-                # 并发执行所有机器人逻辑
-                tasks = []
-                for bot in all_bots:
-                    task = asyncio.wait_for(run_bot_logic(bot), timeout=8.0)
-                    tasks.append(task)
-                
-                # 等待执行结果
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                for i, res in enumerate(results):
-                    if isinstance(res, Exception) and not isinstance(res, asyncio.TimeoutError):
-                        print(f"❌ Bot {all_bots[i]['id']} Error: {res}")
-            else:
-                stream_manager.update_symbols(set())
-                await asyncio.sleep(2)
-            
-            await asyncio.sleep(1)
-        except Exception as e:
-            print(f"Engine Loop Error: {e}")
-            await asyncio.sleep(5)
\ No newline at end of file
+    if ENGINE_CONFIG['workers'] > 0:
+        # 分片模式: 策略计算分布到多个 Worker 进程，Web 进程只负责行情与协调
+        await engine_coordinator.start()
+    else:
+        # 单进程模式: 加载注册表并开始调度 (WS 订阅由调度器随注册表变化自动维护)
+        await bot_scheduler.start()
+
+async def stop_engine():
+    await bot_scheduler.stop()
+    await engine_coordinator.stop()
+
+def get_engine_stats():
+    stats = {
+        'mode': 'sharded' if engine_coordinator.running else 'single',
+        'scheduler': bot_scheduler.get_stats(),
+        'state_cache': bot_state_cache.get_stats(),
+        'db_writer': db.writer.get_stats(),
+        'indicators': indicator_book.get_stats(),
+        'klines': kline_store.get_stats(),
+        'streams': stream_manager.get_stats(),
+        'pionex_tickers': pionex_tickers.get_stats(),
+        'rate_limit': rate_limiter.get_stats(),
+        'markets': markets_meta.get_stats(),
+        'portfolio': portfolio.get_stats(),
+    }
+    if engine_coordinator.running:
+        stats['shards'] = engine_coordinator.get_stats()
+    return stats
@@ -3,6 +3,7 @@ import pandas as pd
 import asyncio
 import io
 from datetime import datetime
+from modules.rate_limiter import rate_limiter, PRIORITY_BULK
 
 async def download_history_kline(symbol, timeframe, start_str, end_str=None, source='binance', proxy_port=0, market_type='spot'):
     """
@@ -28,7 +29,8 @@ async def download_history_kline(symbol, timeframe, start_str, end_str=None, sou
             'https': f'http://127.0.0.1:{proxy_port}'
         }
     
-    exchange = exchange_class(args)
+    # 共享限流: 批量下载排在机器人行情请求之后
+    exchange = rate_limiter.attach(exchange_class(args), (source, 'spot' if market_type == 'spot' else 'future'), PRIORITY_BULK)
     
     try:
         # 解析时间
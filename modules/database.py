@@ -1,12 +1,342 @@
 import aiomysql
-import json
+import time
 import asyncio
 from config import DB_CONFIG
+from modules import json_codec
+
+# ================= 机器人状态拆分 (热字段 / 挂单 / 冷数据) =================
+# 代码里的 state 字典结构不变，落库时拆成三部分:
+# - 热字段 (持仓、均价、余额、阶段等，几乎每次写都会变) -> bot_runtime 表的定长列
+# - 挂单列表 orders -> bot_orders 表 (按 bot_id 索引，通常只追加新单或整体清空)
+# - 其余不常变化的字段 -> bots.state_json，内容未变化时不重写
+# 读取时合并回原结构；还没有 bot_runtime 行的旧数据直接使用 state_json (第一次写入时自动迁移)
+# 类型不符合列定义的值 (None、字符串数字等) 留在 state_json 中；浮点列的整数值写入前统一转成 float
+# (DOUBLE 列读回的就是 float，与 json_codec.decode_state 对同名字段的规整一致，跳过未变化写入的比较也不会因 0 / 0.0 误判)
+
+RUNTIME_FIELDS = (
+    ('position_amt', float), ('avg_price', float), ('total_cost', float), ('balance', float),
+    ('stage', str), ('direction', str), ('last_level_idx', int), ('current_so_index', int),
+    ('is_trailing_active', bool), ('highest_price_seen', float), ('lowest_price_seen', float),
+    ('stop_loss_price', float), ('extreme_price', float),
+)
+ORDER_FIELDS = ('level_idx', 'price', 'amount', 'cost', 'time')
+
+RUNTIME_SELECT = ", ".join(["r.bot_id AS rt_bot_id"] + [f"r.{name} AS rt_{name}" for name, _ in RUNTIME_FIELDS])
+RUNTIME_UPSERT = (
+    "INSERT INTO bot_runtime (bot_id, " + ", ".join(name for name, _ in RUNTIME_FIELDS) + ") VALUES ("
+    + ", ".join(["%s"] * (len(RUNTIME_FIELDS) + 1)) + ") ON DUPLICATE KEY UPDATE "
+    + ", ".join(f"{name} = VALUES({name})" for name, _ in RUNTIME_FIELDS)
+)
+
+def _fits(value, typ):
+    if isinstance(value, bool) or value is None:
+        return typ is bool and value is not None
+    if typ is float: return isinstance(value, (int, float))
+    if typ is int: return isinstance(value, int)
+    if typ is str: return isinstance(value, str) and len(value) <= 20
+    return False
+
+def split_state(state):
+    """ state -> (冷数据 JSON, 热字段元组, 挂单元组) """
+    cold = dict(state)
+    hot = []
+    for name, typ in RUNTIME_FIELDS:
+        value = cold.get(name)
+        if name in cold and _fits(value, typ):
+            hot.append(float(value) if typ is float else value)
+            del cold[name]
+        else:
+            hot.append(None)
+
+    orders = ()
+    raw = cold.get('orders')
+    if isinstance(raw, list):
+        try:
+            if all(isinstance(o, dict) and set(o) == set(ORDER_FIELDS) for o in raw):
+                orders = tuple((int(o['level_idx']), float(o['price']), float(o['amount']), float(o['cost']), float(o['time'])) for o in raw)
+                del cold['orders']
+        except (TypeError, ValueError):
+            orders = ()
+    return json_codec.dumps(cold), tuple(hot), orders
+
+def merge_state(row, orders_by_bot):
+    """ 把 bot_runtime 列 (rt_*) 与 bot_orders 合并回 row['state']，并移除辅助列 """
+    state = json_codec.decode_state(row.get('state_json'), row.get('strategy_type'))
+    has_runtime = row.get('rt_bot_id') is not None
+    for name, typ in RUNTIME_FIELDS:
+        value = row.pop(f"rt_{name}", None)
+        if has_runtime and value is not None:
+            state[name] = bool(value) if typ is bool else typ(value)
+    row.pop('rt_bot_id', None)
+    if has_runtime and 'orders' not in state:
+        state['orders'] = [dict(zip(ORDER_FIELDS, o)) for o in orders_by_bot.get(row['id'], ())]
+    return state
+
+# ================= 交易日志类型 =================
+# trade_logs.action 是按用户语言翻译后的文字，不适合做统计条件；写入时同时记录结构化的 kind:
+# open 开仓首单 / add 加仓 (补仓、网格、定投、手动加仓) / close 平仓 / deposit 入金 / info 提示类日志
+# 调用方知道类型时直接传入，未传时按 action 文字推断 (规则与 db.sql 中旧数据迁移的 UPDATE 一致)
+
+LOG_KINDS = ('open', 'add', 'close', 'deposit', 'info')
+
+_DEPOSIT_WORDS = ('deposit', '充值', '儲值')
+_CLOSE_WORDS = ('平仓', '平倉', 'close', 'sell', '卖出', '賣出', 'stop loss', 'take profit', 'trailing hit', 'trailing profit', '追踪止盈', '追蹤止盈')
+_OPEN_WORDS = ('首单', '首單', 'base')
+
+def classify_log(action, amount=0, profit=0):
+    text = (action or "").lower()
+    if profit: return 'close'
+    if any(w in text for w in _DEPOSIT_WORDS): return 'deposit'
+    if not amount: return 'info'
+    if any(w in text for w in _CLOSE_WORDS): return 'close'
+    if any(w in text for w in _OPEN_WORDS): return 'open'
+    return 'add'
+
+def ends_round(action, profit):
+    """ 回合分界: 与原来 get_bot_rounds 的规则一致 (有已实现盈亏，或盈亏为 0 的手动/全部平仓)，不按 kind 判断，
+    以免 0 盈亏的普通卖出改变已有机器人的回合划分 """
+    if float(profit or 0) != 0: return True
+    text = (action or "").lower()
+    return ('sell' in text or 'close' in text or '平仓' in text) and ('all' in text or 'manual' in text)
+
+def log_row(bot_id, action, price, amount, profit=0, fee=0, note="", kind=None):
+    """ 规整为 trade_logs 行 (bot_id, action, price, amount, profit, fee, note, kind) """
+    if note and len(note) > 250: note = note[:247] + "..."
+    amount = round(float(amount), 8)
+    profit = round(float(profit), 8)
+    fee = round(float(fee), 8)
+    if kind not in LOG_KINDS: kind = classify_log(action, amount, profit)
+    return (int(bot_id), action, price, amount, profit, fee, note, kind)
+
+async def insert_logs(cursor, rows):
+    """ 多行 INSERT 写入 trade_logs """
+    sql = (
+        "INSERT INTO trade_logs (bot_id, action, price, amount, profit, fee, note, kind) VALUES "
+        + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+    )
+    await cursor.execute(sql, [v for row in rows for v in row])
+
+# ================= 写后队列 (Write-Behind) =================
+# 引擎每个 tick 的状态落库和回测的每笔成交日志不再各占一个连接执行一条 SQL:
+# 1. 同一机器人在一个刷新窗口内的多次状态更新合并为一次 UPDATE
+# 2. 交易日志攒批，用多行 INSERT 一次写入
+# 3. 队列有上限，写满时调用方等待 (背压)；退出时 db.close() 会先清空队列
+
+class WriteBehindQueue:
+    def __init__(self, manager, flush_interval=0.2, batch_size=500, max_pending=5000):
+        self.manager = manager
+        self.flush_interval = flush_interval  # 刷新窗口 (秒)
+        self.batch_size = batch_size          # 单条多行 INSERT 的最大行数，积压超过该值立即刷新
+        self.max_pending = max_pending        # 队列上限 (待写状态数 + 待写日志数)
+
+        self.states = {}          # bot_id -> 合并后的待写状态
+        self.logs = []            # [(bot_id, action, price, amount, profit, fee, note, kind)]
+        self.log_counts = {}      # bot_id -> self.logs 中该机器人的待写日志数 (has_pending 不用扫描整个列表)
+        self.on_conflict = None   # 版本冲突回调 (状态缓存据此丢弃本地行)
+        self.running = False
+        self.task = None
+        self._wake = None
+        self._room = None
+        self._flush_lock = None
+
+        # 统计
+        self.coalesced = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.backpressure_waits = 0
+        self.conflicts = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._flush_ms_sum = 0.0
+
+    @property
+    def depth(self):
+        return len(self.states) + len(self.logs)
+
+    def has_pending(self, bot_id):
+        bot_id = int(bot_id)
+        return bot_id in self.states or bot_id in self.log_counts
+
+    def start(self):
+        if self.running: return
+        self._wake = asyncio.Event()
+        self._room = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.running = True
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """ 停止后台任务并把剩余数据全部写入 """
+        if not self.running: return
+        self.running = False
+        self._wake.set()
+        if self.task:
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    # ---------- 入队 ----------
+
+    async def _wait_for_room(self):
+        while self.running and self.depth >= self.max_pending:
+            self.backpressure_waits += 1
+            self._room.clear()
+            self._wake.set()
+            await self._room.wait()
+
+    def _after_enqueue(self):
+        depth = self.depth
+        if depth > self.max_depth: self.max_depth = depth
+        if depth >= self.batch_size: self._wake.set()
+
+    async def put_state(self, bot_id, parts, balance, profit, status_msg, expected_version, logs=()):
+        bot_id = int(bot_id)
+        pending = self.states.get(bot_id)
+        if pending is None:
+            await self._wait_for_room()
+            pending = self.states.get(bot_id)
+
+        if pending is not None:
+            # 合并: 保留第一次的期望版本，累计版本步数；status_msg 为 None 表示不修改，沿用之前的值
+            self.coalesced += 1
+            pending['parts'] = parts
+            pending['balance'] = balance
+            pending['profit'] = profit
+            if status_msg is not None: pending['status_msg'] = status_msg
+            pending['steps'] += 1
+            pending['logs'].extend(logs)
+        else:
+            self.states[bot_id] = {
+                'parts': parts, 'balance': balance, 'profit': profit,
+                'status_msg': status_msg, 'expected_version': expected_version, 'steps': 1,
+                'logs': list(logs),
+            }
+        self._after_enqueue()
+
+    async def put_log(self, row):
+        await self._wait_for_room()
+        self.logs.append(row)
+        self.log_counts[row[0]] = self.log_counts.get(row[0], 0) + 1
+        self._after_enqueue()
+
+    # ---------- 刷新 ----------
+
+    async def _loop(self):
+        while self.running:
+            try:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Write-Behind Loop Error: {e}")
+                await asyncio.sleep(1)
+
+    async def flush(self):
+        if self._flush_lock is None:
+            await self._flush_once()
+            return
+        async with self._flush_lock:
+            await self._flush_once()
+
+    async def _flush_once(self):
+        if not self.states and not self.logs: return
+        states, self.states = self.states, {}
+        logs, self.logs = self.logs, []
+        self.log_counts = {}
+        started = time.time()
+        conflicted = []
+        closed = {row[0] for row in logs if ends_round(row[1], row[4])}
+        written_closed = set()    # 随状态同一事务写入的平仓日志 (已提交，出错时仍需物化)
+        try:
+            async with self.manager.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for bot_id in list(states.keys()):
+                        item = states[bot_id]
+                        ok = await self.manager._write_state_tx(
+                            conn, cursor, bot_id, item['parts'], item['balance'], item['profit'],
+                            item['status_msg'], item['steps'], item['expected_version'], item['logs']
+                        )
+                        if not ok: conflicted.append(bot_id)
+                        elif any(ends_round(row[1], row[4]) for row in item['logs']): written_closed.add(bot_id)
+                        # 已写入的立即移除，出错重试时不会重复写
+                        del states[bot_id]
+                        self.rows_written += 1 + (len(item['logs']) if ok else 0)
+
+                    while logs:
+                        chunk = logs[:self.batch_size]
+                        await insert_logs(cursor, chunk)
+                        self.rows_written += len(chunk)
+                        logs = logs[self.batch_size:]
+        except Exception as e:
+            self.errors += 1
+            closed = set()
+            print(f"Write-Behind Flush Error: {e}")
+            # 失败的数据放回队列等待下次重试
+            for bot_id, item in states.items():
+                newer = self.states.get(bot_id)
+                if newer is None:
+                    self.states[bot_id] = item
+                    continue
+                # 期间又有新的状态入队: 内容以较新的为准，期望版本取失败批次的 (库里仍是这个版本)，版本步数与日志累加
+                newer['expected_version'] = item['expected_version']
+                newer['steps'] += item['steps']
+                newer['logs'][:0] = item['logs']
+                if newer['status_msg'] is None: newer['status_msg'] = item['status_msg']
+            self.logs = logs + self.logs
+            for row in logs:
+                self.log_counts[row[0]] = self.log_counts.get(row[0], 0) + 1
+        finally:
+            elapsed_ms = (time.time() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = round(elapsed_ms, 2)
+            self._flush_ms_sum += elapsed_ms
+            if elapsed_ms > self.max_flush_ms: self.max_flush_ms = round(elapsed_ms, 2)
+            if self._room is not None and self.depth < self.max_pending:
+                self._room.set()
+
+        for bot_id in conflicted:
+            self.conflicts += 1
+            if self.on_conflict: self.on_conflict(bot_id)
+
+        # 有平仓日志的机器人物化新结束的回合
+        closed |= written_closed
+        if closed:
+            await self.manager.sync_rounds(closed)
+
+    def get_stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'pending_states': len(self.states),
+            'pending_logs': len(self.logs),
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'flush_ms_last': self.last_flush_ms,
+            'flush_ms_avg': round(self._flush_ms_sum / max(1, self.flushes), 2),
+            'flush_ms_max': self.max_flush_ms,
+            'backpressure_waits': self.backpressure_waits,
+            'conflicts': self.conflicts,
+            'errors': self.errors,
+        }
 
 class DatabaseManager:
     def __init__(self):
         self.cfg = DB_CONFIG
         self.pool = None
+        self.lock_pool = None     # 跨进程机器人锁专用 (GET_LOCK 需要在整个执行期间占用一个连接)
+        self.writer = WriteBehindQueue(self)
+        # 本进程最后一次写入的 (版本号, 冷数据, 热字段, 挂单)：版本号连续时只写变化的部分
+        self.written = {}
 
     async def init_pool(self):
         """ 初始化连接池 (必须在异步循环中调用) """
@@ -23,16 +353,51 @@ class DatabaseManager:
                 minsize=5,
                 maxsize=100,  # 异步池可以开大一点
             )
+            self.writer.start()
 
     async def close(self):
         if self.pool:
+            # 先把写后队列中的状态和日志全部落库
+            await self.writer.stop()
             self.pool.close()
             await self.pool.wait_closed()
+        if self.lock_pool:
+            self.lock_pool.close()
+            await self.lock_pool.wait_closed()
+            self.lock_pool = None
+
+    async def flush_writes(self):
+        """ 立即写入写后队列中的全部数据 """
+        await self.writer.flush()
 
-    async def get_connection(self):
-        if not self.pool:
-            await self.init_pool()
-        return await self.pool.acquire()
+    async def flush_bot(self, bot_id):
+        """ 读取/直接修改某个机器人之前，先写入它在队列中的数据，保证读到最新 """
+        if self.writer.has_pending(bot_id):
+            await self.writer.flush()
+
+    async def get_lock_connection(self):
+        """
+        取一个锁专用连接 (用完调用 release_lock_connection)
+        持锁期间机器人逻辑还要从业务连接池取连接；锁连接如果也来自业务池，
+        同时持锁的机器人达到池上限时所有持锁者都在等彼此占用的连接 (死锁)，因此单独建池
+        """
+        if self.lock_pool is None:
+            self.lock_pool = await aiomysql.create_pool(
+                host=self.cfg['host'],
+                port=self.cfg['port'],
+                user=self.cfg['user'],
+                password=self.cfg['password'],
+                db=self.cfg['db'],
+                charset=self.cfg['charset'],
+                cursorclass=aiomysql.DictCursor,
+                autocommit=True,
+                minsize=1,
+                maxsize=self.cfg['lock_pool_size'],
+            )
+        return await self.lock_pool.acquire()
+
+    def release_lock_connection(self, conn):
+        self.lock_pool.release(conn)
 
     # --- 用户管理 ---
     async def create_user(self, username, password_hash, language='zh-CN'):
@@ -109,8 +474,8 @@ class DatabaseManager:
                     INSERT INTO bots (user_id, name, symbol, strategy_type, config_json, state_json, total_balance, mode)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 """
-                cfg_str = json.dumps(initial_config)
-                state_str = json.dumps(initial_state)
+                cfg_str = json_codec.dumps(initial_config)
+                state_str = json_codec.dumps(initial_state)
                 balance = round(float(initial_state.get('balance', 0)), 8)
                 # 参数列表增加 mode
                 await cursor.execute(sql, (user_id, name, symbol, strategy_type, cfg_str, state_str, balance, mode))
@@ -121,36 +486,44 @@ class DatabaseManager:
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 # 增加 WHERE mode = %s
-                sql = "SELECT id, name, symbol, strategy_type, is_running, status_msg, current_profit, total_balance, state_json, config_json, folder_id FROM bots WHERE user_id = %s AND mode = %s"
+                sql = f"""
+                    SELECT b.id, b.name, b.symbol, b.strategy_type, b.is_running, b.status_msg, b.current_profit, b.total_balance,
+                           b.state_json, b.config_json, b.folder_id, {RUNTIME_SELECT}
+                    FROM bots b LEFT JOIN bot_runtime r ON r.bot_id = b.id
+                    WHERE b.user_id = %s AND b.mode = %s
+                """
                 await cursor.execute(sql, (user_id, mode))
                 rows = await cursor.fetchall()
+                await self._merge_rows(cursor, rows)
                 
                 for row in rows:
-                    row['state'] = json.loads(row['state_json']) if row.get('state_json') else {}
-                    row['config'] = json.loads(row['config_json']) if row.get('config_json') else {}
+                    row['config'] = json_codec.loads(row['config_json']) if row.get('config_json') else {}
                     if 'state_json' in row: del row['state_json']
                     if 'config_json' in row: del row['config_json']
                 return rows
 
     async def get_bot_full_data(self, bot_id):
         if not self.pool: await self.init_pool()
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 # [修改] SQL 查询增加了 binance_api_key, binance_api_secret
-                sql = """
+                sql = f"""
                     SELECT b.*, u.language, u.exchange_source, 
                            u.api_key, u.api_secret,
-                           u.binance_api_key, u.binance_api_secret
+                           u.binance_api_key, u.binance_api_secret,
+                           {RUNTIME_SELECT}
                     FROM bots b 
                     JOIN users u ON b.user_id = u.id 
+                    LEFT JOIN bot_runtime r ON r.bot_id = b.id
                     WHERE b.id = %s
                 """
                 await cursor.execute(sql, (bot_id,))
                 result = await cursor.fetchone()
                 
                 if result:
-                    result['config'] = json.loads(result['config_json']) if result['config_json'] else {}
-                    result['state'] = json.loads(result['state_json']) if result['state_json'] else {}
+                    result['config'] = json_codec.loads(result['config_json']) if result['config_json'] else {}
+                    await self._merge_rows(cursor, [result])
                     if 'language' not in result or not result['language']:
                         result['language'] = 'zh-CN'
                     
@@ -168,42 +541,149 @@ class DatabaseManager:
                     if 'state_json' in result: del result['state_json']
                 return result
 
-    async def update_bot_state(self, bot_id, new_state, status_msg=None, profit=0):
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                state_str = json.dumps(new_state)
+    @staticmethod
+    def clip_status(status_msg):
+        """ status_msg 字段 VARCHAR(255)，超长截断 """
+        if status_msg and len(status_msg) > 250:
+            return status_msg[:247] + "..."
+        return status_msg
 
-                balance = round(float(new_state.get('balance', 0)), 8) # [修复] 强制8位精度
-                profit = round(float(profit), 8)
-                
-                if status_msg and len(status_msg) > 250:
-                    status_msg = status_msg[:247] + "..."
+    @staticmethod
+    def _version_clause(sql, params, expected_version):
+        """
+        [新增] 乐观锁: 每次写 bots 都递增 state_version；
+        传入 expected_version 时只有版本一致才写入 (返回 False 表示被其他写入方抢先)
+        """
+        sql += " WHERE id = %s"
+        if expected_version is not None:
+            sql += " AND state_version = %s"
+            params.append(expected_version)
+        return sql, params
+
+    async def _write_state(self, cursor, bot_id, parts, balance, profit, status_msg, steps, expected_version):
+        """ 写入拆分后的状态，返回 False 表示版本冲突 (未写入任何内容) """
+        cold_str, hot, orders = parts
+        prev = self.written.pop(bot_id, None)
+        if prev is not None and (expected_version is None or prev[0] != expected_version):
+            prev = None
+
+        sets, params = [], []
+        if prev is None or prev[1] != cold_str:
+            sets.append("state_json = %s")
+            params.append(cold_str)
+        sets += ["total_balance = %s", "current_profit = %s"]
+        params += [balance, profit]
+        if status_msg is not None:
+            sets.append("status_msg = %s")
+            params.append(status_msg)
+        sets.append("state_version = state_version + %s")
+        params += [steps, bot_id]
+        sql, params = self._version_clause("UPDATE bots SET " + ", ".join(sets), params, expected_version)
+        await cursor.execute(sql, params)
+        if cursor.rowcount <= 0:
+            return False
+
+        if prev is None or prev[2] != hot:
+            await cursor.execute(RUNTIME_UPSERT, (bot_id, *hot))
+
+        if prev is None or prev[3] != orders:
+            old = prev[3] if prev is not None else None
+            if old is not None and orders[:len(old)] == old:
+                new_orders = orders[len(old):]
+            else:
+                await cursor.execute("DELETE FROM bot_orders WHERE bot_id = %s", (bot_id,))
+                new_orders = orders
+            if new_orders:
+                sql = (
+                    "INSERT INTO bot_orders (bot_id, level_idx, price, amount, cost, order_time) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(new_orders))
+                )
+                await cursor.execute(sql, [v for o in new_orders for v in (bot_id, *o)])
+
+        if expected_version is not None:
+            self.written[bot_id] = (int(expected_version) + steps, cold_str, hot, orders)
+        return True
+
+    async def _write_state_tx(self, conn, cursor, bot_id, parts, balance, profit, status_msg, steps, expected_version, logs=()):
+        """ bots / bot_runtime / bot_orders 在同一事务内写入；logs 为随本次状态产生的成交日志，只在版本校验通过时一并写入 """
+        await conn.begin()
+        try:
+            ok = await self._write_state(cursor, bot_id, parts, balance, profit, status_msg, steps, expected_version)
+            if ok and logs:
+                await insert_logs(cursor, logs)
+            await conn.commit()
+            return ok
+        except Exception:
+            self.written.pop(bot_id, None)
+            await conn.rollback()
+            raise
+
+    def _bump_written(self, bot_id, expected_version, ok):
+        """ 其他字段 (配置/运行开关) 的写入也会递增版本号，同步记录，避免下次状态写入退化为全量写 """
+        prev = self.written.pop(int(bot_id), None)
+        if ok and prev is not None and expected_version is not None and prev[0] == expected_version:
+            self.written[int(bot_id)] = (prev[0] + 1, *prev[1:])
+
+    async def _load_orders(self, cursor, bot_ids):
+        """ bot_id -> [(level_idx, price, amount, cost, time), ...] """
+        orders = {}
+        bot_ids = list(bot_ids)
+        for start in range(0, len(bot_ids), 1000):
+            chunk = bot_ids[start:start + 1000]
+            sql = (
+                "SELECT bot_id, level_idx, price, amount, cost, order_time FROM bot_orders WHERE bot_id IN ("
+                + ", ".join(["%s"] * len(chunk)) + ") ORDER BY bot_id, id"
+            )
+            await cursor.execute(sql, chunk)
+            for r in await cursor.fetchall():
+                orders.setdefault(r['bot_id'], []).append((r['level_idx'], r['price'], r['amount'], r['cost'], r['order_time']))
+        return orders
+
+    async def _merge_rows(self, cursor, rows):
+        """ 批量把 bot_runtime / bot_orders 合并回各行的 state """
+        orders = await self._load_orders(cursor, [r['id'] for r in rows if r.get('rt_bot_id') is not None])
+        for row in rows:
+            row['state'] = merge_state(row, orders)
+
+    async def update_bot_state(self, bot_id, new_state, status_msg=None, profit=0, expected_version=None, logs=()):
+        parts = split_state(new_state)
+        balance = round(float(new_state.get('balance', 0)), 8) # [修复] 强制8位精度
+        profit = round(float(profit), 8)
+        status_msg = self.clip_status(status_msg)
+
+        if self.writer.running:
+            # 写后队列: 版本冲突在刷新时通过 writer.on_conflict 回调通知
+            await self.writer.put_state(bot_id, parts, balance, profit, status_msg, expected_version, logs)
+            return True
 
-                if status_msg is None:
-                    sql = "UPDATE bots SET state_json = %s, total_balance = %s, current_profit = %s WHERE id = %s"
-                    params = [state_str, balance, profit, bot_id]
-                else:
-                    sql = "UPDATE bots SET state_json = %s, total_balance = %s, current_profit = %s, status_msg = %s WHERE id = %s"
-                    params = [state_str, balance, profit, status_msg, bot_id]
-                await cursor.execute(sql, params)
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                ok = await self._write_state_tx(conn, cursor, int(bot_id), parts, balance, profit, status_msg, 1, expected_version, logs)
+        if ok and any(ends_round(row[1], row[4]) for row in logs):
+            await self.sync_rounds([int(bot_id)])
+        return ok
 
-    async def update_bot_config(self, bot_id, new_config):
+    async def update_bot_config(self, bot_id, new_config, expected_version=None):
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                cfg_str = json.dumps(new_config)
-                sql = "UPDATE bots SET config_json = %s WHERE id = %s"
-                await cursor.execute(sql, (cfg_str, bot_id))
+                cfg_str = json_codec.dumps(new_config)
+                sql = "UPDATE bots SET config_json = %s, state_version = state_version + 1"
+                sql, params = self._version_clause(sql, [cfg_str, bot_id], expected_version)
+                await cursor.execute(sql, params)
+                self._bump_written(bot_id, expected_version, cursor.rowcount > 0)
+                return cursor.rowcount > 0
 
     async def get_all_running_bots(self):
         if not self.pool: await self.init_pool()
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                sql = "SELECT * FROM bots WHERE is_running = 1"
+                sql = f"SELECT b.*, {RUNTIME_SELECT} FROM bots b LEFT JOIN bot_runtime r ON r.bot_id = b.id WHERE b.is_running = 1"
                 await cursor.execute(sql)
                 rows = await cursor.fetchall()
+                await self._merge_rows(cursor, rows)
                 for row in rows:
-                    row['config'] = json.loads(row['config_json']) if row['config_json'] else {}
-                    row['state'] = json.loads(row['state_json']) if row['state_json'] else {}
+                    row['config'] = json_codec.loads(row['config_json']) if row['config_json'] else {}
                 return rows
 
     async def get_all_bots_for_engine(self):
@@ -211,18 +691,20 @@ class DatabaseManager:
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 # [修改] 同样读取 binance keys
-                sql = """
+                sql = f"""
                     SELECT b.*, u.language, u.exchange_source, 
                            u.api_key, u.api_secret,
-                           u.binance_api_key, u.binance_api_secret
+                           u.binance_api_key, u.binance_api_secret,
+                           {RUNTIME_SELECT}
                     FROM bots b 
                     JOIN users u ON b.user_id = u.id
+                    LEFT JOIN bot_runtime r ON r.bot_id = b.id
                 """
                 await cursor.execute(sql)
                 rows = await cursor.fetchall()
+                await self._merge_rows(cursor, rows)
                 for row in rows:
-                    row['config'] = json.loads(row['config_json']) if row['config_json'] else {}
-                    row['state'] = json.loads(row['state_json']) if row['state_json'] else {}
+                    row['config'] = json_codec.loads(row['config_json']) if row['config_json'] else {}
                     if not row.get('exchange_source'): row['exchange_source'] = 'binance'
                     
                     # === [核心逻辑新增] ===
@@ -232,168 +714,238 @@ class DatabaseManager:
                     # ====================
                 return rows
 
-    async def toggle_bot_status(self, bot_id, is_running, status_msg=None):
+    async def toggle_bot_status(self, bot_id, is_running, status_msg=None, expected_version=None):
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 # 如果没传 msg，给个默认兜底（防止报错）
                 if status_msg is None:
                     status_msg = "🟡 Starting..." if is_running else "🛑 Stopped"
                 
-                sql = "UPDATE bots SET is_running = %s, status_msg = %s WHERE id = %s"
+                sql = "UPDATE bots SET is_running = %s, status_msg = %s, state_version = state_version + 1"
                 val = 1 if is_running else 0
-                await cursor.execute(sql, (val, status_msg, bot_id))
+                sql, params = self._version_clause(sql, [val, status_msg, bot_id], expected_version)
+                await cursor.execute(sql, params)
+                self._bump_written(bot_id, expected_version, cursor.rowcount > 0)
+                return cursor.rowcount > 0
 
     async def delete_bot(self, bot_id):
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 await cursor.execute("DELETE FROM trade_logs WHERE bot_id = %s", (bot_id,))
+                await cursor.execute("DELETE FROM trade_rounds WHERE bot_id = %s", (bot_id,))
+                await cursor.execute("DELETE FROM bot_orders WHERE bot_id = %s", (bot_id,))
+                await cursor.execute("DELETE FROM bot_runtime WHERE bot_id = %s", (bot_id,))
                 await cursor.execute("DELETE FROM bots WHERE id = %s", (bot_id,))
+        self.written.pop(int(bot_id), None)
 
     # --- 日志管理 ---
 
-    async def add_log(self, bot_id, action, price, amount, profit=0, fee=0, note=""):
+    async def add_log(self, bot_id, action, price, amount, profit=0, fee=0, note="", kind=None):
+        row = log_row(bot_id, action, price, amount, profit, fee, note, kind)
+
+        if self.writer.running:
+            # 写后队列: 攒批后多行 INSERT
+            await self.writer.put_log(row)
+            return
+
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                if note and len(note) > 250: note = note[:247] + "..."
-
-                amount = round(float(amount), 8)
-                profit = round(float(profit), 8)
-                fee = round(float(fee), 8)
+                await insert_logs(cursor, [row])
+        if ends_round(action, row[4]):
+            await self.sync_rounds([int(bot_id)])
 
-                # SQL 中增加 fee 字段
-                sql = """
-                    INSERT INTO trade_logs (bot_id, action, price, amount, profit, fee, note)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                await cursor.execute(sql, (bot_id, action, price, amount, profit, fee, note))
+    async def replace_trade_logs(self, bot_id, rows, chunk_size=1000):
+        """
+        [新增] 回测结果一次性写入: 同一事务内清空该机器人的日志并批量插入
+        rows: [(log_time 秒级时间戳, action, price, amount, profit, fee, note, kind), ...]
+        """
+        if not self.pool: await self.init_pool()
+        await self.flush_bot(bot_id)
+        async with self.pool.acquire() as conn:
+            await conn.begin()
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("DELETE FROM trade_logs WHERE bot_id = %s", (bot_id,))
+                    await cursor.execute("DELETE FROM trade_rounds WHERE bot_id = %s", (bot_id,))
+                    for start in range(0, len(rows), chunk_size):
+                        chunk = rows[start:start + chunk_size]
+                        sql = (
+                            "INSERT INTO trade_logs (bot_id, log_time, action, price, amount, profit, fee, note, kind) VALUES "
+                            + ", ".join(["(%s, FROM_UNIXTIME(%s), %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+                        )
+                        params = []
+                        for row in chunk:
+                            params.append(bot_id)
+                            params.extend(row)
+                        await cursor.execute(sql, params)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
 
     async def get_logs(self, bot_id, limit=50):
         if not self.pool: await self.init_pool()
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                sql = "SELECT log_time, action, price, amount, profit, note FROM trade_logs WHERE bot_id = %s ORDER BY log_time DESC LIMIT %s"
+                # 按 (bot_id, id) 索引倒序取最近几条 (id 与写入顺序一致)
+                sql = "SELECT log_time, action, price, amount, profit, note, kind FROM trade_logs WHERE bot_id = %s ORDER BY id DESC LIMIT %s"
                 await cursor.execute(sql, (bot_id, limit))
                 return await cursor.fetchall()
             
-    async def get_bot_rounds(self, bot_id):
+    # --- 交易回合 (trade_rounds 物化) ---
+    # 已结束的回合按 (bot_id, round_no) 存入 trade_rounds，只记录汇总和它覆盖的日志 id 区间;
+    # 每次只处理上一个已结束回合之后的新日志 (按 (bot_id, id) 索引范围读取)，
+    # 遇到回合结束的日志 (见 ends_round) 即把这一段写成新回合，剩余部分就是进行中的回合。
+    # 写后队列刷新出平仓日志时立即物化；读取时也会先补齐 (旧数据首次读取时一次性物化)。
+    # 多个进程同时物化同一段日志得到的行完全相同，INSERT IGNORE 即可
+
+    async def _sync_rounds(self, cursor, bot_id):
+        """ 物化该机器人新结束的回合，返回进行中回合的日志 (按 id 升序) """
+        await cursor.execute(
+            "SELECT round_no, last_log_id FROM trade_rounds WHERE bot_id = %s ORDER BY round_no DESC LIMIT 1", (bot_id,)
+        )
+        last = await cursor.fetchone()
+        round_no = last['round_no'] if last else 0
+        await cursor.execute(
+            "SELECT id, log_time, action, price, amount, profit, fee, note, kind FROM trade_logs "
+            "WHERE bot_id = %s AND id > %s ORDER BY id ASC", (bot_id, last['last_log_id'] if last else 0)
+        )
+        logs = await cursor.fetchall()
+
+        finished = []
+        pending = []
+        for log in logs:
+            pending.append(log)
+            if ends_round(log['action'], log['profit']):
+                round_no += 1
+                finished.append((
+                    bot_id, round_no, pending[0]['id'], log['id'], pending[0]['log_time'], log['log_time'],
+                    sum(float(x['profit'] or 0) for x in pending), sum(float(x['fee'] or 0) for x in pending), len(pending)
+                ))
+                pending = []
+        if finished:
+            sql = (
+                "INSERT IGNORE INTO trade_rounds (bot_id, round_no, first_log_id, last_log_id, start_time, end_time, profit, fees, trades) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(finished))
+            )
+            await cursor.execute(sql, [v for row in finished for v in row])
+        return pending
+
+    async def sync_rounds(self, bot_ids):
+        """ 写后队列刷新出平仓日志后调用 (失败不影响日志本身，下次读取时会补齐) """
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for bot_id in bot_ids:
+                        await self._sync_rounds(cursor, bot_id)
+        except Exception as e:
+            print(f"⚠️ [Rounds] 物化失败: {e}")
+
+    @staticmethod
+    def _round_dict(round_no, start_time, end_time, profit, fees, trades, running=False):
+        for log in trades:
+            log.pop('id', None)
+            if log.get('log_time'): log['log_time'] = str(log['log_time'])
+        # 净利润 = 毛利 - 手续费，胜负按净利润判断
+        net_profit = profit - fees
+        return {
+            'round_id': round_no,
+            'start_time': str(start_time) if start_time else None,
+            'end_time': "running" if running else str(end_time),
+            'profit': 0 if running else profit,
+            'net_profit': net_profit,
+            'total_fees': fees,
+            'trades': trades[::-1],
+            'result': 'running' if running else ('win' if net_profit > 0 else ('loss' if net_profit < 0 else 'break_even'))
+        }
+
+    async def get_bot_rounds(self, bot_id, before=None, limit=50):
         """
-        [新增] 获取按回合分组的交易记录
-        [优化] 自动计算净利润 (扣除手续费) 并据此判断 win/loss
+        获取按回合分组的交易记录 (新的在前)
+        游标分页: before 为上一页最小的 round_id，不传时返回最新一页并在最前面附上进行中的回合
+        返回 (rounds, next_before)，没有更早的回合时 next_before 为 None
         """
         if not self.pool: await self.init_pool()
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                sql = "SELECT log_time, action, price, amount, profit, fee, note FROM trade_logs WHERE bot_id = %s ORDER BY id ASC"
-                await cursor.execute(sql, (bot_id,))
-                logs = await cursor.fetchall()
-                
+                pending = await self._sync_rounds(cursor, bot_id)
+
+                sql = "SELECT round_no, first_log_id, last_log_id, start_time, end_time, profit, fees FROM trade_rounds WHERE bot_id = %s"
+                params = [bot_id]
+                if before is not None:
+                    sql += " AND round_no < %s"
+                    params.append(int(before))
+                sql += " ORDER BY round_no DESC LIMIT %s"
+                params.append(int(limit))
+                await cursor.execute(sql, params)
+                rows = await cursor.fetchall()
+
+                # 本页各回合的日志是一段连续的 id 区间，一次读出后按区间分组
+                trades_by_round = {row['round_no']: [] for row in rows}
+                if rows:
+                    await cursor.execute(
+                        "SELECT id, log_time, action, price, amount, profit, fee, note, kind FROM trade_logs "
+                        "WHERE bot_id = %s AND id BETWEEN %s AND %s ORDER BY id ASC",
+                        (bot_id, rows[-1]['first_log_id'], rows[0]['last_log_id'])
+                    )
+                    bounds = [(row['first_log_id'], row['last_log_id'], row['round_no']) for row in reversed(rows)]
+                    k = 0
+                    for log in await cursor.fetchall():
+                        while k < len(bounds) and log['id'] > bounds[k][1]:
+                            k += 1
+                        if k < len(bounds) and log['id'] >= bounds[k][0]:
+                            trades_by_round[bounds[k][2]].append(log)
+
                 rounds = []
-                current_round_trades = []
-                current_round_profit = 0
-                current_round_fees = 0  # [新增] 统计本回合手续费
-                round_start_time = None
-                
-                for log in logs:
-                    if log.get('log_time'):
-                        log['log_time'] = str(log['log_time'])
+                if before is None and pending:
+                    last_no = rows[0]['round_no'] if rows else 0
+                    rounds.append(self._round_dict(
+                        last_no + 1, pending[0]['log_time'], None,
+                        sum(float(x['profit'] or 0) for x in pending), sum(float(x['fee'] or 0) for x in pending),
+                        pending, running=True
+                    ))
+                for row in rows:
+                    rounds.append(self._round_dict(
+                        row['round_no'], row['start_time'], row['end_time'],
+                        float(row['profit'] or 0), float(row['fees'] or 0), trades_by_round[row['round_no']]
+                    ))
 
-                    if not current_round_trades:
-                        round_start_time = log['log_time']
-                    
-                    current_round_trades.append(log)
-                    
-                    p = float(log['profit'] or 0)
-                    f = float(log['fee'] or 0) # [新增] 读取手续费
-                    current_round_profit += p
-                    current_round_fees += f
-                    
-                    action_str = (log['action'] or "").lower()
-                    
-                    is_closing = False
-                    if p != 0: is_closing = True
-                    if 'sell' in action_str or 'close' in action_str or '平仓' in action_str:
-                        if p != 0 or 'all' in action_str or 'manual' in action_str:
-                            is_closing = True
-
-                    if is_closing:
-                        # [关键修改] 计算净利润 = 毛利 - 手续费
-                        net_profit = current_round_profit - current_round_fees
-                        
-                        rounds.append({
-                            'round_id': len(rounds) + 1,
-                            'start_time': round_start_time,
-                            'end_time': log['log_time'],
-                            'profit': current_round_profit, # 原始毛利
-                            'net_profit': net_profit,       # [新增] 净利润 (用于前端显示)
-                            'total_fees': current_round_fees, # [新增] 总手续费
-                            'trades': current_round_trades[::-1], 
-                            # [关键修改] 胜负判断基于净利润
-                            'result': 'win' if net_profit > 0 else ('loss' if net_profit < 0 else 'break_even')
-                        })
-                        
-                        current_round_trades = []
-                        current_round_profit = 0
-                        current_round_fees = 0
-                        round_start_time = None
-                
-                if current_round_trades:
-                    # 进行中的回合也计算一下净浮动 (虽然还没平仓，但开仓手续费已经产生了)
-                    net_profit = current_round_profit - current_round_fees
-                    rounds.append({
-                        'round_id': len(rounds) + 1,
-                        'start_time': round_start_time,
-                        'end_time': "running",
-                        'profit': 0,
-                        'net_profit': net_profit,
-                        'total_fees': current_round_fees,
-                        'trades': current_round_trades[::-1],
-                        'result': 'running'
-                    })
-
-                return rounds[::-1]
-            
-    async def get_total_profit(self, bot_id):
-        """ 计算指定机器人的累计已实现盈亏 (从日志表求和) """
+                next_before = rows[-1]['round_no'] if rows and rows[-1]['round_no'] > 1 else None
+                return rounds, next_before
+
+    async def get_log_totals(self, bot_id):
+        """
+        [新增] 一次聚合返回累计已实现盈亏、总手续费、开仓/加仓手续费
+        只读 (bot_id, kind, profit, fee) 覆盖索引，不回表、不再对 action 文字做 LIKE 匹配
+        """
         if not self.pool: await self.init_pool()
+        await self.flush_bot(bot_id)
         async with self.pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                # 统计所有利润的总和
-                sql = "SELECT SUM(profit) as total FROM trade_logs WHERE bot_id = %s"
+                sql = """
+                    SELECT SUM(profit) AS profit, SUM(fee) AS fees,
+                           SUM(CASE WHEN kind IN ('open', 'add') THEN fee ELSE 0 END) AS buy_fees
+                    FROM trade_logs WHERE bot_id = %s
+                """
                 await cursor.execute(sql, (bot_id,))
-                result = await cursor.fetchone()
-                # 如果没有记录返回 0
-                return float(result['total']) if result and result['total'] else 0.0
-            
+                result = await cursor.fetchone() or {}
+                return {key: float(result.get(key) or 0) for key in ('profit', 'fees', 'buy_fees')}
+
+    async def get_total_profit(self, bot_id):
+        """ 计算指定机器人的累计已实现盈亏 (从日志表求和) """
+        return (await self.get_log_totals(bot_id))['profit']
+
     async def get_total_fees(self, bot_id):
         """ 计算指定机器人的累计手续费 """
-        if not self.pool: await self.init_pool()
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                sql = "SELECT SUM(fee) as total FROM trade_logs WHERE bot_id = %s"
-                await cursor.execute(sql, (bot_id,))
-                result = await cursor.fetchone()
-                return float(result['total']) if result and result['total'] else 0.0
+        return (await self.get_log_totals(bot_id))['fees']
 
     #获取开仓手续费 (用于修正净盈亏计算)
     async def get_buy_fees(self, bot_id):
-        if not self.pool: await self.init_pool()
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                # 统计所有开仓动作的手续费
-                sql = """
-                    SELECT SUM(fee) as total FROM trade_logs 
-                    WHERE bot_id = %s 
-                    AND (
-                        action LIKE '%%Buy%%' OR 
-                        action LIKE '%%买入%%' OR 
-                        action LIKE '%%补仓%%' OR
-                        action LIKE '%%首单%%' OR
-                        action LIKE '%%Base%%'
-                    )
-                """
-                await cursor.execute(sql, (bot_id,))
-                result = await cursor.fetchone()
-                return float(result['total']) if result and result['total'] else 0.0
+        return (await self.get_log_totals(bot_id))['buy_fees']
 
     # 在 modules/database.py 的用户管理区域添加
     async def update_user_language(self, user_id, lang_code):
@@ -1,93 +1,380 @@
 import time
+import random
 import asyncio
 import ccxt.pro as ccxt
-from modules.adapters import ExchangeFactory, PionexAdapter, BinanceAdapter
-from modules.globals import WS_PRICE_CACHE, EXCHANGE_CACHE
+from config import STREAM_CONFIG, PIONEX_CONFIG
+from modules.adapters import PionexAdapter, BinanceAdapter, BinanceSigner, close_pionex_session
+from modules.globals import WS_PRICE_CACHE, EXCHANGE_CACHE, tick_bus
+from modules.kline_store import kline_store
+from modules.pionex_ws import PionexStream
+from modules.rate_limiter import rate_limiter
+from modules.markets_meta import markets_meta
 
 # ================= WebSocket 管理器 =================
+# 行情流中心: 每个 (交易所, 市场类型) 一组独立连接 (币安合约/现货、Pionex 合约/现货互不影响)
+# 价格写入 WS_PRICE_CACHE[(交易所, 市场类型, 交易对)]，K 线增量写入共享 K 线仓库
 
-class StreamManager:
-    def __init__(self):
+def _create_stream_exchange(source, market_type):
+    if source == 'pionex':
+        # ccxt.pro 没有 Pionex: 使用原生 WS 客户端；未配置 WS 地址时退回 REST 行情快照轮询
+        if PIONEX_CONFIG['ws_url']:
+            return PionexStream(market_type=market_type)
+        return PionexAdapter(market_type=market_type)
+    exchange_class = getattr(ccxt, source, None)
+    if not exchange_class:
+        return None
+    options = {
+        'enableRateLimit': True,
+        'aiohttp_trust_env': True,
+    }
+    if source == 'binance':
+        options['options'] = { 'defaultType': 'spot' if market_type == 'spot' else 'future' }
+    return rate_limiter.attach(exchange_class(options), (source, market_type))
+
+def _backoff_delay(attempt):
+    """ 指数退避 + 随机抖动 (避免大量连接同时重连) """
+    delay = min(STREAM_CONFIG['backoff_max'], STREAM_CONFIG['backoff_base'] * (2 ** min(attempt, 10)))
+    return delay * random.uniform(0.5, 1.0)
+
+def get_stream_price(key, now=None):
+    """ 读取推送价格 (key = (交易所, 市场类型, 交易对))，不存在或已过期返回 0.0 """
+    data = WS_PRICE_CACHE.get(key)
+    if not data: return 0.0
+    if (now or time.time()) - data['ts'] >= STREAM_CONFIG['stale_after']: return 0.0
+    return data['price']
+
+class TickerShard:
+    """ 一条 watch_tickers 连接负责的一组交易对 (独立的交易所实例 = 独立的 socket) """
+    def __init__(self, shard_id):
+        self.id = shard_id
+        self.symbols = set()
+        self.exchange = None
+        self.task = None
+        self.connected = False
+        self.reconnects = 0
+        self.last_error = None
+        self.last_msg_ts = 0
+
+class VenueStream:
+    """
+    单个 (交易所, 市场类型) 的行情连接:
+    - 价格: 交易对按每连接上限拆分到多个 watch_tickers 分片，单个分片断线/坏交易对不影响其他分片
+    - K 线: 按需的 watch_ohlcv 流 (使用独立的主连接)
+    """
+    def __init__(self, venue):
+        self.venue = venue
         self.exchange = None
         self.running = False
         self.active_symbols = set()
-        self.task = None
-        self.current_source = 'binance'
+        # 分片: Pionex REST 轮询为整表拉取，一个分片即可覆盖全部交易对
+        rest_polling = venue[0] == 'pionex' and not PIONEX_CONFIG['ws_url']
+        self.shard_cap = 0 if rest_polling else STREAM_CONFIG['symbols_per_conn']
+        self.shards = {}          # shard_id -> TickerShard
+        self.symbol_shard = {}    # symbol -> shard_id
+        self._next_shard = 0
+        self.bad_symbols = set()  # 交易所不支持的交易对 (不再订阅)
+        # K 线订阅: (symbol, timeframe) -> 需要的根数 / 对应的 watch_ohlcv 任务
+        self.kline_needs = {}
+        self.kline_tasks = {}
+        self.kline_reconnects = 0
+        self.kline_last_error = None
 
-    async def start(self, source='binance'):
-        if self.running and self.exchange and self.current_source == source:
-            return
-        
-        if self.running:
-            await self.stop()
-        
-        self.running = True
-        self.current_source = source
-        print(f">>> 🔌 正在启动 WebSocket 数据流 ({source})...")
+    def start(self):
+        source, market_type = self.venue
+        print(f">>> 🔌 正在启动 WebSocket 数据流 ({source} {market_type})...")
         try:
-            exchange_class = getattr(ccxt, source, None)
-            if not exchange_class:
+            self.exchange = _create_stream_exchange(source, market_type)
+            if not self.exchange:
                 print(f"WS Error: Unsupported exchange {source}")
-                self.running = False
-                return
-            options = {
-                'enableRateLimit': True,
-                'aiohttp_trust_env': True,
-            }
-
-            if source == 'binance':
-                options['options'] = { 'defaultType': 'future' }
-
-            self.exchange = exchange_class(options)
-            
-            self.task = asyncio.create_task(self._loop())
+                return False
+            self.running = True
+            self._rebalance()
+            self.update_klines(self.kline_needs)
+            return True
         except Exception as e:
             print(f"WS Start Error ({source}): {e}")
             self.running = False
+            return False
 
     async def stop(self):
         self.running = False
-        print(">>> 🔌 正在停止 WebSocket 数据流...")
-        if self.task:
-            self.task.cancel()
-            try:
-                await self.task
-            except asyncio.CancelledError:
-                pass
-            except Exception as e:
-                print(f"WS Task Close Error: {e}")
-        
+        for task in self.kline_tasks.values():
+            task.cancel()
+        self.kline_tasks.clear()
+        for shard in list(self.shards.values()):
+            await self._stop_shard(shard)
+        self.shards.clear()
+        self.symbol_shard.clear()
+
         if self.exchange:
             try:
                 await self.exchange.close()
-                print(">>> ✅ WebSocket Exchange Closed.")
             except Exception as e:
                 print(f"WS Exchange Close Error: {e}")
             finally:
                 self.exchange = None
-                WS_PRICE_CACHE.clear()
+        for key in [k for k in WS_PRICE_CACHE if k[:2] == self.venue]:
+            WS_PRICE_CACHE.pop(key, None)
+
+    # ---------- 价格分片 ----------
 
     def update_symbols(self, symbols):
         self.active_symbols = set(symbols)
+        self._rebalance()
 
-    async def _loop(self):
-        while self.running:
+    def _rebalance(self):
+        """ 增量分配: 已订阅的交易对保持在原分片，新交易对填入未满的分片，空分片关闭 """
+        wanted = self.active_symbols - self.bad_symbols
+        for symbol in list(self.symbol_shard.keys()):
+            if symbol not in wanted:
+                shard = self.shards.get(self.symbol_shard.pop(symbol))
+                if shard: shard.symbols.discard(symbol)
+                WS_PRICE_CACHE.pop((*self.venue, symbol), None)
+
+        for symbol in sorted(wanted - set(self.symbol_shard)):
+            shard = next((sh for sh in self.shards.values() if not self.shard_cap or len(sh.symbols) < self.shard_cap), None)
+            if shard is None:
+                shard = TickerShard(self._next_shard)
+                self._next_shard += 1
+                self.shards[shard.id] = shard
+            shard.symbols.add(symbol)
+            self.symbol_shard[symbol] = shard.id
+
+        for shard in list(self.shards.values()):
+            if not shard.symbols:
+                self.shards.pop(shard.id, None)
+                if shard.task: asyncio.create_task(self._stop_shard(shard))
+            elif self.running and shard.task is None:
+                shard.task = asyncio.create_task(self._shard_loop(shard))
+
+    async def _stop_shard(self, shard):
+        if shard.task:
+            shard.task.cancel()
             try:
-                if not self.active_symbols:
-                    await asyncio.sleep(1)
-                    continue
-                symbols = list(self.active_symbols)
-                tickers = await self.exchange.watch_tickers(symbols)
+                await shard.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"WS Task Close Error: {e}")
+            shard.task = None
+        await self._close_shard_exchange(shard)
+
+    async def _close_shard_exchange(self, shard):
+        shard.connected = False
+        if shard.exchange:
+            try:
+                await shard.exchange.close()
+            except Exception:
+                pass
+            shard.exchange = None
+
+    async def _drop_bad_symbols(self, shard):
+        """ 交易所报坏交易对时，按市场列表找出并剔除，其余交易对照常订阅 """
+        try:
+            markets = await shard.exchange.load_markets()
+        except Exception:
+            return
+        bad = {s for s in shard.symbols if s not in markets}
+        if bad:
+            print(f">>> ⚠️ WS ({self.venue[0]} {self.venue[1]}) 剔除不支持的交易对: {sorted(bad)}")
+            self.bad_symbols |= bad
+            self._rebalance()
+
+    async def _shard_loop(self, shard):
+        source, market_type = self.venue
+        attempt = 0
+        while self.running and shard.symbols:
+            try:
+                if shard.exchange is None:
+                    shard.exchange = _create_stream_exchange(source, market_type)
+                tickers = await shard.exchange.watch_tickers(list(shard.symbols))
+                now = time.time()
+                shard.connected = True
+                shard.last_msg_ts = now
+                attempt = 0
                 for symbol, ticker in tickers.items():
-                    WS_PRICE_CACHE[symbol] = {'price': ticker['last'], 'ts': time.time()}
+                    if ticker.get('last') and symbol in shard.symbols:
+                        tick_bus.publish((source, market_type, symbol), {'price': ticker['last'], 'ts': now})
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                shard.last_error = str(e)[:200]
+                shard.reconnects += 1
+                # 断线期间的价格立即作废 (机器人直接回退 REST，不必等过期)
+                for symbol in shard.symbols:
+                    WS_PRICE_CACHE.pop((source, market_type, symbol), None)
+                if isinstance(e, getattr(ccxt, 'BadSymbol', ())) and shard.exchange:
+                    await self._drop_bad_symbols(shard)
+                await self._close_shard_exchange(shard)
+                await asyncio.sleep(_backoff_delay(attempt))
+                attempt += 1
+
+    # ---------- K 线 ----------
+
+    def update_klines(self, needs):
+        """ needs: {(symbol, timeframe): 根数}，按差异增减 watch_ohlcv 订阅 """
+        self.kline_needs = dict(needs)
+        if not self.running or not self.exchange: return
+        if not getattr(self.exchange, 'has', {}).get('watchOHLCV'):
+            # 不支持 K 线推送的交易所继续走 K 线仓库的 REST 路径
+            return
+        for key in list(self.kline_tasks.keys()):
+            if key not in self.kline_needs:
+                self.kline_tasks.pop(key).cancel()
+        for key in self.kline_needs:
+            if key not in self.kline_tasks:
+                self.kline_tasks[key] = asyncio.create_task(self._kline_loop(*key))
+
+    async def _kline_loop(self, symbol, timeframe):
+        """ 单个 (交易对, 周期) 的 K 线流: REST 回补一次，之后只靠 watch_ohlcv 增量更新共享 K 线仓库 """
+        venue = self.venue
+        backfilled = False
+        attempt = 0
+        while self.running:
+            try:
+                if not backfilled:
+                    # 与机器人的请求共用同一个在途请求，已有新鲜数据时不会重复拉取
+                    await kline_store.get(self.exchange, venue, symbol, timeframe, self.kline_needs.get((symbol, timeframe), 100))
+                    backfilled = True
+                candles = await self.exchange.watch_ohlcv(symbol, timeframe)
+                kline_store.merge(venue, symbol, timeframe, candles)
+                attempt = 0
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                await asyncio.sleep(5)
+                self.kline_last_error = f"{symbol} {timeframe}: {str(e)[:200]}"
+                self.kline_reconnects += 1
+                # 断线期间可能漏掉 K 线: 丢弃缓存，重连后重新回补
+                kline_store.invalidate(venue, symbol, timeframe)
+                backfilled = False
+                await asyncio.sleep(_backoff_delay(attempt))
+                attempt += 1
+
+    # ---------- 统计 ----------
+
+    def get_stats(self, now=None):
+        """ 连接状态 + 价格新鲜度 (过期交易对数 / 最大延迟) """
+        now = now or time.time()
+        stale_after = STREAM_CONFIG['stale_after']
+        ages = []
+        stale = 0
+        for symbol in self.symbol_shard:
+            data = WS_PRICE_CACHE.get((*self.venue, symbol))
+            age = now - data['ts'] if data else None
+            if age is None or age >= stale_after:
+                stale += 1
+            if age is not None:
+                ages.append(age)
+        return {
+            'connected': self.running and self.exchange is not None,
+            'symbols': len(self.symbol_shard),
+            'bad_symbols': len(self.bad_symbols),
+            'stale_symbols': stale,
+            'max_age_s': round(max(ages), 2) if ages else None,
+            'shards': [{
+                'symbols': len(sh.symbols),
+                'connected': sh.connected,
+                'reconnects': sh.reconnects,
+                'idle_s': round(now - sh.last_msg_ts, 2) if sh.last_msg_ts else None,
+                'last_error': sh.last_error,
+            } for sh in self.shards.values()],
+            'kline_streams': len(self.kline_tasks),
+            'kline_reconnects': self.kline_reconnects,
+            'kline_last_error': self.kline_last_error,
+        }
+
+class StreamManager:
+    """
+    行情流中心: 按 (交易所, 市场类型) 管理 VenueStream
+    调度器上报每个市场需要的交易对/K 线，有需求的市场自动建立连接，需求清空后自动断开
+    """
+    def __init__(self):
+        self.running = False
+        self.streams = {}       # venue -> VenueStream
+        self.symbols = {}       # venue -> set(symbol)
+        self.kline_needs = {}   # venue -> {(symbol, timeframe): 根数}
+
+    async def start(self):
+        if self.running: return
+        self.running = True
+        self._apply()
+
+    async def stop(self):
+        self.running = False
+        print(">>> 🔌 正在停止 WebSocket 数据流...")
+        streams = list(self.streams.values())
+        self.streams.clear()
+        for stream in streams:
+            await stream.stop()
+        WS_PRICE_CACHE.clear()
+        if streams:
+            print(">>> ✅ WebSocket Exchange Closed.")
+
+    def update_symbols(self, symbols_by_venue):
+        """ {venue: set(symbol)} """
+        self.symbols = {venue: set(syms) for venue, syms in symbols_by_venue.items() if syms}
+        self._apply()
+
+    def update_klines(self, needs_by_venue):
+        """ {venue: {(symbol, timeframe): 根数}} """
+        self.kline_needs = {venue: dict(needs) for venue, needs in needs_by_venue.items() if needs}
+        self._apply()
+
+    def _apply(self):
+        if not self.running: return
+        venues = set(self.symbols) | set(self.kline_needs)
+        for venue in list(self.streams.keys()):
+            if venue not in venues:
+                asyncio.create_task(self.streams.pop(venue).stop())
+        for venue in venues:
+            stream = self.streams.get(venue)
+            if stream is None:
+                if venue[0] != 'pionex' and not hasattr(ccxt, venue[0]): continue
+                stream = VenueStream(venue)
+                stream.update_symbols(self.symbols.get(venue, ()))
+                stream.kline_needs = self.kline_needs.get(venue, {})
+                if not stream.start(): continue
+                self.streams[venue] = stream
+            else:
+                stream.update_symbols(self.symbols.get(venue, ()))
+                stream.update_klines(self.kline_needs.get(venue, {}))
+
+    def get_stats(self):
+        return {f"{source}_{market_type}": stream.get_stats() for (source, market_type), stream in self.streams.items()}
 
 stream_manager = StreamManager()
 
 # ================= 交易所连接管理 =================
+# 公共数据 (行情、K 线、交易对、市场信息) 不需要密钥: 每个 (交易所, 市场类型) 只有一个共享客户端，
+# 市场信息只加载一次；每个用户的客户端只是引用它的轻量包装 (见 BinanceSigner)
+
+PUBLIC_EXCHANGES = {}   # (source, market_type) -> 共享公共适配器
+
+def _create_rest_exchange(source, market_type):
+    exchange_class = getattr(ccxt, source)
+    options = {
+        'timeout': 10000, 
+        'enableRateLimit': True,
+        'aiohttp_trust_env': True,  # 关键：允许读取系统代理设置
+        'options': { 'defaultType': 'spot' if market_type == 'spot' else 'future' }
+    }
+    return rate_limiter.attach(exchange_class(options), (source, market_type))
+
+def get_public_exchange(source='binance', market_type='future'):
+    key = (source, market_type)
+    adapter = PUBLIC_EXCHANGES.get(key)
+    if adapter is not None:
+        return adapter
+    if source == 'pionex':
+        adapter = PionexAdapter(market_type=market_type)
+    elif source == 'binance':
+        adapter = BinanceAdapter(_create_rest_exchange(source, market_type))
+    else:
+        return None
+    PUBLIC_EXCHANGES[key] = adapter
+    return adapter
+
+markets_meta.client_factory = get_public_exchange
 
 def get_cached_exchange(bot_config):
     exchange_source = bot_config.get('exchange_source', 'binance')
@@ -119,23 +406,11 @@ def get_cached_exchange(bot_config):
 
     try:
         if exchange_source == 'pionex':
+            # Pionex 适配器本身就很轻: 共用连接池与行情快照
             adapter = PionexAdapter(api_key, api_secret, market_type)
         elif exchange_source == 'binance':
-            if not hasattr(ccxt, exchange_source): return None
-            exchange_class = getattr(ccxt, exchange_source)
-            options = {
-                'timeout': 10000, 
-                'enableRateLimit': True,
-                'aiohttp_trust_env': True,
-                'options': { 'defaultType': 'spot' if market_type == 'spot' else 'future' }
-            }
-            if api_key and api_secret:
-                options['apiKey'] = api_key
-                options['secret'] = api_secret
-                
-            ccxt_instance = exchange_class(options)
-            adapter = ExchangeFactory.create(exchange_source, ccxt_instance)
-            if not adapter: adapter = ccxt_instance
+            public = get_public_exchange(exchange_source, market_type)
+            adapter = BinanceSigner(public, api_key, api_secret)
 
         if adapter:
             EXCHANGE_CACHE[cache_key] = adapter
@@ -151,6 +426,7 @@ async def close_all_exchanges():
         await stream_manager.stop()
     except Exception as e:
         print(f"Error closing StreamManager: {e}")
+    await markets_meta.stop()
 
     for key, ex in EXCHANGE_CACHE.items():
         try:
@@ -159,6 +435,18 @@ async def close_all_exchanges():
             print(f">>> ❌ Error closing {key}: {e}")
     EXCHANGE_CACHE.clear()
 
+    for key, ex in PUBLIC_EXCHANGES.items():
+        try:
+            await ex.close()
+        except Exception as e:
+            print(f">>> ❌ Error closing public {key}: {e}")
+    PUBLIC_EXCHANGES.clear()
+
+    try:
+        await close_pionex_session()
+    except Exception as e:
+        print(f"Error closing Pionex session: {e}")
+
 async def clear_user_exchange_cache(user_id):
     if not user_id: return
     print(f">>> ♻️ 正在为用户 {user_id} 清理旧交易所连接...")
@@ -172,83 +460,30 @@ async def clear_user_exchange_cache(user_id):
         EXCHANGE_CACHE.pop(key, None)
 
 async def fetch_exchange_symbols(source='binance'):
-    temp_adapter = None
     try:
-        if source == 'pionex':
-            temp_adapter = PionexAdapter()
-        else:
-            import ccxt.pro as ccxt
-            options = {
-                'timeout': 10000, 
-                'enableRateLimit': True,
-                'aiohttp_trust_env': True,  # 关键：允许读取系统代理设置
-                'options': { 'defaultType': 'future' }
-            }
-            raw_ex = ccxt.binance(options)
-            temp_adapter = BinanceAdapter(raw_ex)
-        return await temp_adapter.fetch_symbols()
+        return await markets_meta.get_symbols(source)
     except Exception as e:
         print(f"Fetch Symbols Error: {e}")
         return []
-    finally:
-        if temp_adapter: await temp_adapter.close()
 
 async def fetch_symbol_info(symbol, market_type='future', source='binance', api_key=None, api_secret=None):
-    temp_ex = None
+    # 市场信息是公共数据，从元数据服务的内存快照读取 (api_key/api_secret 保留以兼容调用方)
     try:
-        # 目前只针对币安进行自动获取，Pionex 逻辑暂缺
-        if source != 'binance':
+        info = await markets_meta.get_info(symbol, market_type, source)
+        if not info or info.get('precision') is None:
+            print(f">>> ⚠️ 自动获取失败: 交易对 {symbol} 不存在于 {source} {market_type}")
             return None
 
-        import ccxt.pro as ccxt
-        options = {
-            'timeout': 10000, 
-            'enableRateLimit': True,
-            'aiohttp_trust_env': True,
-            'options': { 'defaultType': 'spot' if market_type == 'spot' else 'future' }
+        # 优先使用 taker 费率，交易所未提供时默认万5
+        fee_rate = float(info['taker']) if info.get('taker') is not None else 0.0005
+
+        print(f">>> 🔍 自动获取 {symbol} ({market_type}) 信息: Precision={info['precision']}, Fee={fee_rate}")
+        return {
+            'precision': info['precision'],
+            'fee_rate': fee_rate,
+            'min_notional': info.get('min_notional'),
         }
-        
-        if api_key and api_secret:
-            options['apiKey'] = api_key
-            options['secret'] = api_secret
-            
-        exchange_class = getattr(ccxt, source)
-        temp_ex = exchange_class(options)
-        
-        # 加载市场信息
-        await temp_ex.load_markets()
-        
-        if symbol in temp_ex.markets:
-            market = temp_ex.markets[symbol]
-            
-            # 1. 获取数量精度 (Step Size)
-            # CCXT 结构通常是 market['precision']['amount']
-            # 对于 Binance，这通常就是 stepSize (如 0.001)
-            precision = market.get('precision', {}).get('amount', 0.001)
-            
-            # 2. 获取手续费率 (Fee Rate)
-            # 优先获取 taker 费率
-            fee_rate = 0.0005 # 默认万5
-            if market.get('taker') is not None:
-                fee_rate = float(market['taker'])
-            elif market.get('feeSide') == 'get': # 有些交易所结构不同
-                pass 
-                
-            # 如果没获取到具体费率，尝试 fetch_trading_fees (需要权限)
-            # 但为了速度，通常 load_markets 里的 info 就够了
-            
-            print(f">>> 🔍 自动获取 {symbol} ({market_type}) 信息: Precision={precision}, Fee={fee_rate}")
-            return {
-                'precision': precision,
-                'fee_rate': fee_rate
-            }
-        else:
-            print(f">>> ⚠️ 自动获取失败: 交易对 {symbol} 不存在于 {market_type}")
-            return None
 
     except Exception as e:
         print(f">>> ⚠️ 获取币种信息异常: {e}")
         return None
-    finally:
-        if temp_ex:
-            await temp_ex.close()
\ No newline at end of file
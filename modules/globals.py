@@ -8,11 +8,123 @@ WS_PRICE_CACHE = {}
 BOT_LOCKS = {}
 EXCHANGE_CACHE = {}
 
+# 引擎运行模式: sharded=True 时机器人分布在多个 Worker 进程中执行
+ENGINE_MODE = {'sharded': False, 'worker_id': None}
+
+class SharedBotLock:
+    """
+    跨进程机器人锁 (分片模式专用)
+    进程内先拿 asyncio.Lock，再用 MySQL GET_LOCK 保证 Web 进程与各 Worker 之间互斥
+    """
+    def __init__(self, bot_id, local_lock, timeout=10):
+        self.bot_id = bot_id
+        self.name = f"bot_lock_{bot_id}"
+        self.local_lock = local_lock
+        self.timeout = timeout
+        self.conn = None
+
+    async def __aenter__(self):
+        from modules.database import db
+        await self.local_lock.acquire()
+        try:
+            self.conn = await db.get_lock_connection()
+            async with self.conn.cursor() as cursor:
+                await cursor.execute("SELECT GET_LOCK(%s, %s) AS ok", (self.name, self.timeout))
+                row = await cursor.fetchone()
+            if not row or not row.get('ok'):
+                raise TimeoutError(f"Bot lock timeout: {self.name}")
+            # 上一个持锁进程可能刚修改过该机器人，丢弃本进程的缓存行，锁内读取时重新从库加载
+            from modules.state_cache import bot_state_cache
+            bot_state_cache.invalidate(self.bot_id)
+        except BaseException:
+            await self._release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        from modules.database import db
+        try:
+            # 释放前写入该机器人在写后队列中的数据，下一个持锁进程才能读到最新状态
+            await db.flush_bot(self.bot_id)
+        finally:
+            await self._release()
+
+    async def _release(self):
+        from modules.database import db
+        try:
+            if self.conn:
+                async with self.conn.cursor() as cursor:
+                    await cursor.execute("SELECT RELEASE_LOCK(%s)", (self.name,))
+        except Exception as e:
+            print(f"Bot lock release error ({self.name}): {e}")
+        finally:
+            if self.conn:
+                db.release_lock_connection(self.conn)
+                self.conn = None
+            self.local_lock.release()
+
 def get_bot_lock(bot_id):
     if bot_id not in BOT_LOCKS:
         BOT_LOCKS[bot_id] = asyncio.Lock()
+    if ENGINE_MODE['sharded']:
+        return SharedBotLock(bot_id, BOT_LOCKS[bot_id])
     return BOT_LOCKS[bot_id]
 
+class MarketDataBus:
+    """
+    行情共享总线: Worker 进程拉到的 K 线缓存通过它发布给协调器，再广播给其他 Worker
+    单进程模式下没有订阅者，publish 为空操作
+    """
+    def __init__(self):
+        self.sink = None
+
+    def attach(self, sink):
+        self.sink = sink
+
+    def publish(self, key, entry):
+        if self.sink:
+            try:
+                self.sink(key, entry)
+            except Exception as e:
+                print(f"MarketDataBus publish error: {e}")
+
+market_bus = MarketDataBus()
+
+class TickBus:
+    """
+    价格推送总线: 行情流写入 WS_PRICE_CACHE 的同时按交易对键通知订阅者 (调度器据此立即唤醒机器人)
+    key = (交易所, 市场类型, 交易对)；listen_all 的订阅者收到所有键 (协调器转发给 Worker)
+    """
+    def __init__(self):
+        self.subscribers = {}     # key -> set(callback)
+        self.all_listeners = []
+
+    def subscribe(self, key, callback):
+        self.subscribers.setdefault(key, set()).add(callback)
+
+    def unsubscribe(self, key, callback):
+        callbacks = self.subscribers.get(key)
+        if callbacks:
+            callbacks.discard(callback)
+            if not callbacks: self.subscribers.pop(key, None)
+
+    def listen_all(self, callback):
+        self.all_listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.all_listeners:
+            self.all_listeners.remove(callback)
+
+    def publish(self, key, data):
+        WS_PRICE_CACHE[key] = data
+        for callback in list(self.subscribers.get(key, ())) + self.all_listeners:
+            try:
+                callback(key, data)
+            except Exception as e:
+                print(f"TickBus callback error: {e}")
+
+tick_bus = TickBus()
+
 def adjust_precision(value, precision):
     if value == 0: return 0.0
     if precision == 0: return float(value)
@@ -0,0 +1,597 @@
+import math
+from collections import deque, OrderedDict
+
+# ================= 流式指标 (每根 K 线 O(1) 更新) =================
+# indicators.py 里的单值函数每次都用完整价格列表重建 pd.Series 再整列重算，只取最后一个值。
+# 这里的指标对象保存 EMA/Wilder 状态和滚动窗口 (环形缓冲区)，每次只喂一根新 K 线:
+# - update(...) 提交一根已收盘 K 线，返回最新值
+# - peek(...)   计算 "如果再加上这根 K 线" 的值，不修改状态 (用于未收盘的当前 K 线)
+# - seed(...)   批量初始化
+# 输出与 indicators.py 对应函数 (pandas) 一致，误差在浮点舍入量级 (python -m modules.indicator_stream 校验)
+
+NAN = float('nan')
+
+class RingBuffer:
+    """ 定长环形缓冲区，写满后覆盖最旧的值 """
+    __slots__ = ('size', 'data', 'start', 'count')
+
+    def __init__(self, size):
+        self.size = size
+        self.data = [0.0] * size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def full(self):
+        return self.count == self.size
+
+    def append(self, x):
+        """ 追加一个值，返回被挤出的最旧值 (未满时返回 None) """
+        if self.count < self.size:
+            self.data[(self.start + self.count) % self.size] = x
+            self.count += 1
+            return None
+        old = self.data[self.start]
+        self.data[self.start] = x
+        self.start = (self.start + 1) % self.size
+        return old
+
+    def __getitem__(self, k):
+        """ k=0 为最旧，k=-1 为最新 """
+        if k < 0: k += self.count
+        return self.data[(self.start + k) % self.size]
+
+    def __iter__(self):
+        for k in range(self.count):
+            yield self.data[(self.start + k) % self.size]
+
+def _com(span=None, alpha=None, com=None):
+    """ 与 pandas ewm 一致的参数换算 (alpha 统一由 com 推出，保证逐位一致) """
+    if com is not None: return float(com)
+    if span is not None: return (float(span) - 1) / 2
+    return (1 - float(alpha)) / float(alpha)
+
+class StreamEMA:
+    """
+    EMA (等价于 pandas ewm(adjust=False).mean())
+    给定 window 时等价于只对最近 window 个值重新计算 (与 indicators.ema_series 相同的闭式修正):
+    y = E + (1-alpha)^(window-1) * (x_s - E_s)，(x_s, E_s) 为窗口起点的输入和整列 EMA
+    """
+    WINDOWED = True
+    FIELDS = (4,)
+
+    def __init__(self, span=None, alpha=None, com=None, window=None):
+        self.alpha = 1.0 / (1.0 + _com(span, alpha, com))
+        self.window = window
+        self.decay = (1 - self.alpha) ** (window - 1) if window else 0.0
+        self.ring = RingBuffer(window) if window else None
+        self.n = 0
+        self.e = NAN
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    def _next(self, x):
+        if self.n == 0: return float(x)
+        e = self.e
+        if e == x: return e
+        a = self.alpha
+        return ((1 - a) * e + a * x) / ((1 - a) + a)
+
+    def _value(self, e, start):
+        if start is None: return e
+        x_s, e_s = start
+        return e + self.decay * (x_s - e_s)
+
+    def _start_after(self, x, e):
+        """ 追加 (x, e) 之后窗口起点的 (x_s, E_s)，不需要修正时返回 None """
+        if not self.window or self.n + 1 <= self.window: return None
+        if self.window == 1: return (x, e)
+        return self.ring[1]
+
+    def update(self, x):
+        e = self._next(x)
+        start = self._start_after(x, e)
+        if self.ring is not None: self.ring.append((float(x), e))
+        self.e = e
+        self.n += 1
+        return self._value(e, start)
+
+    def peek(self, x):
+        e = self._next(x)
+        return self._value(e, self._start_after(x, e))
+
+    @property
+    def value(self):
+        if self.n == 0: return NAN
+        if not self.window or self.n <= self.window: return self.e
+        return self._value(self.e, self.ring[0])
+
+class StreamSMA:
+    """ 滚动均值 (pandas rolling(period).mean())，运行和在缓冲区每转一圈时重算一次，避免累计误差 """
+    WINDOWED = False
+    FIELDS = (4,)
+
+    def __init__(self, period):
+        self.period = period
+        self.ring = RingBuffer(period)
+        self.total = 0.0
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    def _mean(self, total, count):
+        return total / count if count >= self.period else NAN
+
+    def update(self, x):
+        old = self.ring.append(float(x))
+        self.total += x - (old if old is not None else 0.0)
+        if old is not None and self.ring.start == 0:
+            self.total = math.fsum(self.ring)
+        return self._mean(self.total, len(self.ring))
+
+    def peek(self, x):
+        count = len(self.ring)
+        if self.ring.full():
+            return self._mean(self.total + x - self.ring[0], count)
+        return self._mean(self.total + x, count + 1)
+
+class StreamMA:
+    """ 与 calculate_ma 一致: 数据不足 period 根返回 0 """
+    WINDOWED = True
+    FIELDS = (4,)
+
+    def __init__(self, period=50, ma_type='ema', window=None):
+        self.period = period
+        self.window = window
+        self.n = 0
+        if ma_type.lower() == 'ema':
+            self.ma = StreamEMA(span=period, window=window)
+        else:
+            self.ma = StreamSMA(period)
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    def _count(self, n):
+        return min(n, self.window) if self.window else n
+
+    def update(self, x):
+        val = self.ma.update(x)
+        self.n += 1
+        return float(val) if self._count(self.n) >= self.period else 0
+
+    def peek(self, x):
+        val = self.ma.peek(x)
+        return float(val) if self._count(self.n + 1) >= self.period else 0
+
+class StreamRSI:
+    """ Wilder RSI，与 calculate_rsi_value 一致: 数据不足 period+1 根返回 50 """
+    WINDOWED = True
+    FIELDS = (4,)
+
+    def __init__(self, period=14, window=None):
+        self.period = period
+        self.window = window
+        # 窗口内第一个 diff 为 NaN，EMA 实际从窗口第二个值开始
+        w = None if window is None else window - 1
+        self.up = StreamEMA(com=period - 1, window=w)
+        self.down = StreamEMA(com=period - 1, window=w)
+        self.prev = None
+        self.n = 0
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    @staticmethod
+    def _rsi(up, down):
+        if down == 0:
+            return 100.0 if up > 0 else NAN
+        return 100 - (100 / (1 + up / down))
+
+    def raw(self):
+        """ 当前 RSI 原值 (不套用数据不足时的默认值) """
+        if self.n < 2: return NAN
+        return self._rsi(self.up.value, self.down.value)
+
+    def _count(self, n):
+        return min(n, self.window) if self.window else n
+
+    def _result(self, n, up, down):
+        if self._count(n) < self.period + 1: return 50.0
+        return self._rsi(up, down)
+
+    def update(self, x):
+        x = float(x)
+        if self.prev is None:
+            self.prev = x
+            self.n = 1
+            return 50.0
+        d = x - self.prev
+        up = self.up.update(d if d > 0 else 0.0)
+        down = self.down.update(-d if d < 0 else 0.0)
+        self.prev = x
+        self.n += 1
+        return self._result(self.n, up, down)
+
+    def peek(self, x):
+        if self.prev is None: return 50.0
+        d = float(x) - self.prev
+        return self._result(self.n + 1, self.up.peek(d if d > 0 else 0.0), self.down.peek(-d if d < 0 else 0.0))
+
+class StreamBollinger:
+    """
+    布林带 (rolling mean ± std_dev * rolling std, ddof=1)，与 calculate_bollinger_bands 一致: 数据不足返回 (0, 0, 0)
+    均值和平方差用滑动 Welford 更新，缓冲区每转一圈重算一次
+    """
+    WINDOWED = False
+    FIELDS = (4,)
+
+    def __init__(self, period=20, std_dev=2):
+        self.period = period
+        self.std_dev = std_dev
+        self.ring = RingBuffer(period)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    def _next(self, x):
+        count = len(self.ring)
+        if not self.ring.full():
+            n = count + 1
+            d = x - self.mean
+            mean = self.mean + d / n
+            return mean, self.m2 + d * (x - mean)
+        old = self.ring[0]
+        mean = self.mean + (x - old) / self.period
+        return mean, self.m2 + (x - old) * (x - mean + old - self.mean)
+
+    def _bands(self, count, mean, m2):
+        if count < self.period: return 0, 0, 0
+        std = math.sqrt(max(m2, 0.0) / (self.period - 1))
+        return mean + std * self.std_dev, mean, mean - std * self.std_dev
+
+    def update(self, x):
+        x = float(x)
+        self.mean, self.m2 = self._next(x)
+        old = self.ring.append(x)
+        if old is not None and self.ring.start == 0:
+            vals = list(self.ring)
+            self.mean = math.fsum(vals) / len(vals)
+            self.m2 = math.fsum((v - self.mean) ** 2 for v in vals)
+        return self._bands(len(self.ring), self.mean, self.m2)
+
+    def peek(self, x):
+        mean, m2 = self._next(float(x))
+        return self._bands(min(len(self.ring) + 1, self.period), mean, m2)
+
+class _RollingExtreme:
+    """ 单调队列维护最近 size 个值的最小/最大值 (均摊 O(1))，窗口内有 NaN 时结果为 NaN """
+
+    def __init__(self, size, is_max=False):
+        self.size = size
+        self.sign = -1.0 if is_max else 1.0
+        self.q = deque()       # (下标, 带符号的值)，值单调递增
+        self.n = 0
+        self.last_nan = -1
+
+    def _front(self, lo):
+        for idx, v in self.q:
+            if idx >= lo: return v
+        return None
+
+    def _result(self, n, best, last_nan):
+        if n < self.size or last_nan > n - 1 - self.size: return NAN
+        return self.sign * best
+
+    def update(self, x):
+        i = self.n
+        self.n += 1
+        if x != x:
+            self.last_nan = i
+        else:
+            v = self.sign * x
+            while self.q and self.q[-1][1] >= v: self.q.pop()
+            self.q.append((i, v))
+        while self.q and self.q[0][0] <= i - self.size: self.q.popleft()
+        return self._result(self.n, self.q[0][1] if self.q else NAN, self.last_nan)
+
+    def peek(self, x):
+        i = self.n
+        last_nan = i if x != x else self.last_nan
+        best = self._front(i + 1 - self.size)
+        if x == x:
+            v = self.sign * x
+            best = v if best is None or v < best else best
+        return self._result(i + 1, best if best is not None else NAN, last_nan)
+
+class StreamStochRSI:
+    """
+    StochRSI %K，与 calculate_stoch_rsi_k 一致: 数据不足 rsi_period+stoch_period 根返回 50
+    RSI 从第一根喂入的 K 线连续计算 (不按窗口重新起算)，与对最近 N 根重算的差异同 stoch_rsi_k_series
+    """
+    WINDOWED = False
+    FIELDS = (4,)
+
+    def __init__(self, rsi_period=14, stoch_period=14, k_window=3):
+        self.rsi_period = rsi_period
+        self.stoch_period = stoch_period
+        self.rsi = StreamRSI(rsi_period)
+        self.lo = _RollingExtreme(stoch_period)
+        self.hi = _RollingExtreme(stoch_period, is_max=True)
+        self.stoch = RingBuffer(k_window)
+        self.n = 0
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    @staticmethod
+    def _stoch(rsi, lo, hi):
+        denom = hi - lo
+        if denom == 0: denom = 0.000001
+        return ((rsi - lo) / denom) * 100
+
+    def _k(self, n, vals):
+        if n < self.rsi_period + self.stoch_period: return 50
+        if len(vals) < self.stoch.size: return NAN
+        return sum(vals) / len(vals)
+
+    def _rsi_raw(self, x, commit):
+        if commit:
+            self.rsi.update(x)
+            return self.rsi.raw()
+        if self.rsi.prev is None: return NAN
+        d = float(x) - self.rsi.prev
+        return StreamRSI._rsi(self.rsi.up.peek(d if d > 0 else 0.0), self.rsi.down.peek(-d if d < 0 else 0.0))
+
+    def update(self, x):
+        rsi = self._rsi_raw(x, True)
+        stoch = self._stoch(rsi, self.lo.update(rsi), self.hi.update(rsi))
+        self.stoch.append(stoch)
+        self.n += 1
+        return self._k(self.n, list(self.stoch))
+
+    def peek(self, x):
+        rsi = self._rsi_raw(x, False)
+        stoch = self._stoch(rsi, self.lo.peek(rsi), self.hi.peek(rsi))
+        vals = list(self.stoch)
+        if self.stoch.full(): vals = vals[1:]
+        return self._k(self.n + 1, vals + [stoch])
+
+class StreamADX:
+    """
+    ADX (Wilder 平滑)，与 calculate_adx 一致: 数据不足 period*2 根返回 0
+    输入为 (high, low, close)；从第一根喂入的 K 线连续计算
+    """
+    WINDOWED = False
+    FIELDS = (2, 3, 4)
+
+    def __init__(self, period=14):
+        self.period = period
+        self.tr = StreamEMA(alpha=1 / period)
+        self.plus = StreamEMA(alpha=1 / period)
+        self.minus = StreamEMA(alpha=1 / period)
+        self.adx = StreamEMA(alpha=1 / period)
+        self.prev = None
+        self.n = 0
+
+    def seed(self, bars):
+        for h, l, c in bars: self.update(h, l, c)
+        return self
+
+    def _moves(self, h, l, c):
+        if self.prev is None:
+            return h - l, 0.0, 0.0
+        ph, pl, pc = self.prev
+        tr = max(abs(h - l), abs(h - pc), abs(l - pc))
+        up_move, down_move = h - ph, pl - l
+        plus_dm = up_move if (up_move > down_move and up_move > 0) else 0.0
+        minus_dm = down_move if (down_move > up_move and down_move > 0) else 0.0
+        return tr, plus_dm, minus_dm
+
+    @staticmethod
+    def _dx(tr_s, plus_s, minus_s):
+        if tr_s == 0: return NAN
+        plus_di = 100 * (plus_s / tr_s)
+        minus_di = 100 * (minus_s / tr_s)
+        sum_di = plus_di + minus_di
+        if sum_di == 0: sum_di = 0.000001
+        return 100 * abs(plus_di - minus_di) / sum_di
+
+    def _result(self, n, adx):
+        return float(adx) if n >= self.period * 2 else 0
+
+    def update(self, h, l, c):
+        h, l, c = float(h), float(l), float(c)
+        tr, plus_dm, minus_dm = self._moves(h, l, c)
+        dx = self._dx(self.tr.update(tr), self.plus.update(plus_dm), self.minus.update(minus_dm))
+        # 全零区间 (DX 为 NaN) 时沿用上一个 ADX
+        adx = self.adx.update(dx) if dx == dx else self.adx.value
+        self.prev = (h, l, c)
+        self.n += 1
+        return self._result(self.n, adx)
+
+    def peek(self, h, l, c):
+        h, l, c = float(h), float(l), float(c)
+        tr, plus_dm, minus_dm = self._moves(h, l, c)
+        dx = self._dx(self.tr.peek(tr), self.plus.peek(plus_dm), self.minus.peek(minus_dm))
+        adx = self.adx.peek(dx) if dx == dx else self.adx.value
+        return self._result(self.n + 1, adx)
+
+class StreamVolumeSpike:
+    """ 放量检测，与 check_volume_spike 一致: 返回 (是否放量, 当前量, 目标量) """
+    WINDOWED = False
+    FIELDS = (5,)
+
+    def __init__(self, period=20, multiplier=1.5):
+        self.period = period
+        self.multiplier = multiplier
+        self.avg = StreamSMA(period)   # 之前 period 根的均量 (不含当前)
+        self.n = 0
+        self.last = None
+
+    def seed(self, values):
+        for x in values: self.update(x)
+        return self
+
+    def _check(self, n, avg_vol, current_vol):
+        if n < self.period + 1: return False, 0, 0
+        if avg_vol == 0: return True, current_vol, 0
+        target = avg_vol * self.multiplier
+        return current_vol > target, current_vol, target
+
+    def update(self, x):
+        res = self.peek(x)
+        self.avg.update(x)
+        self.n += 1
+        return res
+
+    def peek(self, x):
+        avg_vol = self.avg.total / self.period if self.avg.ring.full() else NAN
+        return self._check(self.n + 1, avg_vol, x)
+
+# ================= 实盘指标簿 =================
+# 同一交易对/周期的 K 线快照被很多机器人共用 (共享 K 线仓库)，这里按 (行情, 周期, 指标, 参数) 保存流式指标:
+# - 同一份快照重复查询直接返回上次结果
+# - 快照刷新时只把新收盘的 K 线喂进去，最后一根 (未收盘) 用 peek 计算
+# - 带窗口的指标 (EMA/RSI/MA) 以快照长度为窗口，结果与对整份快照调用 indicators.py 的函数一致
+
+class IndicatorBook:
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.updates = 0
+        self.rebuilds = 0
+
+    def _feed(self, stream, bar, commit):
+        args = [bar[f] for f in stream.FIELDS]
+        return stream.update(*args) if commit else stream.peek(*args)
+
+    def _rebuild(self, stream_cls, params, bars):
+        if stream_cls.WINDOWED:
+            params = dict(params, window=len(bars))
+        stream = stream_cls(**params)
+        for bar in bars[:-1]:
+            self._feed(stream, bar, True)
+        self.rebuilds += 1
+        return stream
+
+    def value(self, market, tf, bars, stream_cls, **params):
+        """
+        对 K 线快照 bars ([[ts, o, h, l, c, v], ...]，最后一根视为未收盘) 计算指标值
+        market 为行情标识 (交易对，或 ((交易所, 市场类型), 交易对))
+        """
+        if not bars: return None
+        key = (market, tf, stream_cls.__name__, tuple(sorted(params.items())))
+        snap = (len(bars), bars[0][0], tuple(bars[-1]))
+        entry = self.entries.get(key)
+
+        if entry is not None and entry['snap'] == snap:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+        closed_ts = bars[-2][0] if len(bars) > 1 else None
+        if (entry is None or entry['size'] != len(bars) or closed_ts is None
+                or entry['ts'] is None or entry['ts'] < bars[0][0]):
+            # 首次使用 / 快照长度变化 / 中间缺了 K 线: 用整份快照重建
+            stream = self._rebuild(stream_cls, params, bars)
+        else:
+            stream = entry['stream']
+            # 只喂上次之后新收盘的 K 线
+            k = len(bars) - 1
+            while k > 0 and bars[k - 1][0] > entry['ts']: k -= 1
+            for bar in bars[k:-1]:
+                self._feed(stream, bar, True)
+            self.updates += 1
+
+        value = self._feed(stream, bars[-1], False)
+        self.entries[key] = {'stream': stream, 'snap': snap, 'size': len(bars), 'ts': closed_ts, 'value': value}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'updates': self.updates, 'rebuilds': self.rebuilds}
+
+indicator_book = IndicatorBook()
+
+# ================= 对比 & 基准测试 =================
+# python -m modules.indicator_stream [rows]
+# 逐根喂入随机游走 K 线，与 indicators.py 的 pandas 单值函数对比每一步的结果，并比较每根 K 线的耗时
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import numpy as np
+    from modules.indicators import (
+        calculate_ma, calculate_rsi_value, calculate_bollinger_bands,
+        calculate_stoch_rsi_k, calculate_adx, check_volume_spike
+    )
+    from modules.backtest_precompute import _synthetic_candles
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    df = _synthetic_candles(rows)
+    bars = df[['timestamp', 'open', 'high', 'low', 'close', 'volume']].values.tolist()
+    closes = [b[4] for b in bars]
+    window = 200
+
+    def rel(a, b):
+        if isinstance(a, tuple):
+            return max(rel(x, y) for x, y in zip(a, b))
+        a, b = float(a), float(b)
+        if np.isnan(a) and np.isnan(b): return 0.0
+        return abs(a - b) / max(1.0, abs(b))
+
+    cases = {
+        # 名称: (流式对象, 每步的 pandas 参考值)
+        'rsi': (StreamRSI(14), lambda i: calculate_rsi_value(closes[:i + 1])),
+        'rsi_w200': (StreamRSI(14, window=window), lambda i: calculate_rsi_value(closes[max(0, i + 1 - window):i + 1])),
+        'ema50': (StreamMA(50, 'ema'), lambda i: calculate_ma(closes[:i + 1], 50, 'ema')),
+        'ema150_w200': (StreamMA(150, 'ema', window=window), lambda i: calculate_ma(closes[max(0, i + 1 - window):i + 1], 150, 'ema')),
+        'sma20': (StreamMA(20, 'sma'), lambda i: calculate_ma(closes[:i + 1], 20, 'sma')),
+        'bb': (StreamBollinger(), lambda i: calculate_bollinger_bands(closes[:i + 1])),
+        'stoch': (StreamStochRSI(), lambda i: calculate_stoch_rsi_k(closes[:i + 1])),
+        'adx': (StreamADX(), lambda i: calculate_adx([b[2] for b in bars[:i + 1]], [b[3] for b in bars[:i + 1]], closes[:i + 1])),
+        'vol': (StreamVolumeSpike(), lambda i: check_volume_spike([b[5] for b in bars[:i + 1]])),
+    }
+
+    print(f"rows={rows}")
+    for name, (stream, ref) in cases.items():
+        worst_peek = worst_upd = 0.0
+        t_stream = t_ref = 0.0
+        for i, bar in enumerate(bars):
+            args = [bar[f] for f in stream.FIELDS]
+            t0 = time.perf_counter()
+            peeked = stream.peek(*args)
+            got = stream.update(*args)
+            t_stream += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            want = ref(i)
+            t_ref += time.perf_counter() - t0
+            worst_peek = max(worst_peek, rel(peeked, want))
+            worst_upd = max(worst_upd, rel(got, want))
+        print(f"  {name:<12} max rel err update={worst_upd:.2e} peek={worst_peek:.2e} | "
+              f"pandas {t_ref / rows * 1e6:8.1f}us/candle, stream {t_stream / rows * 1e6:6.2f}us/candle")
+
+    # 指标簿: 模拟 200 根快照每次右移一根
+    book = IndicatorBook()
+    worst = 0.0
+    for end in range(window, rows):
+        snap = bars[end - window:end]
+        got = book.value('BTC/USDT', '15m', snap, StreamMA, period=150, ma_type='ema')
+        want = calculate_ma([b[4] for b in snap], 150, 'ema')
+        worst = max(worst, rel(got, want))
+    print(f"  book ema150 sliding snapshot max rel err={worst:.2e} stats={book.get_stats()}")
@@ -79,4 +79,112 @@ def check_volume_spike(volumes, period=20, multiplier=1.5):
     if avg_vol == 0: return True, current_vol, 0
     target = avg_vol * multiplier
     is_spike = current_vol > target
-    return is_spike, current_vol, target
\ No newline at end of file
+    return is_spike, current_vol, target
+# ================= 整列版本 (回测预计算) =================
+# 与上面的单值函数算法一致，一次算出整列:
+# 结果第 i 个元素 == 对 prices[:i+1] (给定 window 时为最近 window 个值) 调用单值函数的返回值
+
+def _window_counts(n, window=None):
+    counts = np.arange(1, n + 1)
+    if window is not None:
+        counts = np.minimum(counts, window)
+    return counts
+
+def ema_series(values, alpha, window=None):
+    """
+    EMA (adjust=False) 整列计算。
+    给定 window 时等价于每个位置只用最近 window 个值重新起算:
+    起点为 s 时 y_i = E_i + (1-alpha)^(i-s) * (x_s - E_s)，其中 E 为整列 EMA
+    """
+    x = np.asarray(values, dtype=float)
+    ema = pd.Series(x).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+    if window is None or len(x) <= window:
+        return ema
+    start = np.arange(len(x)) - window + 1
+    idx = np.nonzero(start > 0)[0]
+    s = start[idx]
+    corr = (1 - alpha) ** (window - 1) * (x[s] - ema[s])
+    out = ema.copy()
+    out[idx] += np.where(np.isnan(corr), 0.0, corr)
+    return out
+
+def _rsi_raw(prices, period=14, window=None):
+    s = pd.Series(np.asarray(prices, dtype=float))
+    delta = s.diff()
+    up = delta.clip(lower=0).to_numpy(copy=True)
+    down = (-1 * delta.clip(upper=0)).to_numpy(copy=True)
+    # 窗口内第一个 diff 为 NaN，EMA 实际从窗口第二个值开始
+    w = None if window is None else window - 1
+    ma_up = ema_series(up, 1 / period, w)
+    ma_down = ema_series(down, 1 / period, w)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 - (100 / (1 + ma_up / ma_down))
+
+def rsi_series(prices, period=14, window=None):
+    rsi = _rsi_raw(prices, period, window)
+    rsi[_window_counts(len(rsi), window) < period + 1] = 50.0
+    return rsi
+
+def ma_series(prices, period=50, ma_type='ema', window=None):
+    x = np.asarray(prices, dtype=float)
+    if ma_type.lower() == 'ema':
+        ma = ema_series(x, 2 / (period + 1), window)
+    else:
+        ma = pd.Series(x).rolling(window=period).mean().to_numpy(copy=True)
+    ma[_window_counts(len(x), window) < period] = 0
+    return ma
+
+def bollinger_series(prices, period=20, std_dev=2):
+    s = pd.Series(np.asarray(prices, dtype=float))
+    sma = s.rolling(window=period).mean().to_numpy(copy=True)
+    std = s.rolling(window=period).std().to_numpy(copy=True)
+    upper = sma + (std * std_dev)
+    lower = sma - (std * std_dev)
+    short = _window_counts(len(s)) < period
+    for arr in (upper, sma, lower):
+        arr[short] = 0
+    return upper, sma, lower
+
+def stoch_rsi_k_series(prices, rsi_period=14, stoch_period=14, k_window=3, window=None):
+    """
+    给定 window 时 RSI 取整列值 (而非每个窗口重新起算)，两者只差 (1-1/rsi_period)^(window-stoch_period) 量级:
+    window=201 时 RSI 相对误差 < 1e-5，经 Stoch 归一化放大后 K 值误差约 1e-4
+    """
+    rsi = pd.Series(_rsi_raw(prices, rsi_period))
+    min_rsi = rsi.rolling(window=stoch_period).min()
+    max_rsi = rsi.rolling(window=stoch_period).max()
+    denom = max_rsi - min_rsi
+    denom = denom.replace(0, 0.000001)
+    stoch = ((rsi - min_rsi) / denom) * 100
+    k = stoch.rolling(window=k_window).mean().to_numpy(copy=True)
+    k[_window_counts(len(k), window) < rsi_period + stoch_period] = 50
+    return k
+
+def adx_series(highs, lows, closes, period=14):
+    df = pd.DataFrame({'high': highs, 'low': lows, 'close': closes}, dtype=float)
+    df['tr0'] = abs(df['high'] - df['low'])
+    df['tr1'] = abs(df['high'] - df['close'].shift(1))
+    df['tr2'] = abs(df['low'] - df['close'].shift(1))
+    df['tr'] = df[['tr0', 'tr1', 'tr2']].max(axis=1)
+    df['up_move'] = df['high'] - df['high'].shift(1)
+    df['down_move'] = df['low'].shift(1) - df['low']
+    df['plus_dm'] = np.where((df['up_move'] > df['down_move']) & (df['up_move'] > 0), df['up_move'], 0)
+    df['minus_dm'] = np.where((df['down_move'] > df['up_move']) & (df['down_move'] > 0), df['down_move'], 0)
+    alpha = 1/period
+    tr_s = df['tr'].ewm(alpha=alpha, adjust=False).mean()
+    plus_di = 100 * (df['plus_dm'].ewm(alpha=alpha, adjust=False).mean() / tr_s)
+    minus_di = 100 * (df['minus_dm'].ewm(alpha=alpha, adjust=False).mean() / tr_s)
+    sum_di = (plus_di + minus_di).replace(0, 0.000001)
+    dx = 100 * abs(plus_di - minus_di) / sum_di
+    adx = dx.ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+    adx[_window_counts(len(adx)) < period * 2] = 0
+    return adx
+
+def volume_spike_series(volumes, period=20, multiplier=1.5):
+    v = pd.Series(np.asarray(volumes, dtype=float))
+    avg_vol = v.rolling(window=period).mean().shift(1).to_numpy(copy=True)
+    cur = v.to_numpy(copy=True)
+    with np.errstate(invalid='ignore'):
+        spike = np.where(avg_vol == 0, True, cur > avg_vol * multiplier)
+    spike[_window_counts(len(cur)) < period + 1] = False
+    return spike.astype(bool)
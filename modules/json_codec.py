@@ -0,0 +1,187 @@
+import json
+import math
+
+# ================= JSON 编解码 =================
+# 数据库中的 config_json / state_json 每次读写都要编解码 (引擎每秒全量加载、每个 tick 写状态、看板轮询)
+# 按可用性选择后端: orjson > msgspec > 标准库 json (两个加速库都是可选依赖，未安装时行为与原来一致)
+# - dumps 返回 str，可直接作为 SQL 参数
+# - loads 遇到加速库不接受的旧数据 (标准库写入的 NaN / Infinity) 时退回标准库解析
+# - 非有限浮点数 (NaN / inf) 加速库会编码为 null，这种情况改用标准库编码，保证读回一致
+# - decode_state: 按策略类型把已知字段规整为声明的类型 (JSON 中的 0 读回为 0.0 等)，
+#   未声明的字段原样保留 (state 是开放结构，不能用会丢弃未知字段的结构体解码)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+def _has_non_finite(obj):
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(v) for v in obj)
+    return False
+
+class StdlibCodec:
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, data):
+        return json.loads(data)
+
+class OrjsonCodec:
+    name = 'orjson'
+
+    def __init__(self):
+        self.options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        try:
+            text = orjson.dumps(obj, option=self.options).decode('utf-8')
+        except TypeError:
+            # 不支持的类型 (超过 64 位的整数等) 交给标准库
+            return json.dumps(obj)
+        if 'null' in text and _has_non_finite(obj):
+            return json.dumps(obj)
+        return text
+
+    def loads(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+class MsgspecCodec:
+    name = 'msgspec'
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj):
+        try:
+            text = self.encoder.encode(obj).decode('utf-8')
+        except (TypeError, msgspec.EncodeError):
+            return json.dumps(obj)
+        if 'null' in text and _has_non_finite(obj):
+            return json.dumps(obj)
+        return text
+
+    def loads(self, data):
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError:
+            return json.loads(data)
+
+def get_codec(name=None):
+    """ 按名称取编解码器；不指定时选择已安装的最快后端 """
+    if name in (None, 'orjson') and orjson is not None:
+        return OrjsonCodec()
+    if name in (None, 'msgspec') and msgspec is not None:
+        return MsgspecCodec()
+    return StdlibCodec()
+
+codec = get_codec()
+
+def dumps(obj):
+    return codec.dumps(obj)
+
+def loads(data):
+    return codec.loads(data)
+
+# ================= 策略状态类型 =================
+# 与策略代码中的读写保持一致；只列出数值/布尔字段，其余字段不做处理
+
+_COMMON_STATE = {
+    'position_amt': float, 'avg_price': float, 'total_cost': float, 'balance': float,
+    'is_trailing_active': bool, 'highest_price_seen': float, 'lowest_price_seen': float,
+    'last_close_time': float,
+}
+
+STATE_TYPES = {
+    'grid_dca': {**_COMMON_STATE, 'range_top': float, 'range_bottom': float, 'last_level_idx': int},
+    'fvg': {**_COMMON_STATE, 'initial_base_price': float, 'current_so_index': int},
+    'coffin': {**_COMMON_STATE, 'stop_loss_price': float, 'extreme_price': float, 'breakout_price': float},
+    'periodic': {**_COMMON_STATE, 'last_invest_time': float, 'next_trade_time': float},
+}
+
+def decode_state(data, strategy_type=None):
+    """ 解码 state_json 并按策略声明的类型规整字段 (类型不符且无法转换的值保持原样) """
+    state = loads(data) if data else {}
+    types = STATE_TYPES.get(strategy_type)
+    if not types or not isinstance(state, dict):
+        return state
+    for key, typ in types.items():
+        value = state.get(key)
+        if value is None or type(value) is typ:
+            continue
+        if typ is float and isinstance(value, int) and not isinstance(value, bool):
+            state[key] = float(value)
+        elif typ is int and isinstance(value, float) and value.is_integer():
+            state[key] = int(value)
+        elif typ is bool and value in (0, 1):
+            state[key] = bool(value)
+    return state
+
+# ================= 基准测试 =================
+# python -m modules.json_codec
+# 用接近线上的 config / state 结构对比各后端的编解码耗时
+
+def _sample_blobs():
+    now = 1.7e9
+    config = {
+        'symbol': 'BTC/USDT', 'capital': 1000, 'leverage': 3, 'market_type': 'future', 'fee_rate': 0.0005,
+        'amount_precision': 0.001, 'direction': 'long', 'grid_count': 40, 'tp_percent': 1.2, 'sl_percent': 8.0,
+        'rsi_conditions': [{'enabled': True, 'tf': tf, 'op': '<', 'value': 30} for tf in ('5m', '15m', '1h', '4h')],
+        'ma_conditions': [{'enabled': True, 'tf': '15m', 'fast': 7, 'slow': 25}],
+        'rsi_filter_stoch': True, 'rsi_filter_bb': False, 'rsi_filter_adx': True, 'manual_close_action': 'stop',
+    }
+    grid_state = {
+        'position_amt': 0.42, 'avg_price': 64123.5, 'total_cost': 8978.3, 'balance': 1021.7, 'direction': 'long',
+        'range_top': 68000.0, 'range_bottom': 60000.0, 'last_level_idx': 17, 'is_trailing_active': False,
+        'highest_price_seen': 0.0, 'lowest_price_seen': 0.0, 'last_close_time': now,
+        'orders': [{'level_idx': i, 'price': 64000.0 - i * 100, 'amount': 0.01, 'cost': 213.3, 'time': now + i} for i in range(40)],
+    }
+    fvg_state = {
+        'position_amt': 0.1, 'avg_price': 3100.25, 'total_cost': 310.0, 'balance': 690.0, 'current_so_index': 3,
+        'initial_base_price': 3150.0, 'is_trailing_active': True, 'highest_price_seen': 3190.0, 'lowest_price_seen': 3080.0,
+        'fvgs': [{'top': 3200.0 - i * 10, 'bottom': 3190.0 - i * 10, 'tf': '1h' if i % 2 else '4h'} for i in range(6)],
+        'last_fvg_update_time': now,
+    }
+    return {'config': config, 'grid_state': grid_state, 'fvg_state': fvg_state}
+
+def benchmark(rounds=20000):
+    import timeit
+    blobs = _sample_blobs()
+    backends = [StdlibCodec()]
+    if orjson is not None: backends.append(OrjsonCodec())
+    if msgspec is not None: backends.append(MsgspecCodec())
+
+    results = {}
+    for name, obj in blobs.items():
+        text = json.dumps(obj)
+        row = {}
+        for c in backends:
+            enc = timeit.timeit(lambda: c.dumps(obj), number=rounds) / rounds * 1e6
+            dec = timeit.timeit(lambda: c.loads(text), number=rounds) / rounds * 1e6
+            assert c.loads(c.dumps(obj)) == obj
+            row[c.name] = (round(enc, 2), round(dec, 2))
+        results[name] = (len(text), row)
+    return results
+
+if __name__ == '__main__':
+    print(f"当前后端: {codec.name}")
+    for name, (size, row) in benchmark().items():
+        base_enc, base_dec = row['json']
+        print(f"\n{name} ({size} bytes)   dumps us / loads us")
+        for backend, (enc, dec) in row.items():
+            print(f"  {backend:8s} {enc:8.2f} {dec:8.2f}   (x{base_enc / enc:.1f} / x{base_dec / dec:.1f})")
@@ -0,0 +1,247 @@
+import time
+import asyncio
+from collections import OrderedDict
+from config import KLINE_CONFIG
+from modules.globals import market_bus
+
+# ================= 共享 K 线仓库 =================
+# 所有需要 K 线的地方 (RSI 条件、高级过滤、Coffin、FVG 扫描、/kline 接口) 统一从这里取:
+# - 按 (交易所, 市场类型, 交易对, 周期) 只保存一份，保留请求过的最长窗口，短窗口直接切片
+# - 同一个键同时只有一个 REST 请求在途，并发请求共用结果
+# - 当前 K 线收盘后失效 (并设最长缓存时间，保证未收盘 K 线的价格不过旧)
+# - LRU 淘汰，内存有上限
+# 分片模式下拉到的数据通过 market_bus 共享给其他进程
+# StreamManager 订阅 watch_ohlcv 后用 merge 增量更新 (REST 只在首次回补时调用一次)，并触发收盘事件
+
+KLINE_PREFIX = "kline|"
+
+_TF_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000}
+
+def timeframe_seconds(tf):
+    """ '15m' -> 900，无法识别时按 60 秒处理 """
+    try:
+        return int(tf[:-1]) * _TF_UNITS[tf[-1]]
+    except (KeyError, ValueError, IndexError):
+        return 60
+
+def bot_kline_needs(row):
+    """ 机器人运行时会请求的 K 线 {周期: 根数} (与 bot_logic 中的调用保持一致，用于 WS 订阅) """
+    cfg = row.get('config', {}) or {}
+    needs = {}
+
+    def need(tf, limit):
+        if tf: needs[tf] = max(needs.get(tf, 0), limit)
+
+    for c in cfg.get('rsi_conditions', []) or []:
+        if c.get('enabled'): need(c.get('tf'), 50)
+    if cfg.get('rsi_filter_stoch') or cfg.get('rsi_filter_bb'): need('15m', 200)
+    if cfg.get('rsi_filter_adx'): need('4h', 200)
+    for c in cfg.get('ma_conditions', []) or []:
+        if c.get('enabled', True): need(c.get('tf', '15m'), 200)
+
+    strat_type = row.get('strategy_type', 'fvg')
+    if strat_type == 'coffin':
+        need('5m', 100)
+        need('15m', 100)
+    elif strat_type == 'fvg' or (strat_type == 'fib_grid' and cfg.get('use_fvg', False)):
+        need('1h', 100)
+        need('4h', 100)
+    return needs
+
+def bot_venue(row):
+    return (row.get('exchange_source', 'binance'), (row.get('config', {}) or {}).get('market_type', 'future'))
+
+class KlineView:
+    """ 把 fetch_ohlcv 转到共享仓库的交易所包装，其余属性/方法透传给原交易所对象 """
+    def __init__(self, store, exchange, venue):
+        self.store = store
+        self.exchange = exchange
+        self.venue = venue
+
+    async def fetch_ohlcv(self, symbol, timeframe='15m', limit=100):
+        return await self.store.get(self.exchange, self.venue, symbol, timeframe, limit)
+
+    def __getattr__(self, name):
+        return getattr(self.exchange, name)
+
+class KlineStore:
+    def __init__(self, max_entries=500, max_bars=1000, max_age=50, close_grace=1.0):
+        self.max_entries = max_entries    # 最多缓存的 (交易所, 市场, 交易对, 周期) 数
+        self.max_bars = max_bars          # 单个键最多保存的 K 线根数
+        self.max_age = max_age            # 最长缓存时间 (秒)，未收盘 K 线至少这么久刷新一次
+        self.close_grace = close_grace    # 收盘后等待交易所生成新 K 线的时间 (秒)
+
+        self.entries = OrderedDict()      # key -> {'data', 'limit', 'ts', 'expires'}
+        self.inflight = {}                # key -> (task, limit)
+        self.close_listeners = []         # 收盘事件回调 fn(venue, symbol, timeframe, candle)
+        self.publish_interval = 1.0       # WS 增量广播给其他进程的最小间隔 (收盘时立即广播)
+
+        self.hits = 0
+        self.fetches = 0
+        self.joined = 0
+        self.errors = 0
+        self.evictions = 0
+        self.merges = 0
+        self.closes = 0
+
+    @staticmethod
+    def make_key(venue, symbol, timeframe):
+        source, market_type = venue
+        return f"{KLINE_PREFIX}{source}|{market_type}|{symbol}|{timeframe}"
+
+    @staticmethod
+    def split_key(key):
+        source, market_type, symbol, timeframe = key[len(KLINE_PREFIX):].split('|')
+        return (source, market_type), symbol, timeframe
+
+    def view(self, exchange, venue):
+        return KlineView(self, exchange, venue)
+
+    def on_close(self, callback):
+        self.close_listeners.append(callback)
+
+    def invalidate(self, venue, symbol, timeframe):
+        self.entries.pop(self.make_key(venue, symbol, timeframe), None)
+
+    def _expires(self, data, timeframe, now):
+        """ 当前 (最后一根) K 线收盘时间 与 最长缓存时间 取较早者 """
+        expires = now + self.max_age
+        if data:
+            close_at = data[-1][0] / 1000 + timeframe_seconds(timeframe) + self.close_grace
+            expires = min(expires, max(close_at, now + self.close_grace))
+        return expires
+
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, exchange, venue, symbol, timeframe='15m', limit=100):
+        """ 返回最近 limit 根 K 线 ([[ts, o, h, l, c, v], ...])，失败时返回旧数据或 [] """
+        limit = max(1, min(int(limit), self.max_bars))
+        key = self.make_key(venue, symbol, timeframe)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry['limit'] >= limit and time.time() < entry['expires']:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry['data'][-limit:]
+
+        pending = self.inflight.get(key)
+        if pending is not None and pending[1] >= limit:
+            self.joined += 1
+            task = pending[0]
+        else:
+            # 按最长窗口拉取，之后更短的请求都能直接命中
+            fetch_limit = max(limit, entry['limit'] if entry else 0, pending[1] if pending else 0)
+            task = asyncio.ensure_future(self._fetch(key, exchange, symbol, timeframe, fetch_limit))
+            self.inflight[key] = (task, fetch_limit)
+
+        data = await asyncio.shield(task)
+        return data[-limit:]
+
+    async def _fetch(self, key, exchange, symbol, timeframe, limit):
+        self.fetches += 1
+        try:
+            data = await exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+        except Exception as e:
+            print(f"Kline Fetch Error ({symbol} {timeframe}): {e}")
+            data = None
+        finally:
+            pending = self.inflight.get(key)
+            if pending is not None and pending[0] is asyncio.current_task():
+                self.inflight.pop(key, None)
+
+        if not isinstance(data, list) or not data:
+            # 拉取失败: 有旧数据时继续用旧数据，并推迟几秒再重试，避免每个机器人都去重试
+            self.errors += 1
+            stale = self.entries.get(key)
+            if not stale: return []
+            stale['expires'] = time.time() + 5
+            return stale['data']
+
+        now = time.time()
+        entry = {'data': data, 'limit': limit, 'ts': now, 'expires': self._expires(data, timeframe, now)}
+        self._store(key, entry)
+        market_bus.publish(key, entry)
+        return data
+
+    # ---------- WS 增量 ----------
+
+    def merge(self, venue, symbol, timeframe, candles):
+        """ 合并 WS 推送的最新 K 线: 同一根覆盖，新的一根追加 (上一根即收盘)。返回本次收盘的 K 线 """
+        return self._merge(self.make_key(venue, symbol, timeframe), candles, publish=True)
+
+    def _merge(self, key, candles, publish):
+        if not candles: return []
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None:
+            # 还没有回补: 先记下推送数据，limit=0 保证请求时仍会走一次 REST
+            entry = {'data': [], 'limit': 0, 'ts': now, 'expires': 0}
+            self._store(key, entry)
+
+        data = entry['data']
+        closed = []
+        for c in sorted(candles, key=lambda c: c[0]):
+            if data and c[0] == data[-1][0]:
+                data[-1] = list(c)
+            elif not data or c[0] > data[-1][0]:
+                if data: closed.append(data[-1])
+                data.append(list(c))
+        keep = entry['limit'] or self.max_bars
+        if len(data) > keep:
+            del data[:len(data) - keep]
+
+        # WS 持续推送时缓存一直有效；断流后 max_age 秒内自动退回 REST
+        entry['ts'] = now
+        if entry['limit']:
+            entry['expires'] = now + self.max_age
+        self.merges += 1
+
+        if publish and (closed or now - entry.get('published', 0) >= self.publish_interval):
+            entry['published'] = now
+            market_bus.publish(key, {'tail': [list(c) for c in data[-(len(closed) + 1):]], 'ts': now})
+
+        if closed:
+            self.closes += len(closed)
+            venue, symbol, timeframe = self.split_key(key)
+            for candle in closed:
+                for callback in self.close_listeners:
+                    try:
+                        callback(venue, symbol, timeframe, candle)
+                    except Exception as e:
+                        print(f"Kline close listener error: {e}")
+        return closed
+
+    def ingest(self, key, entry):
+        """ 接收其他进程发布的 K 线 (非 K 线键返回 False)，整份数据只保留更新的一份，增量直接合并 """
+        if not key.startswith(KLINE_PREFIX): return False
+        if 'tail' in entry:
+            self._merge(key, entry['tail'], publish=False)
+            return True
+        cached = self.entries.get(key)
+        if cached is None or entry['ts'] > cached['ts']:
+            self._store(key, entry)
+        return True
+
+    def get_stats(self):
+        return {
+            'entries': len(self.entries),
+            'inflight': len(self.inflight),
+            'hits': self.hits,
+            'fetches': self.fetches,
+            'joined': self.joined,
+            'errors': self.errors,
+            'evictions': self.evictions,
+            'merges': self.merges,
+            'closes': self.closes,
+        }
+
+kline_store = KlineStore(
+    max_entries=KLINE_CONFIG['max_entries'],
+    max_bars=KLINE_CONFIG['max_bars'],
+    max_age=KLINE_CONFIG['max_age']
+)
@@ -3,12 +3,13 @@ from decimal import Decimal, ROUND_DOWN
 from modules.database import db
 from modules.globals import RUNTIME_CACHE, get_bot_lock
 from modules.exchange_manager import get_cached_exchange
+from modules.state_cache import bot_state_cache
 from languages import TRANSLATIONS
 
 async def execute_manual_buy(bot_id, amount_usd):
     lock = get_bot_lock(bot_id)
     async with lock:
-        bot_data = await db.get_bot_full_data(bot_id)
+        bot_data = await bot_state_cache.get(bot_id)
         if not bot_data: raise Exception("Bot not found")
 
         user_lang = bot_data.get('language', 'zh-CN')
@@ -145,14 +146,14 @@ async def execute_manual_buy(bot_id, amount_usd):
 
         # ----------------------------------------
             
-        await db.add_log(bot_id, t("manual_warehousing"), price, float(amt_d), 0, float(actual_fee_d), f"Manual Buy (Lev {leverage}x)")
-        await db.update_bot_state(bot_id, state, f"{t('msg_manual_buy_success')}: {amt_d}")
+        await db.add_log(bot_id, t("manual_warehousing"), price, float(amt_d), 0, float(actual_fee_d), f"Manual Buy (Lev {leverage}x)", kind='open' if pos_amt_d == 0 else 'add')
+        await bot_state_cache.save_state(bot_id, state, f"{t('msg_manual_buy_success')}: {amt_d}")
         return True
 
 async def execute_manual_close(bot_id):
     lock = get_bot_lock(bot_id)
     async with lock:
-        bot_data = await db.get_bot_full_data(bot_id)
+        bot_data = await bot_state_cache.get(bot_id)
         if not bot_data: raise Exception("Bot not found")
 
         user_lang = bot_data.get('language', 'zh-CN')
@@ -206,7 +207,7 @@ async def execute_manual_close(bot_id):
         
         realized_profit = float(pnl_d - close_fee_d)
         
-        await db.add_log(bot_id, t("log_manual_close"), price, float(pos_amt_d), realized_profit, float(close_fee_d), "Manual Close")
+        await db.add_log(bot_id, t("log_manual_close"), price, float(pos_amt_d), realized_profit, float(close_fee_d), "Manual Close", kind='close')
         
         state['balance'] = float(new_bal_d)
         state['position_amt'] = 0.0
@@ -242,7 +243,7 @@ async def execute_manual_close(bot_id):
         msg = f"{t('msg_manual_close_success')}, {t('realized_pnl')}: {sign}${realized_profit:.2f}"
         
         if action_after == 'stop':
-            await db.toggle_bot_status(bot_id, False)
+            await bot_state_cache.set_running(bot_id, False)
             msg += f" ({t('stopped')})"
         elif action_after == 'cooldown':
             state['next_trade_time'] = time.time() + 3600
@@ -252,5 +253,5 @@ async def execute_manual_close(bot_id):
             msg += f" ({t('continue_running')})"
         
         total_profit = float(bot_data.get('current_profit', 0)) + realized_profit
-        await db.update_bot_state(bot_id, state, msg, total_profit)
+        await bot_state_cache.save_state(bot_id, state, msg, total_profit)
         return realized_profit
\ No newline at end of file
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import asyncio
+from config import MARKETS_CONFIG
+
+# ================= 市场元数据服务 =================
+# 添加机器人 / 交易对列表只需要每个交易对的精度、手续费、最小下单额，
+# 不必每次都加载完整的 ccxt markets (几 MB JSON):
+# - 每个 (交易所, 市场类型) 只加载一次，整理成精简快照 {交易对: {precision, taker, maker, min_notional, min_amount}}
+# - 快照写入磁盘，重启后直接使用，不用等交易所接口
+# - 后台按 MARKETS_REFRESH 间隔刷新 (同一市场同时只有一个刷新在途)，刷新失败继续使用旧快照
+# - 查询都是内存字典查找
+# 交易对统一用页面上的写法 BTC/USDT (合约市场对应 ccxt 的 BTC/USDT:USDT)
+
+class MarketsMeta:
+    def __init__(self, cache_dir, refresh_interval=3600):
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.client_factory = None    # (source, market_type) -> 共享公共适配器，由 exchange_manager 注入
+
+        self.venues = {}              # (source, market_type) -> {'symbols': [...], 'info': {...}, 'ts'}
+        self.inflight = {}            # (source, market_type) -> Task
+        self.task = None
+
+        self.loads = 0
+        self.disk_loads = 0
+        self.errors = 0
+
+    # ---------- 磁盘快照 ----------
+
+    def _path(self, venue):
+        return os.path.join(self.cache_dir, f"{venue[0]}_{venue[1]}.json")
+
+    def _read_disk(self, venue):
+        try:
+            with open(self._path(venue), 'r', encoding='utf-8') as f:
+                snap = json.load(f)
+            if isinstance(snap, dict) and snap.get('info'):
+                return snap
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _write_disk(self, venue, snap):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._path(venue) + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snap, f, separators=(',', ':'))
+            os.replace(tmp, self._path(venue))
+        except OSError as e:
+            print(f"⚠️ [Markets] 快照写入失败 {venue}: {e}")
+
+    # ---------- 加载 ----------
+
+    @staticmethod
+    def _from_ccxt(markets, market_type):
+        info = {}
+        for m in (markets or {}).values():
+            if market_type == 'spot':
+                if not m.get('spot'): continue
+            elif not (m.get('swap') and m.get('linear')):
+                continue
+            limits = m.get('limits') or {}
+            info[f"{m['base']}/{m['quote']}"] = {
+                'precision': (m.get('precision') or {}).get('amount'),
+                'taker': m.get('taker'),
+                'maker': m.get('maker'),
+                'min_notional': (limits.get('cost') or {}).get('min'),
+                'min_amount': (limits.get('amount') or {}).get('min'),
+            }
+        return info
+
+    @staticmethod
+    def _from_pionex(rows):
+        info = {}
+        for r in rows or []:
+            try:
+                base_precision = r.get('basePrecision')
+                info[f"{r['baseCurrency']}/{r['quoteCurrency']}"] = {
+                    'precision': 10 ** -int(base_precision) if base_precision is not None else None,
+                    'taker': None,
+                    'maker': None,
+                    'min_notional': float(r['minAmount']) if r.get('minAmount') else None,
+                    'min_amount': float(r['minTradeSize']) if r.get('minTradeSize') else None,
+                }
+            except (KeyError, TypeError, ValueError):
+                continue
+        return info
+
+    async def _fetch(self, venue):
+        source, market_type = venue
+        self.loads += 1
+        try:
+            client = self.client_factory(source, market_type)
+            if client is None:
+                return self.venues.get(venue)
+            if source == 'pionex':
+                info = self._from_pionex(await client.fetch_markets_info())
+                if not info:
+                    # 交易对信息接口不可用时至少保留交易对列表
+                    info = {s: dict.fromkeys(('precision', 'taker', 'maker', 'min_notional', 'min_amount')) for s in await client.fetch_symbols()}
+            else:
+                await client.load_markets()
+                info = self._from_ccxt(client.exchange.markets, market_type)
+            if not info:
+                raise Exception("empty markets")
+            snap = {'symbols': sorted(s for s in info if s.endswith('/USDT')), 'info': info, 'ts': time.time()}
+            self.venues[venue] = snap
+            await asyncio.get_running_loop().run_in_executor(None, self._write_disk, venue, snap)
+            print(f">>> 📚 [Markets] {source} {market_type} 已加载 {len(info)} 个交易对")
+            return snap
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ [Markets] 加载失败 {venue}: {e}")
+            return self.venues.get(venue)
+        finally:
+            self.inflight.pop(venue, None)
+
+    def _refresh(self, venue):
+        task = self.inflight.get(venue)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(venue))
+            self.inflight[venue] = task
+        return task
+
+    async def ensure(self, venue):
+        """ 返回该市场的快照: 内存 -> 磁盘 -> 交易所 """
+        snap = self.venues.get(venue)
+        if snap is not None:
+            return snap
+        snap = self._read_disk(venue)
+        if snap is not None:
+            self.disk_loads += 1
+            self.venues[venue] = snap
+            if time.time() - snap.get('ts', 0) > self.refresh_interval:
+                self._refresh(venue)
+            return snap
+        return await asyncio.shield(self._refresh(venue))
+
+    # ---------- 查询 ----------
+
+    def lookup(self, venue, symbol):
+        """ 同步查询 (未加载时返回 None) """
+        snap = self.venues.get(venue)
+        return snap['info'].get(symbol) if snap else None
+
+    async def get_info(self, symbol, market_type='future', source='binance'):
+        snap = await self.ensure((source, market_type))
+        return snap['info'].get(symbol) if snap else None
+
+    async def get_symbols(self, source='binance', market_type='spot'):
+        snap = await self.ensure((source, market_type))
+        return list(snap['symbols']) if snap else []
+
+    # ---------- 后台刷新 ----------
+
+    async def start(self):
+        # 预载磁盘上已有的快照
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith('.json'): continue
+            source, _, market_type = name[:-5].partition('_')
+            if market_type and (source, market_type) not in self.venues:
+                await self.ensure((source, market_type))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(min(60, self.refresh_interval))
+            now = time.time()
+            for venue, snap in list(self.venues.items()):
+                if now - snap.get('ts', 0) >= self.refresh_interval:
+                    await self._refresh(venue)
+
+    def get_stats(self):
+        now = time.time()
+        return {
+            'venues': {f"{s}_{m}": {'symbols': len(v['info']), 'age_s': round(now - v.get('ts', 0))} for (s, m), v in self.venues.items()},
+            'loads': self.loads,
+            'disk_loads': self.disk_loads,
+            'errors': self.errors,
+        }
+
+markets_meta = MarketsMeta(MARKETS_CONFIG['cache_dir'], refresh_interval=MARKETS_CONFIG['refresh'])
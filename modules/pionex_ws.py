@@ -0,0 +1,273 @@
+import json
+import time
+import asyncio
+import aiohttp
+from config import PIONEX_CONFIG
+from modules.adapters import PionexAdapter, get_pionex_session
+from modules.kline_store import timeframe_seconds
+
+# ================= Pionex WebSocket 行情 =================
+# 接口与 ccxt.pro 一致 (watch_tickers / watch_ohlcv / fetch_ohlcv / load_markets / close)，
+# 直接作为 StreamManager 中 Pionex 市场的交易所对象使用:
+# - 价格写入 WS_PRICE_CACHE，K 线增量写入共享 K 线仓库 (由 VenueStream 完成)
+# - Pionex 公共 WS 只提供 TRADE / DEPTH 主题: 最新价取自成交推送，
+#   K 线在订阅时用 REST 取当前一根作为种子，之后按成交逐笔更新 (跨周期时开新 K 线)
+# - 服务端定时发送 PING，需回复 PONG，否则连接会被关闭
+# - 断线时所有等待中的 watch_* 抛出异常，由 VenueStream 按退避策略重连
+
+class PionexStream:
+    def __init__(self, market_type='spot', url=None, rest=None):
+        self.url = url or PIONEX_CONFIG['ws_url']
+        self.rest = rest or PionexAdapter(market_type=market_type)
+        self.has = {'watchTickers': True, 'watchOHLCV': True}
+        self.markets = {}
+
+        self.ws = None
+        self.reader = None
+        self._connecting = None
+        self.subscribed = set()       # 已订阅 TRADE 的 Pionex 交易对 (BTC_USDT)
+        self.tickers = {}             # symbol -> ticker
+        self.updated = set()          # 上次 watch_tickers 返回之后有新成交的交易对 (同 ccxt.pro，两次调用之间的更新不会丢)
+        self.candles = {}             # (symbol, timeframe) -> 当前 K 线 [ts, o, h, l, c, v]
+        self.kline_tfs = {}           # symbol -> set(timeframe)
+        self.ticker_waiters = []      # [(set(symbol), Future)]
+        self.ohlcv_waiters = {}       # (symbol, timeframe) -> [Future]
+
+    # ---------- 连接 ----------
+
+    async def _ensure_connected(self):
+        if self.ws is not None and not self.ws.closed:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        try:
+            await asyncio.shield(self._connecting)
+        finally:
+            self._connecting = None
+
+    async def _connect(self):
+        session = await get_pionex_session()
+        self.ws = await session.ws_connect(self.url, autoping=True)
+        self.reader = asyncio.create_task(self._read_loop(self.ws))
+        # 重连后恢复之前的订阅
+        for p_symbol in self.subscribed:
+            await self._send({'op': 'SUBSCRIBE', 'topic': 'TRADE', 'symbol': p_symbol})
+
+    async def _send(self, payload):
+        await self.ws.send_str(json.dumps(payload, separators=(',', ':')))
+
+    async def _subscribe(self, symbols):
+        await self._ensure_connected()
+        for symbol in symbols:
+            p_symbol = self.rest._symbol_to_pionex(symbol)
+            if p_symbol in self.subscribed: continue
+            self.subscribed.add(p_symbol)
+            await self._send({'op': 'SUBSCRIBE', 'topic': 'TRADE', 'symbol': p_symbol})
+
+    async def _read_loop(self, ws):
+        error = None
+        try:
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    await self._on_message(json.loads(msg.data))
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+        except asyncio.CancelledError:
+            error = ConnectionError("Pionex WS closed")
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            if self.ws is ws:
+                self.ws = None
+            self._fail_waiters(error or ConnectionError("Pionex WS disconnected"))
+
+    def _fail_waiters(self, error):
+        for _, future in self.ticker_waiters:
+            if not future.done(): future.set_exception(error)
+        self.ticker_waiters = []
+        for futures in self.ohlcv_waiters.values():
+            for future in futures:
+                if not future.done(): future.set_exception(error)
+        self.ohlcv_waiters = {}
+
+    # ---------- 消息处理 ----------
+
+    async def _on_message(self, data):
+        if data.get('op') == 'PING':
+            await self._send({'op': 'PONG', 'timestamp': data.get('timestamp', int(time.time() * 1000))})
+            return
+        if data.get('topic') != 'TRADE' or not data.get('data'):
+            return
+
+        symbol = self.rest._symbol_from_pionex(data.get('symbol', ''))
+        trades = sorted(data['data'], key=lambda x: x.get('timestamp', 0))
+        for trade in trades:
+            self._apply_trade(symbol, float(trade['price']), float(trade.get('size', 0)), int(trade.get('timestamp', time.time() * 1000)))
+
+        last = trades[-1]
+        self.tickers[symbol] = {
+            'symbol': symbol,
+            'last': float(last['price']),
+            'close': float(last['price']),
+            'timestamp': int(last.get('timestamp', time.time() * 1000)),
+        }
+        self.updated.add(symbol)
+        self._resolve_tickers()
+
+    def _apply_trade(self, symbol, price, size, ts):
+        for tf in self.kline_tfs.get(symbol, ()):
+            key = (symbol, tf)
+            period = timeframe_seconds(tf) * 1000
+            bucket = ts - ts % period
+            candle = self.candles.get(key)
+            if candle is None or bucket > candle[0]:
+                self.candles[key] = [bucket, price, price, price, price, size]
+            elif bucket == candle[0]:
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+                candle[5] += size
+            else:
+                continue
+            futures = self.ohlcv_waiters.pop(key, [])
+            for future in futures:
+                if not future.done(): future.set_result([list(self.candles[key])])
+
+    def _take_updated(self, symbols):
+        """ 取出 symbols 中有更新的行情 (取出后清除更新标记)，没有则返回 None """
+        ready = self.updated & symbols
+        if not ready: return None
+        self.updated -= ready
+        return {symbol: dict(self.tickers[symbol]) for symbol in ready}
+
+    def _resolve_tickers(self):
+        pending = []
+        for symbols, future in self.ticker_waiters:
+            if future.done(): continue
+            result = self._take_updated(symbols)
+            if result is not None:
+                future.set_result(result)
+            else:
+                pending.append((symbols, future))
+        self.ticker_waiters = pending
+
+    # ---------- ccxt.pro 兼容接口 ----------
+
+    async def watch_tickers(self, symbols):
+        """ 返回上次调用之后有新成交的全部交易对 {symbol: ticker}；还没有更新时等待任一交易对的下一笔成交 """
+        await self._subscribe(symbols)
+        symbols = set(symbols)
+        result = self._take_updated(symbols)
+        if result is not None:
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self.ticker_waiters.append((symbols, future))
+        return await future
+
+    async def watch_ohlcv(self, symbol, timeframe='1m'):
+        """ 等待该周期 K 线的下一次更新，返回 [[ts, o, h, l, c, v]] (当前这一根) """
+        key = (symbol, timeframe)
+        if timeframe not in self.kline_tfs.get(symbol, ()):
+            # 用 REST 取当前一根作为种子，保证开盘价/高低点完整
+            bars = await self.rest.fetch_ohlcv(symbol, timeframe, limit=2)
+            if bars:
+                self.candles[key] = list(bars[-1])
+            self.kline_tfs.setdefault(symbol, set()).add(timeframe)
+        await self._subscribe([symbol])
+        future = asyncio.get_running_loop().create_future()
+        self.ohlcv_waiters.setdefault(key, []).append(future)
+        return await future
+
+    async def fetch_ohlcv(self, symbol, timeframe='15m', limit=100):
+        return await self.rest.fetch_ohlcv(symbol, timeframe, limit=limit)
+
+    async def load_markets(self):
+        if not self.markets:
+            symbols = await self.rest.fetch_symbols()
+            self.markets = {s: {'symbol': s} for s in symbols}
+        return self.markets
+
+    async def close(self):
+        ws, self.ws = self.ws, None
+        if self.reader:
+            self.reader.cancel()
+            try:
+                await self.reader
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.reader = None
+        if ws is not None and not ws.closed:
+            await ws.close()
+        self._fail_waiters(ConnectionError("Pionex WS closed"))
+        await self.rest.close()
+
+# ================= 本地模拟服务器 =================
+# python -m modules.pionex_ws
+# 启动一个模拟 Pionex 公共 WS (PING/PONG + TRADE 推送)，用 PionexStream 连接并打印收到的价格/K 线
+
+async def _mock_server(host='127.0.0.1', port=8765, interval=0.2):
+    from aiohttp import web
+
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        symbols = set()
+
+        async def pump():
+            price = 100.0
+            k = 0
+            while not ws.closed:
+                await asyncio.sleep(interval)
+                k += 1
+                if k % 10 == 0:
+                    await ws.send_str(json.dumps({'op': 'PING', 'timestamp': int(time.time() * 1000)}))
+                for p_symbol in list(symbols):
+                    price *= 1.0005 if k % 3 else 0.999
+                    await ws.send_str(json.dumps({
+                        'topic': 'TRADE', 'symbol': p_symbol,
+                        'data': [{'symbol': p_symbol, 'price': f"{price:.4f}", 'size': '0.01', 'side': 'BUY',
+                                  'timestamp': int(time.time() * 1000)}],
+                    }))
+
+        task = asyncio.create_task(pump())
+        async for msg in ws:
+            data = json.loads(msg.data)
+            if data.get('op') == 'SUBSCRIBE':
+                symbols.add(data['symbol'])
+            elif data.get('op') == 'PONG':
+                print(f"   mock: PONG {data.get('timestamp')}")
+        task.cancel()
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/wsPub', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+class _MockRest:
+    """ 模拟服务器只有 WS，K 线种子直接返回空 """
+    def _symbol_to_pionex(self, symbol): return symbol.upper().replace('/', '_')
+    def _symbol_from_pionex(self, p_symbol): return p_symbol.replace('_', '/')
+    async def fetch_ohlcv(self, *args, **kwargs): return []
+    async def fetch_symbols(self): return []
+    async def close(self): pass
+
+if __name__ == '__main__':
+    async def _demo():
+        runner = await _mock_server()
+        stream = PionexStream(url='http://127.0.0.1:8765/wsPub', rest=_MockRest())
+        try:
+            for _ in range(5):
+                print("ticker:", await stream.watch_tickers(['BTC/USDT', 'ETH/USDT']))
+            for _ in range(5):
+                print("kline:", await stream.watch_ohlcv('BTC/USDT', '1m'))
+        finally:
+            await stream.close()
+            await runner.cleanup()
+            from modules.adapters import close_pionex_session
+            await close_pionex_session()
+
+    asyncio.run(_demo())
@@ -0,0 +1,205 @@
+import time
+from config import PORTFOLIO_CONFIG
+from modules import json_codec
+from modules.database import db
+from modules.globals import RUNTIME_CACHE
+
+# ================= 用户看板快照 =================
+# 看板每个浏览器标签页都在轮询 /get_dashboard_stats，原来每次都要查库、解码全部机器人的 config/state 再逐个计算盈亏
+# 改为按 (用户, 模式) 在内存里维护一份快照:
+# - 引擎每次执行完机器人 (调度器 _run_one) 用最新行数据和市价重算该机器人的条目，内容有变化才递增版本号
+# - 分片模式下由 Worker 计算条目，随 runtime 消息回传给 Web 进程
+# - 接口直接返回序列化好的同一份响应体，并用版本号生成 ETag，内容未变化的轮询返回 304
+# - 首次访问或超过 PORTFOLIO_RESYNC 秒后从库里全量加载一次 (兜底引擎之外的修改: 改名、移动文件夹、回测模式机器人等)
+
+def build_entry(bot, market_price):
+    """ 单个机器人的看板条目 (浮动盈亏、回撤、策略信息) """
+    state = bot.get('state', {})
+    cfg = bot.get('config', {})
+    strategy_type = bot.get('strategy_type', 'fvg')
+
+    pos_amt = float(state.get('position_amt', 0))
+    avg_price = float(state.get('avg_price', 0))
+    total_cost = float(state.get('total_cost', 0))
+    realized_profit = float(bot['current_profit'] or 0)
+
+    # 计算浮动盈亏与回撤
+    floating_pnl = 0.0
+    drawdown_pct = 0.0
+
+    if abs(pos_amt) > 0 and market_price > 0 and avg_price > 0:
+        direction = state.get('direction', cfg.get('direction', 'long'))
+        if direction == 'short':
+            floating_pnl = (avg_price - market_price) * abs(pos_amt)
+            drawdown_pct = (market_price - avg_price) / avg_price * 100
+        else:
+            floating_pnl = (market_price - avg_price) * abs(pos_amt)
+            drawdown_pct = (avg_price - market_price) / avg_price * 100
+
+    net_pnl = realized_profit + floating_pnl
+    direction_display = state.get('direction', cfg.get('direction', 'long')).upper()
+    leverage = float(cfg.get('leverage', 1))
+
+    # 策略特定数据
+    strat_info = {}
+    strat_info['stage'] = state.get('stage', 'IDLE') # Coffin 专用
+
+    if strategy_type == 'grid_dca':
+        strat_info['grid_anchor'] = state.get('last_level_idx', -1)
+        strat_info['is_trailing'] = state.get('is_trailing_active', False)
+        if direction_display == 'LONG':
+            strat_info['extreme'] = float(state.get('highest_price_seen', 0))
+        else:
+            strat_info['extreme'] = float(state.get('lowest_price_seen', 0))
+
+    elif strategy_type == 'coffin':
+        strat_info['sl'] = float(state.get('stop_loss_price', 0))
+        strat_info['extreme'] = float(state.get('extreme_price', 0))
+        box = state.get('coffin_5m', {})
+        if box and 'top' in box and 'bottom' in box:
+            strat_info['box_5m'] = f"${box['bottom']:.2f} - ${box['top']:.2f}"
+        else:
+            strat_info['box_5m'] = "---"
+
+    else: # FVG
+        strat_info['is_trailing'] = state.get('is_trailing_active', False)
+        if direction_display == 'LONG':
+            strat_info['extreme'] = float(state.get('highest_price_seen', 0))
+        else:
+            strat_info['extreme'] = float(state.get('lowest_price_seen', 0))
+
+    return {
+        'id': bot['id'],
+        'name': bot.get('name') or bot['symbol'],
+        'symbol': bot.get('symbol'),
+        'strategy_type': strategy_type,
+        'current_profit': realized_profit,
+        'total_balance': float(bot['total_balance'] or 0),
+        'is_running': int(bot['is_running']),
+        'status_msg': bot['status_msg'] or '',
+        'pos_amt': pos_amt,
+        'avg_price': avg_price,
+        'total_cost': total_cost,
+        'floating_pnl': floating_pnl,
+        'drawdown_pct': drawdown_pct,
+        'direction': direction_display,
+        'net_pnl': net_pnl,
+        'strat_info': strat_info,
+        'market_price': market_price,
+        'leverage': leverage,
+        'folder_id': bot.get('folder_id')
+    }
+
+class PortfolioSnapshots:
+    def __init__(self, resync_interval=30):
+        self.resync_interval = resync_interval
+        self.entries = {}         # bot_id -> (user_id, mode, entry)
+        self.members = {}         # (user_id, mode) -> set(bot_id)
+        self.seeded = {}          # (user_id, mode) -> 上次从库里全量加载的时间
+        self.versions = {}        # (user_id, mode) -> 版本号 (条目有变化就 +1)
+        self.bodies = {}          # (user_id, mode) -> (etag, 序列化后的响应体)
+        self.boot = f"{int(time.time()):x}"   # 进程重启后旧 ETag 全部失效
+
+        self.updates = 0
+        self.changes = 0
+        self.seeds = 0
+        self.served = 0
+        self.not_modified = 0
+
+    # ---------- 写入 ----------
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+        self.bodies.pop(key, None)
+
+    def put(self, user_id, mode, entry):
+        """ 写入一个条目 (内容相同则不改版本号) """
+        self.updates += 1
+        bot_id = int(entry['id'])
+        key = (user_id, mode or 'live')
+        old = self.entries.get(bot_id)
+        if old is not None and (old[0], old[1]) == key and old[2] == entry:
+            return
+        if old is not None and (old[0], old[1]) != key:
+            self._drop(bot_id)
+        self.entries[bot_id] = (key[0], key[1], entry)
+        self.members.setdefault(key, set()).add(bot_id)
+        self.changes += 1
+        self._touch(key)
+
+    def update(self, row):
+        """ 引擎执行完一个机器人后调用 (row 为包含 user_id / mode 的完整行) """
+        if not row or row.get('user_id') is None: return
+        market_price = RUNTIME_CACHE.get(int(row['id']), {}).get('market_price', 0)
+        try:
+            self.put(row['user_id'], row.get('mode'), build_entry(row, market_price))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"⚠️ [Portfolio] Bot {row.get('id')} 条目计算失败: {e}")
+
+    def export(self, bot_id):
+        """ (user_id, mode, entry)，供 Worker 回传给 Web 进程 """
+        return self.entries.get(int(bot_id))
+
+    def _drop(self, bot_id):
+        old = self.entries.pop(bot_id, None)
+        if old is None: return
+        key = (old[0], old[1])
+        members = self.members.get(key)
+        if members: members.discard(bot_id)
+        self._touch(key)
+
+    def remove(self, bot_id):
+        self._drop(int(bot_id))
+
+    def invalidate_bot(self, bot_id):
+        """ 机器人被 API 修改: 所属用户的快照下次访问时重新从库加载 """
+        old = self.entries.get(int(bot_id))
+        if old is not None:
+            self.seeded.pop((old[0], old[1]), None)
+
+    def invalidate_user(self, user_id):
+        for key in [k for k in self.seeded if k[0] == user_id]:
+            self.seeded.pop(key, None)
+
+    # ---------- 读取 ----------
+
+    async def _seed(self, key):
+        user_id, mode = key
+        bots = await db.get_all_bots(user_id, mode=mode)
+        self.seeds += 1
+        seen = set()
+        for bot in bots:
+            bot_id = int(bot['id'])
+            seen.add(bot_id)
+            market_price = RUNTIME_CACHE.get(bot_id, {}).get('market_price', 0)
+            self.put(user_id, mode, build_entry(bot, market_price))
+        for bot_id in list(self.members.get(key, ())):
+            if bot_id not in seen:
+                self._drop(bot_id)
+        self.seeded[key] = time.time()
+
+    async def get(self, user_id, mode='live'):
+        """ 返回 (etag, 响应体 JSON 字符串) """
+        key = (user_id, mode or 'live')
+        if time.time() - self.seeded.get(key, 0) > self.resync_interval:
+            await self._seed(key)
+        self.served += 1
+        cached = self.bodies.get(key)
+        if cached is None:
+            data = [self.entries[bot_id][2] for bot_id in sorted(self.members.get(key, ()))]
+            etag = f'"{self.boot}-{user_id}-{key[1]}-{self.versions.get(key, 0)}"'
+            cached = self.bodies[key] = (etag, json_codec.dumps(data))
+        return cached
+
+    def get_stats(self):
+        return {
+            'bots': len(self.entries),
+            'users': len(self.members),
+            'updates': self.updates,
+            'changes': self.changes,
+            'seeds': self.seeds,
+            'served': self.served,
+            'not_modified': self.not_modified,
+        }
+
+portfolio = PortfolioSnapshots(resync_interval=PORTFOLIO_CONFIG['resync'])
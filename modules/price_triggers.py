@@ -0,0 +1,84 @@
+import bisect
+
+# ================= 价格触发索引 =================
+# 策略在没有动作时给出 "下一次可能产生动作的价格区间" (lo, hi):
+#   价格 <= lo 或 >= hi 时才需要重新评估 (补仓线、止盈、止损、追踪止盈、Coffin 止损价...)
+# 每个交易对维护两条有序阈值表，价格推送到达时用 bisect 只取出被穿越的机器人，
+# 单次推送的成本从 O(该交易对全部机器人) 降为 O(log n + 被触发的机器人)
+# 没有给出区间 (None) 的机器人每次推送都评估，行为与原来一致
+
+# 阈值向内收一点，避免浮点误差导致刚好穿越时漏评估 (多评估一次无副作用)
+_EPS = 1e-9
+
+class PriceTriggerIndex:
+    def __init__(self):
+        self.lows = {}      # key -> ([price...], [bot_id...]) 升序，价格 <= price 时触发
+        self.highs = {}     # key -> ([price...], [bot_id...]) 升序，价格 >= price 时触发
+        self.always = {}    # key -> set(bot_id) 没有阈值，每次推送都评估
+        self.bands = {}     # bot_id -> (key, lo, hi)，lo/hi 均为 None 表示在 always 中
+
+    @staticmethod
+    def _insert(table, key, price, bot_id):
+        prices, ids = table.setdefault(key, ([], []))
+        idx = bisect.bisect_right(prices, price)
+        prices.insert(idx, price)
+        ids.insert(idx, bot_id)
+
+    @staticmethod
+    def _delete(table, key, price, bot_id):
+        entry = table.get(key)
+        if not entry: return
+        prices, ids = entry
+        idx = bisect.bisect_left(prices, price)
+        while idx < len(prices) and prices[idx] == price:
+            if ids[idx] == bot_id:
+                del prices[idx]
+                del ids[idx]
+                break
+            idx += 1
+        if not prices:
+            table.pop(key, None)
+
+    def set(self, bot_id, key, band):
+        """ 登记机器人的触发区间: band = (lo, hi)，lo <= 0 / hi = inf 表示该方向没有阈值；None 表示每次都评估 """
+        self.remove(bot_id)
+        if key is None: return
+        lo = hi = None
+        if band is not None:
+            lo, hi = band
+            lo = lo * (1 + _EPS) if lo and lo > 0 else None
+            hi = hi * (1 - _EPS) if hi is not None and hi != float('inf') else None
+        if lo is None and hi is None:
+            # 没有任何价格阈值: 保守起见每次推送都评估
+            self.always.setdefault(key, set()).add(bot_id)
+        if lo is not None: self._insert(self.lows, key, lo, bot_id)
+        if hi is not None: self._insert(self.highs, key, hi, bot_id)
+        self.bands[bot_id] = (key, lo, hi)
+
+    def remove(self, bot_id):
+        band = self.bands.pop(bot_id, None)
+        if band is None: return
+        key, lo, hi = band
+        if lo is None and hi is None:
+            ids = self.always.get(key)
+            if ids:
+                ids.discard(bot_id)
+                if not ids: self.always.pop(key, None)
+            return
+        if lo is not None: self._delete(self.lows, key, lo, bot_id)
+        if hi is not None: self._delete(self.highs, key, hi, bot_id)
+
+    def hits(self, key, price):
+        """ 本次价格需要评估的机器人 """
+        triggered = set(self.always.get(key, ()))
+        lows = self.lows.get(key)
+        if lows:
+            triggered.update(lows[1][bisect.bisect_left(lows[0], price):])
+        highs = self.highs.get(key)
+        if highs:
+            triggered.update(highs[1][:bisect.bisect_right(highs[0], price)])
+        return triggered
+
+    def get_stats(self):
+        always = sum(len(ids) for ids in self.always.values())
+        return {'armed': len(self.bands) - always, 'always': always}
@@ -0,0 +1,195 @@
+import time
+import heapq
+import asyncio
+from collections import deque
+from config import RATE_LIMIT_CONFIG
+
+# ================= 全局请求权重限流 =================
+# 同一台服务器上所有用户的交易所实例共用一个出口 IP，交易所按 IP 统计请求权重 (币安 429 / 418 封禁)
+# 因此限流按 (交易所, 市场类型, public/signed) 进程内共享，而不是每个 ccxt 实例各自节流:
+# - 令牌桶，权重沿用 ccxt 的接口成本 (calculate_rate_limiter_cost)，速率 = 1000 / rateLimit 单位/秒
+# - 额度不足时按优先级排队: 下单/账户 > 行情/K 线 > 交易对列表/市场信息 > 批量历史下载
+# - 交易所返回限流/封禁 (DDoSProtection / RateLimitExceeded) 时整个桶暂停一段时间
+# - get_stats 输出各桶最近 60 秒的利用率、排队数与等待时间
+
+PRIORITY_ORDER = 0      # 签名请求: 下单、撤单、余额
+PRIORITY_MARKET = 1     # 行情、K 线
+PRIORITY_META = 2       # 交易对列表、市场信息 (load_markets)
+PRIORITY_BULK = 3       # 历史数据下载
+
+# 属于市场信息的接口路径 (签名的 capital/config 也由 load_markets 发起)
+_META_PATHS = ('exchangeInfo', 'capital/config/getall', 'margin/allPairs', 'margin/isolated/allPairs')
+
+_WINDOW = 60.0
+
+class WeightBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate                # 每秒补充的权重
+        self.capacity = capacity        # 桶容量 (允许的突发)
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+        self.waiters = []               # 堆 (priority, seq, cost, future)
+        self.seq = 0
+        self.drainer = None
+
+        self.requests = 0
+        self.weight = 0.0
+        self.queued = 0
+        self.wait_total = 0.0
+        self.max_wait = 0.0
+        self.bans = 0
+        self.recent = deque()           # (ts, cost) 最近 60 秒
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, cost, now):
+        self.tokens -= cost
+        self.requests += 1
+        self.weight += cost
+        self.recent.append((now, cost))
+
+    def _ready(self, cost, now):
+        # 单个请求权重超过容量时，桶满即可放行 (令牌记为负数，后续请求相应等待)
+        return now >= self.paused_until and self.tokens >= min(cost, self.capacity)
+
+    async def acquire(self, cost, priority):
+        now = time.monotonic()
+        self._refill(now)
+        if not self.waiters and self._ready(cost, now):
+            self._take(cost, now)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, self.seq, cost, future))
+        self.seq += 1
+        self.queued += 1
+        if self.drainer is None or self.drainer.done():
+            self.drainer = asyncio.create_task(self._drain())
+
+        await future
+        waited = time.monotonic() - now
+        self.wait_total += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def _drain(self):
+        """ 按优先级放行排队请求；等待期间新到的高优先级请求会排到前面 """
+        while self.waiters:
+            _, _, cost, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            now = time.monotonic()
+            self._refill(now)
+            if not self._ready(cost, now):
+                need = min(cost, self.capacity) - self.tokens
+                delay = max(self.paused_until - now, need / self.rate if need > 0 else 0)
+                await asyncio.sleep(max(delay, 0.001))
+                continue
+            heapq.heappop(self.waiters)
+            self._take(cost, now)
+            future.set_result(None)
+
+    def pause(self, seconds):
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+        self.bans += 1
+
+    def get_stats(self, now=None):
+        now = now or time.monotonic()
+        while self.recent and now - self.recent[0][0] > _WINDOW:
+            self.recent.popleft()
+        used = sum(cost for _, cost in self.recent)
+        return {
+            'rate': round(self.rate, 2),
+            'utilization': round(used / (self.rate * _WINDOW), 3) if self.rate else 0,
+            'waiting': sum(1 for w in self.waiters if not w[3].done()),
+            'requests': self.requests,
+            'weight': round(self.weight, 1),
+            'queued': self.queued,
+            'avg_wait_ms': round(self.wait_total / self.queued * 1000, 1) if self.queued else 0,
+            'max_wait_ms': round(self.max_wait * 1000, 1),
+            'paused_s': round(max(0.0, self.paused_until - now), 1),
+            'bans': self.bans,
+        }
+
+class RateLimiter:
+    def __init__(self, headroom=0.8, burst=2.0, ban_pause=30):
+        self.headroom = headroom        # 只使用交易所额度的这一比例，给网页端/其他工具留余量
+        self.burst = burst              # 桶容量 = 速率 x burst 秒
+        self.ban_pause = ban_pause      # 被限流/封禁后整个桶暂停的秒数
+        self.share = 1.0                # 分片模式下每个进程分到的额度比例
+        self.buckets = {}               # (source, market_type, scope) -> WeightBucket
+
+    def bucket(self, venue, signed, rate):
+        key = (*venue, 'signed' if signed else 'public')
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate = rate * self.headroom * self.share
+            bucket = self.buckets[key] = WeightBucket(rate, max(1.0, rate * self.burst))
+        return bucket
+
+    def set_share(self, share):
+        """ 多进程共用出口 IP 时按比例分配额度 (已创建的桶同步缩放) """
+        for bucket in self.buckets.values():
+            bucket.rate = bucket.rate / self.share * share
+            bucket.capacity = max(1.0, bucket.rate * self.burst)
+            bucket.tokens = min(bucket.tokens, bucket.capacity)
+        self.share = share
+
+    async def acquire(self, venue, cost=1, signed=False, priority=PRIORITY_MARKET, rate=10):
+        await self.bucket(venue, signed, rate).acquire(cost, priority)
+
+    def penalize(self, venue, signed, rate=10, seconds=None):
+        self.bucket(venue, signed, rate).pause(seconds or self.ban_pause)
+        print(f"⛔ [RateLimit] {venue[0]} {venue[1]} {'signed' if signed else 'public'} 被限流，暂停 {seconds or self.ban_pause}s")
+
+    def attach(self, exchange, venue, priority=None):
+        """ 接管 ccxt 实例的节流: 关闭实例自带的 throttle，所有 REST 请求改走共享令牌桶 """
+        if getattr(exchange, '_shared_rate_limit', False):
+            return exchange
+        # ccxt 的 rateLimit 是每单位成本的毫秒数
+        rate = 1000.0 / (getattr(exchange, 'rateLimit', 0) or 100)
+        fetch2 = exchange.fetch2
+
+        async def limited_fetch2(path, api='public', method='GET', params={}, headers=None, body=None, config={}):
+            api_name = api if isinstance(api, str) else '/'.join(api)
+            signed = 'private' in api_name.lower() or api_name.startswith(('sapi', 'papi'))
+            try:
+                cost = exchange.calculate_rate_limiter_cost(api, method, path, params, config)
+            except Exception:
+                cost = config.get('cost', 1) if isinstance(config, dict) else 1
+            if priority is not None:
+                prio = priority
+            elif any(p in path for p in _META_PATHS):
+                prio = PRIORITY_META
+            else:
+                prio = PRIORITY_ORDER if signed else PRIORITY_MARKET
+            await self.acquire(venue, cost, signed, prio, rate)
+            try:
+                return await fetch2(path, api, method, params, headers, body, config)
+            except Exception as e:
+                # ccxt: 418/429 映射为 DDoSProtection / RateLimitExceeded
+                if type(e).__name__ in ('DDoSProtection', 'RateLimitExceeded'):
+                    self.penalize(venue, signed, rate)
+                raise
+
+        exchange.enableRateLimit = False
+        exchange.fetch2 = limited_fetch2
+        exchange._shared_rate_limit = True
+        return exchange
+
+    def get_stats(self):
+        now = time.monotonic()
+        return {'_'.join(key): bucket.get_stats(now) for key, bucket in self.buckets.items()}
+
+rate_limiter = RateLimiter(
+    headroom=RATE_LIMIT_CONFIG['headroom'],
+    burst=RATE_LIMIT_CONFIG['burst'],
+    ban_pause=RATE_LIMIT_CONFIG['ban_pause']
+)
@@ -0,0 +1,415 @@
+import time
+import heapq
+import bisect
+import asyncio
+from modules.database import db
+from modules.globals import WS_PRICE_CACHE, RUNTIME_CACHE, tick_bus
+from modules.exchange_manager import stream_manager, get_stream_price
+from modules.bot_logic import run_bot_logic
+from modules.state_cache import bot_state_cache
+from modules.kline_store import kline_store, bot_kline_needs, bot_venue
+from modules.price_triggers import PriceTriggerIndex
+from modules.portfolio import portfolio
+
+# ================= 事件驱动调度器 =================
+# 取代原来每秒全表扫描 + 全量 gather 的轮询方式:
+# 1. 内存中维护机器人注册表，只在 API 创建/修改/启停/删除时增量刷新
+# 2. 机器人只在 "所属交易对有新 WS 价格" 或 "自身定时器到期" 时被唤醒
+#    价格由 tick_bus 按交易对推送，收到即执行 (不等扫描周期)；执行中的机器人合并为一次补跑
+#    只唤醒价格穿越了自身触发阈值 (补仓线/止盈/止损/追踪) 的机器人，见 PriceTriggerIndex
+# 3. 统计每秒执行次数 (ticks/s)、调度延迟 (lag) 与 tick -> 决策延迟直方图
+# 4. 按机器人用到的 K 线周期维护 WS K 线订阅，K 线收盘时立即唤醒相关机器人
+
+class LatencyHistogram:
+    """ 固定分桶的延迟直方图 (毫秒)，累计计数，分位数取所在桶的上界 """
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = max(0.0, seconds * 1000)
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.sum_ms += ms
+        if ms > self.max_ms: self.max_ms = ms
+
+    def quantile(self, q):
+        if not self.total: return 0.0
+        target = q * self.total
+        seen = 0
+        for k, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return float(self.BUCKETS_MS[k]) if k < len(self.BUCKETS_MS) else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def snapshot(self):
+        buckets = {f"<={b}ms": n for b, n in zip(self.BUCKETS_MS, self.counts)}
+        buckets[f">{self.BUCKETS_MS[-1]}ms"] = self.counts[-1]
+        return {
+            'count': self.total,
+            'avg_ms': round(self.sum_ms / self.total, 2) if self.total else 0.0,
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'buckets': buckets,
+        }
+
+class BotScheduler:
+    def __init__(self, scan_interval=0.1, poll_interval=1.0, ws_idle_interval=5.0,
+                 idle_interval=15.0, resync_interval=60.0, run_timeout=8.0):
+        self.scan_interval = scan_interval        # 调度循环扫描间隔
+        self.poll_interval = poll_interval        # 无 WS 推送 (REST 轮询) 的机器人执行间隔
+        self.ws_idle_interval = ws_idle_interval  # 有 WS 推送但价格未变动时的兜底间隔 (冷却/定投等时间逻辑)
+        self.idle_interval = idle_interval        # 已停止机器人的预览刷新间隔 (市价/梯子)
+        self.resync_interval = resync_interval    # 全量对账间隔 (兜底防止漏通知)
+        self.run_timeout = run_timeout
+
+        self.bots = {}            # bot_id -> 引擎行数据 (仅用于路由/排程，执行时从状态缓存读取最新行)
+        self.symbol_index = {}    # (交易所, 市场类型, symbol) -> set(bot_id)，与 WS_PRICE_CACHE 的键一致
+        self.kline_index = {}     # bot_id -> (venue, {timeframe: 根数})
+        self.triggers = PriceTriggerIndex()   # 价格触发区间 (每次执行后由策略重新登记)
+        self.timers = []          # 最小堆 [(due_ts, bot_id)]
+        self.next_due = {}        # bot_id -> 最近一次待触发时间 (堆中其余条目视为过期)
+        self.last_tick_ts = {}    # bot_id -> 已处理过的 WS 价格时间戳
+        self.pending_ticks = {}   # bot_id -> 执行期间到达的最新价格时间戳 (结束后补跑一次)
+        self.inflight = set()
+        self.running = False
+        self.task = None
+        self.last_resync = 0
+
+        # 分片模式挂钩 (单进程模式保持默认值)
+        self.owns = lambda bot_id: True          # Worker: 只调度哈希环上归属自己的机器人
+        self.symbol_sink = None                  # Worker: 把需要的交易对上报给协调器
+        self.on_run_done = None                  # Worker: 把市价/梯子回传给 Web 进程
+        self.forward = None                      # Web 进程: 把 API 通知转发给协调器
+
+        # 统计
+        self._tick_count = 0
+        self._window_start = time.time()
+        self._lag_sum = 0.0
+        self._lag_n = 0
+        self._lag_max = 0.0
+        self.stats = {'ticks_per_sec': 0.0, 'lag_avg_ms': 0.0, 'lag_max_ms': 0.0}
+        self.candle_wakeups = 0
+        self.coalesced_ticks = 0
+        self.tick_evals = 0       # 推送唤醒的机器人次数
+        self.tick_skips = 0       # 价格在触发区间内、被跳过的机器人次数
+        self.tick_latency = LatencyHistogram()
+
+        kline_store.on_close(self._on_candle_close)
+
+    # ---------- 注册表维护 ----------
+
+    @staticmethod
+    def _price_key(row):
+        symbol = row.get('symbol') or row.get('config', {}).get('symbol')
+        if not symbol: return None
+        return (*bot_venue(row), symbol)
+
+    def _index_add(self, bot_id, row):
+        key = self._price_key(row)
+        if key:
+            if key not in self.symbol_index:
+                tick_bus.subscribe(key, self._on_tick)
+            self.symbol_index.setdefault(key, set()).add(bot_id)
+        # 配置/状态可能已变: 先按 "每次都评估" 登记，执行一次后由策略给出新的区间
+        self.triggers.set(bot_id, key, None)
+        self.kline_index[bot_id] = (bot_venue(row), bot_kline_needs(row))
+
+    def _index_remove(self, bot_id):
+        self.kline_index.pop(bot_id, None)
+        self.triggers.remove(bot_id)
+        row = self.bots.get(bot_id)
+        if not row: return
+        key = self._price_key(row)
+        ids = self.symbol_index.get(key)
+        if ids:
+            ids.discard(bot_id)
+            if not ids:
+                self.symbol_index.pop(key, None)
+                tick_bus.unsubscribe(key, self._on_tick)
+
+    def _schedule(self, bot_id, due_ts):
+        pending = self.next_due.get(bot_id)
+        if pending is not None and pending <= due_ts:
+            return
+        self.next_due[bot_id] = due_ts
+        heapq.heappush(self.timers, (due_ts, bot_id))
+
+    def upsert(self, row):
+        bot_id = int(row['id'])
+        if not self.owns(bot_id):
+            if bot_id in self.bots: self.remove_bot(bot_id)
+            return
+        self._index_remove(bot_id)
+        self.bots[bot_id] = row
+        bot_state_cache.put(row)
+        self._index_add(bot_id, row)
+        self._schedule(bot_id, time.time())
+        self._sync_symbols()
+
+    def remove_bot(self, bot_id):
+        portfolio.remove(bot_id)
+        if self.forward:
+            self.forward.remove_bot(bot_id)
+            return
+        bot_id = int(bot_id)
+        self._index_remove(bot_id)
+        self.bots.pop(bot_id, None)
+        self.last_tick_ts.pop(bot_id, None)
+        self.pending_ticks.pop(bot_id, None)
+        self.next_due.pop(bot_id, None)
+        bot_state_cache.invalidate(bot_id)
+        self._sync_symbols()
+
+    async def refresh_bot(self, bot_id):
+        """ API 修改机器人后调用: 重新读取该机器人一行数据 """
+        if bot_id is None: return
+        portfolio.invalidate_bot(bot_id)
+        if self.forward:
+            self.forward.refresh_bot(bot_id)
+            return
+        # API 已经直接写库，丢弃旧缓存后重新读取
+        bot_state_cache.invalidate(bot_id)
+        row = await bot_state_cache.get(bot_id)
+        if row:
+            self.upsert(row)
+        else:
+            self.remove_bot(bot_id)
+
+    async def refresh_user(self, user_id):
+        """ 用户切换交易所或修改 API Key 后，刷新其全部机器人 """
+        portfolio.invalidate_user(user_id)
+        if self.forward:
+            self.forward.refresh_user(user_id)
+            return
+        bot_state_cache.invalidate_user(user_id)
+        ids = [bid for bid, row in self.bots.items() if row.get('user_id') == user_id]
+        for bid in ids:
+            await self.refresh_bot(bid)
+
+    async def resync(self):
+        """ 全量对账 (启动时 + 低频兜底) """
+        rows = await db.get_all_bots_for_engine()
+        seen = set()
+        for row in rows or []:
+            bot_id = int(row['id'])
+            if not self.owns(bot_id):
+                continue
+            seen.add(bot_id)
+            if bot_id in self.inflight:
+                continue
+            self.upsert(row)
+        for bot_id in list(self.bots.keys()):
+            if bot_id not in seen:
+                self.remove_bot(bot_id)
+        self.last_resync = time.time()
+
+    def _sync_symbols(self):
+        # 动态管理 WebSocket 订阅: 按 (交易所, 市场类型) 分组，每个市场一组连接
+        target_symbols = {}   # venue -> set(symbol)
+        target_klines = {}    # venue -> {(symbol, timeframe): 根数 (取最大值)}
+        for source, market_type, symbol in self.symbol_index.keys():
+            target_symbols.setdefault((source, market_type), set()).add(symbol)
+        for bot_id, (venue, needs) in self.kline_index.items():
+            key = self._price_key(self.bots[bot_id])
+            if not key: continue
+            symbol = key[2]
+            venue_needs = target_klines.setdefault(venue, {})
+            for tf, limit in needs.items():
+                venue_needs[(symbol, tf)] = max(venue_needs.get((symbol, tf), 0), limit)
+        if self.symbol_sink:
+            self.symbol_sink(target_symbols, target_klines)
+        else:
+            stream_manager.update_symbols(target_symbols)
+            stream_manager.update_klines(target_klines)
+
+    def _on_candle_close(self, venue, symbol, timeframe, candle):
+        # K 线收盘: 立即唤醒用到该周期的运行中机器人 (不等下一次价格推送/定时器)
+        now = time.time()
+        for bot_id in self.symbol_index.get((*venue, symbol), ()):
+            row = self.bots.get(bot_id)
+            if not row or not row.get('is_running'): continue
+            _, needs = self.kline_index.get(bot_id, (None, {}))
+            if timeframe in needs:
+                self.candle_wakeups += 1
+                self._schedule(bot_id, now)
+
+    # ---------- 唤醒判断 ----------
+
+    def _is_ws_fed(self, row, now):
+        key = self._price_key(row)
+        return bool(key) and get_stream_price(key, now) > 0
+
+    def _next_interval(self, row, now):
+        if not row.get('is_running'):
+            return self.idle_interval
+        if self._is_ws_fed(row, now):
+            return self.ws_idle_interval
+        return self.poll_interval
+
+    def _on_tick(self, key, data):
+        """ 价格推送: 立即执行该交易对下的运行中机器人，执行中的只记下最新时间戳 (合并为一次补跑) """
+        if not self.running: return
+        tick_ts = data['ts']
+        hits = self.triggers.hits(key, data['price'])
+        self.tick_evals += len(hits)
+        self.tick_skips += len(self.symbol_index.get(key, ())) - len(hits)
+        for bot_id in hits:
+            row = self.bots.get(bot_id)
+            if not row or not row.get('is_running'): continue
+            if tick_ts <= self.last_tick_ts.get(bot_id, 0): continue
+            if bot_id in self.inflight:
+                if bot_id in self.pending_ticks: self.coalesced_ticks += 1
+                self.pending_ticks[bot_id] = tick_ts
+                continue
+            self._dispatch(bot_id, tick_ts, tick_ts)
+
+    def _collect_due(self, now):
+        # 定时器唤醒 (价格唤醒由 _on_tick 推送触发)
+        due = {}
+        while self.timers and self.timers[0][0] <= now:
+            due_ts, bot_id = heapq.heappop(self.timers)
+            if self.next_due.get(bot_id) != due_ts:
+                continue
+            self.next_due.pop(bot_id, None)
+            due[bot_id] = due_ts
+        return due
+
+    # ---------- 执行 ----------
+
+    def _dispatch(self, bot_id, due_ts, tick_ts=None):
+        self.inflight.add(bot_id)
+        asyncio.create_task(self._run_one(bot_id, due_ts, tick_ts))
+
+    async def _run_one(self, bot_id, due_ts, tick_ts=None):
+        row = self.bots.get(bot_id)
+        if row is None:
+            # 排程后已被移除 (对账/删除)
+            self.inflight.discard(bot_id)
+            self.pending_ticks.pop(bot_id, None)
+            return
+        started = time.time()
+        key = self._price_key(row)
+        ws_data = WS_PRICE_CACHE.get(key) if key else None
+        if ws_data: self.last_tick_ts[bot_id] = ws_data['ts']
+
+        rt = RUNTIME_CACHE.get(bot_id)
+        if rt: rt['price_triggers'] = None
+
+        try:
+            # 状态缓存返回副本: 策略可以直接修改 state，只有真正落库后缓存才会更新
+            run_row = await bot_state_cache.get(bot_id)
+            if run_row is None:
+                self.remove_bot(bot_id)
+                return
+            await asyncio.wait_for(run_bot_logic(run_row), timeout=self.run_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            print(f"❌ Bot {bot_id} Error: {e}")
+        finally:
+            self.inflight.discard(bot_id)
+            self._record(started - due_ts)
+            if tick_ts is not None:
+                self.tick_latency.record(time.time() - tick_ts)
+            # 用执行后的最新行数据与市价刷新看板快照
+            if bot_id in self.bots:
+                portfolio.update(bot_state_cache.peek(bot_id) or self.bots[bot_id])
+            if self.on_run_done:
+                self.on_run_done(bot_id)
+
+            if bot_id in self.bots:
+                # 注册表指向缓存中的最新行 (启停状态决定下一次排程间隔)
+                cached = bot_state_cache.peek(bot_id)
+                if cached is not None:
+                    self.bots[bot_id] = cached
+                current = self.bots[bot_id]
+                rt = RUNTIME_CACHE.get(bot_id)
+                self.triggers.set(bot_id, self._price_key(current), rt.get('price_triggers') if rt else None)
+                now = time.time()
+                self._schedule(bot_id, now + self._next_interval(current, now))
+
+                # 执行期间有新价格: 立即补跑一次 (多个价格只补一次)
+                pending = self.pending_ticks.pop(bot_id, None)
+                if pending and pending > self.last_tick_ts.get(bot_id, 0) and current.get('is_running') and self.running:
+                    self._dispatch(bot_id, pending, pending)
+            else:
+                self.pending_ticks.pop(bot_id, None)
+
+    def _record(self, lag):
+        self._tick_count += 1
+        lag = max(0.0, lag)
+        self._lag_sum += lag
+        self._lag_n += 1
+        if lag > self._lag_max: self._lag_max = lag
+
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.stats = {
+                'ticks_per_sec': round(self._tick_count / elapsed, 2),
+                'lag_avg_ms': round(self._lag_sum / max(1, self._lag_n) * 1000, 2),
+                'lag_max_ms': round(self._lag_max * 1000, 2),
+            }
+            self._tick_count = 0
+            self._lag_sum = 0.0
+            self._lag_n = 0
+            self._lag_max = 0.0
+            self._window_start = now
+
+    def get_stats(self):
+        data = dict(self.stats)
+        data['registered'] = len(self.bots)
+        data['running'] = sum(1 for r in self.bots.values() if r.get('is_running'))
+        data['inflight'] = len(self.inflight)
+        data['candle_wakeups'] = self.candle_wakeups
+        data['coalesced_ticks'] = self.coalesced_ticks
+        data['tick_evals'] = self.tick_evals
+        data['tick_skips'] = self.tick_skips
+        data['triggers'] = self.triggers.get_stats()
+        data['tick_latency'] = self.tick_latency.snapshot()
+        return data
+
+    async def start(self):
+        if self.running: return
+        self.running = True
+        await self.resync()
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self):
+        while self.running:
+            try:
+                now = time.time()
+                if now - self.last_resync >= self.resync_interval:
+                    await self.resync()
+
+                for bot_id, due_ts in self._collect_due(now).items():
+                    if bot_id in self.inflight:
+                        # 上一次还没跑完: 合并唤醒，结束后会自动重新排程
+                        continue
+                    self._dispatch(bot_id, due_ts)
+
+                await asyncio.sleep(self.scan_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Scheduler Loop Error: {e}")
+                await asyncio.sleep(5)
+
+bot_scheduler = BotScheduler()
@@ -0,0 +1,410 @@
+import time
+import queue
+import bisect
+import asyncio
+import hashlib
+import multiprocessing as mp
+from config import ENGINE_CONFIG
+from modules.database import db
+from modules.globals import RUNTIME_CACHE, ENGINE_MODE, market_bus, tick_bus
+from modules.exchange_manager import stream_manager, close_all_exchanges
+from modules.scheduler import bot_scheduler
+from modules.state_cache import bot_state_cache
+from modules.indicator_stream import indicator_book
+from modules.kline_store import kline_store
+from modules.rate_limiter import rate_limiter
+from modules.portfolio import portfolio
+
+# ================= 一致性哈希环 =================
+
+class ConsistentHashRing:
+    """ 机器人 ID -> Worker 的一致性哈希映射 (Worker 增减时只迁移 ~1/N 的机器人) """
+    def __init__(self, nodes=None, virtual_nodes=64):
+        self.virtual_nodes = virtual_nodes
+        self.nodes = set()
+        self._keys = []
+        self._owners = {}
+        for node in nodes or []:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(str(key).encode('utf-8')).hexdigest()[:16], 16)
+
+    def _rebuild(self):
+        self._owners = {}
+        for node in self.nodes:
+            for i in range(self.virtual_nodes):
+                self._owners[self._hash(f"{node}#{i}")] = node
+        self._keys = sorted(self._owners.keys())
+
+    def add_node(self, node):
+        if node in self.nodes: return
+        self.nodes.add(node)
+        self._rebuild()
+
+    def remove_node(self, node):
+        if node not in self.nodes: return
+        self.nodes.discard(node)
+        self._rebuild()
+
+    def get_node(self, key):
+        if not self._keys: return None
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._owners[self._keys[idx]]
+
+# ================= Worker 进程 =================
+
+def worker_main(worker_id, members, virtual_nodes, inbox, outbox):
+    """ Worker 进程入口 (spawn 启动，必须是模块级函数) """
+    try:
+        asyncio.run(_worker_async(worker_id, members, virtual_nodes, inbox, outbox))
+    except KeyboardInterrupt:
+        pass
+
+async def _worker_async(worker_id, members, virtual_nodes, inbox, outbox):
+    ENGINE_MODE['sharded'] = True
+    ENGINE_MODE['worker_id'] = worker_id
+    # 交易所按 IP 限流: 各 Worker 与主进程平分额度
+    rate_limiter.set_share(1.0 / (len(members) + 1))
+    await db.init_pool()
+
+    ring = ConsistentHashRing(members, virtual_nodes)
+
+    def send(msg):
+        try:
+            outbox.put_nowait(msg)
+        except Exception as e:
+            print(f"[Worker {worker_id}] send error: {e}")
+
+    def publish_runtime(bot_id):
+        rt = RUNTIME_CACHE.get(bot_id)
+        if rt:
+            send(('runtime', worker_id, bot_id, {
+                'market_price': rt.get('market_price', 0.0), 'ladder': rt.get('ladder', []),
+                'portfolio': portfolio.export(bot_id),
+            }))
+
+    bot_scheduler.owns = lambda bot_id: ring.get_node(bot_id) == worker_id
+    bot_scheduler.symbol_sink = lambda symbols, klines: send(('symbols', worker_id, symbols, klines))
+    bot_scheduler.on_run_done = publish_runtime
+    market_bus.attach(lambda key, entry: send(('cache', worker_id, key, entry)))
+
+    async def release(epoch):
+        """ 移交第一阶段: 等待已不归属本进程的机器人执行完毕 (持锁期间的数据已写库) 后回复协调器 """
+        deadline = time.time() + bot_scheduler.run_timeout + 5
+        while any(not bot_scheduler.owns(bot_id) for bot_id in bot_scheduler.inflight) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        send(('ring_ack', worker_id, epoch))
+
+    await bot_scheduler.start()
+    send(('ready', worker_id))
+    print(f">>> 🧩 Worker {worker_id} 已就绪 (负责 {len(bot_scheduler.bots)} 个机器人)")
+
+    loop = asyncio.get_running_loop()
+    last_stats = 0
+    while True:
+        try:
+            msg = await loop.run_in_executor(None, inbox.get, True, 0.5)
+        except queue.Empty:
+            msg = ('idle',)
+        except Exception:
+            break
+        kind = msg[0]
+
+        if kind == 'prices':
+            # 逐个推送给调度器，收到即唤醒对应交易对的机器人
+            for key, data in msg[1].items():
+                tick_bus.publish(key, data)
+        elif kind == 'cache':
+            if not kline_store.ingest(msg[1], msg[2]):
+                RUNTIME_CACHE[msg[1]] = msg[2]
+        elif kind == 'refresh':
+            await bot_scheduler.refresh_bot(msg[1])
+        elif kind == 'remove':
+            bot_scheduler.remove_bot(msg[1])
+        elif kind == 'refresh_user':
+            await bot_scheduler.refresh_user(msg[1])
+        elif kind == 'ring':
+            # 成员变化: 重建哈希环并全量对账，接管/移交机器人；移交完成后确认 (新成员据此开始调度)
+            ring = ConsistentHashRing(msg[1], virtual_nodes)
+            await bot_scheduler.resync()
+            asyncio.create_task(release(msg[2]))
+        elif kind == 'stop':
+            break
+
+        now = time.time()
+        if now - last_stats >= 1:
+            stats = bot_scheduler.get_stats()
+            stats['state_cache'] = bot_state_cache.get_stats()
+            stats['db_writer'] = db.writer.get_stats()
+            stats['indicators'] = indicator_book.get_stats()
+            stats['klines'] = kline_store.get_stats()
+            stats['rate_limit'] = rate_limiter.get_stats()
+            send(('stats', worker_id, stats))
+            last_stats = now
+
+    await bot_scheduler.stop()
+    await close_all_exchanges()
+    await db.close()
+
+# ================= 协调器 (Web 进程) =================
+
+class EngineCoordinator:
+    """
+    分片引擎协调器:
+    1. 启动 N 个 Worker 进程，按机器人 ID 一致性哈希分配
+    2. Worker 加入/退出时广播新的哈希环，各 Worker 自动重新对账 (两阶段移交):
+       - 退出: 立即从哈希环移除并广播，原属机器人由其余 Worker 接管 (原 Worker 已退出，无需确认)
+       - 加入: 新 Worker 就绪后先把新哈希环发给现有成员，等它们停掉移出的机器人并确认 (ring_ack)
+         或已退出后，才把哈希环发给新 Worker 开始调度；SharedBotLock 兜底防止同一机器人被两个进程同时执行
+    3. 在 Web 进程统一维护 WebSocket 行情，并把价格/K线缓存广播给所有 Worker
+    """
+    def __init__(self, workers=2, virtual_nodes=64, monitor_interval=2.0):
+        self.num_workers = workers
+        self.virtual_nodes = virtual_nodes
+        self.monitor_interval = monitor_interval
+        self.ctx = mp.get_context('spawn')
+        self.ring = ConsistentHashRing(virtual_nodes=virtual_nodes)  # 已生效的成员 (正在调度)
+        self.joining = {}        # worker_id -> 尚未确认移交的现有成员 set(worker_id)
+        self.epoch = 0           # 哈希环广播序号 (过期的 ring_ack 忽略)
+        self.procs = {}          # worker_id -> Process
+        self.inboxes = {}        # worker_id -> Queue
+        self.outbox = None
+        self.worker_symbols = {} # worker_id -> {venue: set(symbol)}
+        self.worker_klines = {}  # worker_id -> {venue: {(symbol, timeframe): 根数}}
+        self.worker_stats = {}
+        self.tasks = []
+        self.running = False
+        self._pending_prices = {} # (交易所, 市场类型, symbol) -> 待转发的最新价格
+        self._prices_event = None
+
+    def _spawn(self, worker_id):
+        """ 启动 Worker；不在哈希环中的 (重启的) Worker 初始不负责任何机器人，就绪后按加入流程接管 """
+        inbox = self.ctx.Queue()
+        members = sorted(self.ring.nodes)
+        proc = self.ctx.Process(
+            target=worker_main,
+            args=(worker_id, members, self.virtual_nodes, inbox, self.outbox),
+            name=f"engine-worker-{worker_id}",
+            daemon=True
+        )
+        proc.start()
+        self.procs[worker_id] = proc
+        self.inboxes[worker_id] = inbox
+
+    def _send(self, worker_id, msg):
+        inbox = self.inboxes.get(worker_id)
+        if not inbox: return
+        try:
+            inbox.put_nowait(msg)
+        except Exception as e:
+            print(f"Coordinator send error (worker {worker_id}): {e}")
+
+    def _broadcast(self, msg, exclude=None):
+        for worker_id in list(self.inboxes.keys()):
+            if worker_id != exclude:
+                self._send(worker_id, msg)
+
+    def _members(self):
+        return sorted(self.ring.nodes | set(self.joining))
+
+    def _broadcast_ring(self):
+        """ 把目标哈希环 (含加入中的成员) 发给现有成员，加入中的成员重新等待全部现有成员确认 """
+        self.epoch += 1
+        members = self._members()
+        live = {worker_id for worker_id in self.ring.nodes if worker_id in self.procs}
+        for worker_id in live:
+            self._send(worker_id, ('ring', members, self.epoch))
+        for waiting in self.joining.values():
+            waiting.clear()
+            waiting.update(live)
+        self._commit_joins()
+
+    def _commit_joins(self):
+        """ 移交第二阶段: 现有成员均已确认 (或已退出) 的新成员正式加入哈希环并开始调度 """
+        for worker_id, waiting in list(self.joining.items()):
+            if waiting: continue
+            self.joining.pop(worker_id)
+            self.ring.add_node(worker_id)
+            self._send(worker_id, ('ring', self._members(), self.epoch))
+            print(f">>> 🧩 Worker {worker_id} 已加入哈希环 (成员: {sorted(self.ring.nodes)})")
+
+    # ---------- bot_scheduler.forward 接口 ----------
+
+    def refresh_bot(self, bot_id):
+        owner = self.ring.get_node(int(bot_id))
+        if owner is not None:
+            self._send(owner, ('refresh', int(bot_id)))
+
+    def remove_bot(self, bot_id):
+        self._broadcast(('remove', int(bot_id)))
+        RUNTIME_CACHE.pop(int(bot_id), None)
+
+    def refresh_user(self, user_id):
+        self._broadcast(('refresh_user', user_id))
+
+    # ---------- 生命周期 ----------
+
+    async def start(self):
+        if self.running: return
+        self.running = True
+        ENGINE_MODE['sharded'] = True
+        bot_scheduler.forward = self
+        # 机器人状态由各 Worker 写入，Web 进程的缓存会过期，改为每次直接读库
+        bot_state_cache.enabled = False
+        bot_state_cache.rows.clear()
+        self.outbox = self.ctx.Queue()
+        # Web 进程 WS 收到的 K 线增量 / 收盘直接广播给所有 Worker
+        market_bus.attach(lambda key, entry: self._broadcast(('cache', key, entry)))
+        self._prices_event = asyncio.Event()
+        tick_bus.listen_all(self._on_tick)
+        rate_limiter.set_share(1.0 / (self.num_workers + 1))
+
+        print(f">>> 🧩 启动分片引擎: {self.num_workers} 个 Worker 进程")
+        # 先登记全部成员，保证每个 Worker 启动时看到同一个哈希环
+        for worker_id in range(self.num_workers):
+            self.ring.add_node(worker_id)
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        self.tasks = [
+            asyncio.create_task(self._pump()),
+            asyncio.create_task(self._relay_prices()),
+            asyncio.create_task(self._monitor()),
+        ]
+
+    async def stop(self):
+        if not self.running: return
+        self.running = False
+        self._broadcast(('stop',))
+        for task in self.tasks:
+            task.cancel()
+        loop = asyncio.get_running_loop()
+        for worker_id, proc in list(self.procs.items()):
+            await loop.run_in_executor(None, proc.join, 5)
+            if proc.is_alive():
+                proc.terminate()
+        self.procs.clear()
+        self.inboxes.clear()
+        rate_limiter.set_share(1.0)
+        market_bus.attach(None)
+        tick_bus.remove_listener(self._on_tick)
+        bot_scheduler.forward = None
+        bot_state_cache.enabled = True
+
+    # ---------- 后台任务 ----------
+
+    async def _pump(self):
+        """ 处理 Worker 上报的消息 """
+        loop = asyncio.get_running_loop()
+        while self.running:
+            try:
+                msg = await loop.run_in_executor(None, self.outbox.get, True, 0.5)
+            except asyncio.CancelledError:
+                break
+            except queue.Empty:
+                continue
+            except Exception:
+                continue
+            kind = msg[0]
+
+            if kind == 'ready':
+                # 首次启动的 Worker 已在哈希环中 (启动时即按完整成员调度)；重启的 Worker 走加入流程
+                worker_id = msg[1]
+                if worker_id not in self.ring.nodes and worker_id in self.procs:
+                    self.joining[worker_id] = set()
+                    self._broadcast_ring()
+            elif kind == 'ring_ack':
+                _, worker_id, epoch = msg
+                if epoch == self.epoch:
+                    for waiting in self.joining.values():
+                        waiting.discard(worker_id)
+                    self._commit_joins()
+            elif kind == 'runtime':
+                _, _, bot_id, data = msg
+                snapshot = data.pop('portfolio', None)
+                RUNTIME_CACHE.setdefault(bot_id, {}).update(data)
+                if snapshot: portfolio.put(*snapshot)
+            elif kind == 'cache':
+                _, worker_id, key, entry = msg
+                # K 线进共享仓库 (Web 进程的 /kline 接口也能命中)
+                if not kline_store.ingest(key, entry):
+                    RUNTIME_CACHE[key] = entry
+                self._broadcast(('cache', key, entry), exclude=worker_id)
+            elif kind == 'symbols':
+                _, worker_id, symbols, klines = msg
+                self.worker_symbols[worker_id] = symbols
+                self.worker_klines[worker_id] = klines
+                union = {}
+                for by_venue in self.worker_symbols.values():
+                    for venue, syms in by_venue.items():
+                        union.setdefault(venue, set()).update(syms)
+                stream_manager.update_symbols(union)
+                kline_union = {}
+                for by_venue in self.worker_klines.values():
+                    for venue, needs in by_venue.items():
+                        venue_needs = kline_union.setdefault(venue, {})
+                        for key, limit in needs.items():
+                            venue_needs[key] = max(venue_needs.get(key, 0), limit)
+                stream_manager.update_klines(kline_union)
+            elif kind == 'stats':
+                self.worker_stats[msg[1]] = msg[2]
+
+    def _on_tick(self, key, data):
+        self._pending_prices[key] = data
+        self._prices_event.set()
+
+    async def _relay_prices(self):
+        """ 把 Web 进程 WS 收到的新价格推送给所有 Worker (同一批到达的价格合并为一条消息) """
+        while self.running:
+            try:
+                await self._prices_event.wait()
+                self._prices_event.clear()
+                changed, self._pending_prices = self._pending_prices, {}
+                if changed:
+                    self._broadcast(('prices', changed))
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Price Relay Error: {e}")
+                await asyncio.sleep(1)
+
+    async def _monitor(self):
+        """
+        Worker 存活检测: 退出的 Worker 先从哈希环移除 (其余 Worker 立即接管它的机器人)，
+        再以同一编号重新拉起，就绪后按加入流程 (两阶段移交) 重新分回机器人
+        """
+        while self.running:
+            try:
+                await asyncio.sleep(self.monitor_interval)
+                for worker_id, proc in list(self.procs.items()):
+                    if proc.is_alive(): continue
+                    print(f">>> ⚠️ Worker {worker_id} 已退出 (exitcode={proc.exitcode})，正在重启...")
+                    self.inboxes.pop(worker_id, None)
+                    self.procs.pop(worker_id, None)
+                    self.worker_symbols.pop(worker_id, None)
+                    self.worker_klines.pop(worker_id, None)
+                    self.worker_stats.pop(worker_id, None)
+                    self.joining.pop(worker_id, None)
+                    # 原 Worker 已退出，无需等待确认: 移出哈希环后直接广播，其余 Worker 接管
+                    self.ring.remove_node(worker_id)
+                    self._broadcast_ring()
+                    self._spawn(worker_id)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Coordinator Monitor Error: {e}")
+
+    def get_stats(self):
+        return {
+            'workers': sorted(self.ring.nodes),
+            'joining': sorted(self.joining),
+            'epoch': self.epoch,
+            'per_worker': {str(k): v for k, v in self.worker_stats.items()},
+        }
+
+engine_coordinator = EngineCoordinator(
+    workers=ENGINE_CONFIG['workers'],
+    virtual_nodes=ENGINE_CONFIG['virtual_nodes']
+)
@@ -0,0 +1,136 @@
+import copy
+from modules.database import db
+
+# ================= 机器人状态缓存 (Write-Through + 版本号) =================
+# 引擎、手动操作和 API 路由统一通过这里读写机器人行数据:
+# - 读: 命中内存直接返回副本，未命中才查库 (get_bot_full_data)
+# - 写: 先落库再更新内存，落库带 state_version 乐观锁，
+#       版本不一致 (其他进程/外部写入) 时丢弃本地缓存，由调用方下次重新读取
+
+class BotStateCache:
+    def __init__(self):
+        self.rows = {}        # bot_id -> 与 get_bot_full_data 结构一致的行数据
+        self.enabled = True   # 分片模式下 Web 进程关闭缓存 (机器人状态由 Worker 写入)
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+        # 写后队列刷新时发现版本冲突 -> 丢弃本地行
+        db.writer.on_conflict = self._on_write_conflict
+
+    @staticmethod
+    def _copy(row):
+        data = dict(row)
+        data['state'] = copy.deepcopy(row.get('state', {}))
+        data['config'] = copy.deepcopy(row.get('config', {}))
+        return data
+
+    # ---------- 读 ----------
+
+    async def get(self, bot_id):
+        """ 返回行数据副本 (调用方可以随意修改，保存时再写回) """
+        if bot_id is None: return None
+        bot_id = int(bot_id)
+        row = self.rows.get(bot_id) if self.enabled else None
+        if row is not None:
+            self.hits += 1
+            return self._copy(row)
+
+        self.misses += 1
+        row = await db.get_bot_full_data(bot_id)
+        if not row: return None
+        if self.enabled:
+            self.rows[bot_id] = row
+            return self._copy(row)
+        return row
+
+    def peek(self, bot_id):
+        """ 只读访问缓存中的行 (不复制，不查库)，未缓存返回 None """
+        if bot_id is None: return None
+        return self.rows.get(int(bot_id))
+
+    def put(self, row):
+        """ 用库里读到的整行刷新缓存: 只有库中版本更新时才覆盖 """
+        if not self.enabled or not row: return
+        bot_id = int(row['id'])
+        cached = self.rows.get(bot_id)
+        if cached is None or int(row.get('state_version') or 0) > int(cached.get('state_version') or 0):
+            self.rows[bot_id] = row
+
+    def invalidate(self, bot_id):
+        if bot_id is None: return
+        self.rows.pop(int(bot_id), None)
+
+    def _on_write_conflict(self, bot_id):
+        self.conflicts += 1
+        self.rows.pop(int(bot_id), None)
+
+    def invalidate_user(self, user_id):
+        for bot_id in [bid for bid, row in self.rows.items() if row.get('user_id') == user_id]:
+            self.rows.pop(bot_id, None)
+
+    # ---------- 写 ----------
+
+    def _expected_version(self, bot_id, version):
+        if version is not None: return version
+        cached = self.rows.get(bot_id)
+        return cached.get('state_version') if cached else None
+
+    def _after_write(self, bot_id, ok, version):
+        """ 写成功: 返回缓存行用于就地更新; 冲突: 丢弃缓存 """
+        row = self.rows.get(bot_id)
+        if not ok:
+            self.conflicts += 1
+            self.rows.pop(bot_id, None)
+            return None
+        if row is None: return None
+        if version is None:
+            # 无条件写入无法确定最新版本号，下次读取时重新加载
+            self.rows.pop(bot_id, None)
+            return None
+        row['state_version'] = int(version) + 1
+        return row
+
+    async def save_state(self, bot_id, state, status_msg=None, profit=0, version=None, logs=()):
+        """ logs: 随本次状态变化产生的成交日志 (database.log_row)，与状态同一事务写入，版本冲突时一起丢弃 """
+        bot_id = int(bot_id)
+        version = self._expected_version(bot_id, version)
+        ok = await db.update_bot_state(bot_id, state, status_msg, profit, expected_version=version, logs=logs)
+        row = self._after_write(bot_id, ok, version)
+        if row is not None:
+            row['state'] = copy.deepcopy(state)
+            row['total_balance'] = round(float(state.get('balance', 0)), 8)
+            row['current_profit'] = round(float(profit), 8)
+            if status_msg is not None:
+                row['status_msg'] = db.clip_status(status_msg)
+        return ok
+
+    async def save_config(self, bot_id, config, version=None):
+        bot_id = int(bot_id)
+        version = self._expected_version(bot_id, version)
+        ok = await db.update_bot_config(bot_id, config, expected_version=version)
+        row = self._after_write(bot_id, ok, version)
+        if row is not None:
+            row['config'] = copy.deepcopy(config)
+        return ok
+
+    async def set_running(self, bot_id, is_running, status_msg=None):
+        bot_id = int(bot_id)
+        version = self._expected_version(bot_id, None)
+        ok = await db.toggle_bot_status(bot_id, is_running, status_msg, expected_version=version)
+        row = self._after_write(bot_id, ok, version)
+        if row is not None:
+            row['is_running'] = 1 if is_running else 0
+            if status_msg is None:
+                status_msg = "🟡 Starting..." if is_running else "🛑 Stopped"
+            row['status_msg'] = status_msg
+        return ok
+
+    def get_stats(self):
+        return {
+            'cached': len(self.rows),
+            'hits': self.hits,
+            'misses': self.misses,
+            'conflicts': self.conflicts,
+        }
+
+bot_state_cache = BotStateCache()
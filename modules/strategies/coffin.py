@@ -279,5 +279,34 @@ class CoffinStrategy:
             
         return intent
 
+    def price_triggers(self, state, fvgs=None):
+        """
+        持仓中 (IN_POS) 的价格触发区间 (lo, hi): 触及 stop_loss_price 平仓，创新极值或达到保本线时上移/下移止损
+        其余阶段依赖 K 线形态，返回 None (每次都评估)
+        """
+        if state.get('stage') != 'IN_POS' or float(state.get('position_amt', 0)) == 0 or self.leverage <= 0:
+            return None
+        current_sl = float(state.get('stop_loss_price', 0))
+        extreme_price = float(state.get('extreme_price', 0))
+        if extreme_price <= 0: return None
+
+        entry_price = float(state.get('avg_price', 0))
+        is_long = (state.get('direction', self.cfg.get('direction', 'long')) == 'long')
+        be_move = self.break_even_trigger / self.leverage
+
+        # 与 analyze_market 一致: 追踪止损随当前极值已生效
+        if is_long:
+            current_sl = max(current_sl, extreme_price * (1 - self.trailing_gap))
+            lo, hi = current_sl, extreme_price
+            if entry_price > 0 and entry_price * 1.001 > current_sl:
+                hi = min(hi, entry_price * (1 + be_move))
+        else:
+            trail_sl = extreme_price * (1 + self.trailing_gap)
+            if current_sl == 0 or trail_sl < current_sl: current_sl = trail_sl
+            lo, hi = extreme_price, current_sl
+            if entry_price > 0 and entry_price * 0.999 < current_sl:
+                lo = max(lo, entry_price * (1 - be_move))
+        return (lo, hi)
+
     def generate_ladder(self, *args, **kwargs):
         return []
\ No newline at end of file
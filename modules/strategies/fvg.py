@@ -203,6 +203,55 @@ class FVGStrategy:
                 
         return intent
     
+    def price_triggers(self, state, fvgs=None):
+        """
+        analyze_market 没有动作时，下一次可能产生动作的价格区间 (lo, hi):
+        价格 <= lo 或 >= hi 才需要重新评估 (下一笔安全单 / 止盈 / 止损 / 追踪)；返回 None 表示每次都要评估
+        """
+        pos_amt = float(state.get('position_amt', 0))
+        avg_price = float(state.get('avg_price', 0))
+        if pos_amt == 0 or avg_price <= 0 or self.leverage <= 0:
+            return None
+
+        is_long = (self.direction == 'long')
+        fee_impact = self.fee_rate * 2 * 100 * self.leverage
+        lo, hi = 0.0, float('inf')
+
+        # 止损: 扣费后 ROE < -sl
+        sl_pct = float(self.cfg.get('stop_loss_percent', 0))
+        if sl_pct > 0:
+            move = (fee_impact - sl_pct) / self.leverage / 100
+            if is_long: lo = max(lo, avg_price * (1 + move))
+            else: hi = min(hi, avg_price * (1 - move))
+
+        if state.get('is_trailing_active', False):
+            trailing_dev = float(self.cfg.get('trailing_dev', 0.2))
+            if is_long:
+                high_seen = float(state.get('highest_price_seen', 0) or 0)
+                if high_seen <= 0: return None
+                hi = min(hi, high_seen)
+                lo = max(lo, high_seen * (1 - trailing_dev / 100))
+            else:
+                low_seen = float(state.get('lowest_price_seen', 0) or 0)
+                if low_seen <= 0: return None
+                lo = max(lo, low_seen)
+                hi = min(hi, low_seen * (1 + trailing_dev / 100))
+            return (lo, hi)
+
+        # 止盈: 扣费后 ROE >= tp_target
+        tp_target = float(self.cfg.get('tp_target', 1.2))
+        move = (tp_target + fee_impact) / self.leverage / 100
+        if is_long: hi = min(hi, avg_price * (1 + move))
+        else: lo = max(lo, avg_price * (1 - move))
+
+        # 下一笔安全单: 用全部 FVG 计算 (有效 FVG 随价格减少，触发价只会更远，这里取最近的一档)
+        current_so = int(state.get('current_so_index', 1))
+        if current_so <= self.max_orders:
+            price_trigger, _, _, _ = self.calculate_next_buy(state.get('initial_base_price', avg_price), current_so, fvgs or [])
+            if is_long: lo = max(lo, price_trigger)
+            else: hi = min(hi, price_trigger)
+        return (lo, hi)
+
     def get_cumulative_drop(self, order_index):
         if order_index <= 1: return 0.0
         effective_so_count = order_index - 1
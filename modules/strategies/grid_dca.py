@@ -217,6 +217,53 @@ class GridDCAStrategy:
 
         return intent
 
+    def price_triggers(self, state, fvgs=None):
+        """
+        analyze_market 没有动作时，下一次可能产生动作的价格区间 (lo, hi):
+        价格 <= lo 或 >= hi 才需要重新评估 (补仓线 / 止盈 / 止损 / 追踪)；返回 None 表示每次都要评估
+        """
+        pos_amt = float(state.get('position_amt', 0))
+        avg_price = float(state.get('avg_price', 0))
+        if float(state.get('range_top', 0)) == 0 or pos_amt == 0 or avg_price <= 0 or self.leverage <= 0:
+            return None
+
+        is_short = (self.direction == 'short')
+        lo, hi = 0.0, float('inf')
+
+        # 止损: ROE < -sl
+        if self.sl_percent > 0:
+            move = self.sl_percent / self.leverage / 100
+            if is_short: hi = min(hi, avg_price * (1 + move))
+            else: lo = max(lo, avg_price * (1 - move))
+
+        if state.get('is_trailing_active', False):
+            # 追踪中: 创新高/新低 (更新极值) 或 回撤达到 trailing_dev
+            if is_short:
+                low_seen = float(state.get('lowest_price_seen', 0) or 0)
+                if low_seen <= 0: return None
+                lo = max(lo, low_seen)
+                hi = min(hi, low_seen * (1 + self.trailing_dev / 100))
+            else:
+                high_seen = float(state.get('highest_price_seen', 0) or 0)
+                if high_seen <= 0: return None
+                hi = min(hi, high_seen)
+                lo = max(lo, high_seen * (1 - self.trailing_dev / 100))
+            return (lo, hi)
+
+        # 止盈: 扣除手续费后的 ROE >= tp_target
+        fee_impact_pct = self.fee_rate * 2 * 100 * self.leverage
+        move = (self.tp_target + fee_impact_pct) / self.leverage / 100
+        if is_short: lo = max(lo, avg_price * (1 - move))
+        else: hi = min(hi, avg_price * (1 + move))
+
+        # 补仓: 最近的未成交网格线
+        filled_levels = set([o.get('level_idx') for o in state.get('orders', [])])
+        open_levels = [p for idx, p in enumerate(self.get_levels(state)) if idx not in filled_levels]
+        if open_levels:
+            if is_short: hi = min(hi, min(open_levels))
+            else: lo = max(lo, max(open_levels))
+        return (lo, hi)
+
     def generate_ladder(self, base_price=0, current_so=-1, market_price=0):
         # 1. 基础数据准备
         top = 0
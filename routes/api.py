@@ -1,17 +1,21 @@
 from quart import Blueprint, request, jsonify, session
+import json
 from languages import TRANSLATIONS
 from modules.database import db
 from modules.manual_ops import execute_manual_buy, execute_manual_close
 from modules.bot_manager import (
     RUNTIME_CACHE, get_bot_kline, get_bot_lock, 
-    fetch_exchange_symbols, clear_user_exchange_cache
+    fetch_exchange_symbols, clear_user_exchange_cache,
+    bot_scheduler, get_engine_stats
 )
-from utils import get_t, get_current_user, login_required, check_bot_ownership
-from modules.backtest_engine import run_backtest
+from utils import get_t, get_current_user, login_required, admin_required, check_bot_ownership
+from modules.backtest_jobs import backtest_jobs
 from modules.data_downloader import download_history_kline
 from quart import Response
 from datetime import datetime
 from modules.exchange_manager import fetch_symbol_info
+from modules.state_cache import bot_state_cache
+from modules.portfolio import portfolio
 
 # 定义蓝图
 api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -149,7 +153,9 @@ async def add_bot():
         }
     
     try:
-        await db.create_bot(user['id'], symbol, s_type, default_config, default_state, name=name, mode=mode)
+        new_id = await db.create_bot(user['id'], symbol, s_type, default_config, default_state, name=name, mode=mode)
+        portfolio.invalidate_user(user['id'])
+        await bot_scheduler.refresh_bot(new_id)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -176,6 +182,8 @@ async def delete_bot_route():
             return jsonify({"status": "error", "msg": f"❌ {t('delete_rejected_due_to_running_bot')}！\n{t('please_stop_running_first')}。"})
 
     await db.delete_bot(bot_id)
+    bot_state_cache.invalidate(bot_id)
+    bot_scheduler.remove_bot(bot_id)
     return jsonify({"status": "success"})
 
 @api_bp.route('/get_dashboard_stats')
@@ -186,99 +194,13 @@ async def get_dashboard_stats():
     # [新增] 从请求中获取 mode
     mode = request.args.get('mode', 'live')
     
-    # 只获取对应模式的机器人
-    bots = await db.get_all_bots(user['id'], mode=mode)
-    data = []
-    
-    for bot in bots:
-        # 1. 获取基础数据
-        state = bot.get('state', {})
-        cfg = bot.get('config', {})
-        bot_id = bot['id']
-        strategy_type = bot.get('strategy_type', 'fvg')
-        
-        pos_amt = float(state.get('position_amt', 0))
-        avg_price = float(state.get('avg_price', 0))
-        total_cost = float(state.get('total_cost', 0)) 
-        realized_profit = float(bot['current_profit'] or 0)
-        
-        # 2. 获取实时价格
-        realtime = RUNTIME_CACHE.get(bot_id, {})
-        market_price = realtime.get('market_price', 0)
-        
-        # 3. 计算浮动盈亏与回撤
-        floating_pnl = 0.0
-        drawdown_pct = 0.0
-        
-        if abs(pos_amt) > 0 and market_price > 0 and avg_price > 0:
-            direction = state.get('direction', cfg.get('direction', 'long'))
-            if direction == 'short':
-                floating_pnl = (avg_price - market_price) * abs(pos_amt)
-                drawdown_pct = (market_price - avg_price) / avg_price * 100
-            else:
-                floating_pnl = (market_price - avg_price) * abs(pos_amt)
-                drawdown_pct = (avg_price - market_price) / avg_price * 100
-
-        # 4. 计算净盈亏
-        net_pnl = realized_profit + floating_pnl
-        direction_display = state.get('direction', cfg.get('direction', 'long')).upper()
-        
-        # [新增] 提取杠杆
-        leverage = float(cfg.get('leverage', 1))
-
-        # 5. 提取策略特定数据 (扩充版)
-        strat_info = {}
-        strat_info['stage'] = state.get('stage', 'IDLE') # Coffin 专用
-
-        if strategy_type == 'grid_dca':
-            strat_info['grid_anchor'] = state.get('last_level_idx', -1)
-            strat_info['is_trailing'] = state.get('is_trailing_active', False)
-            # 提取极值
-            if direction_display == 'LONG':
-                strat_info['extreme'] = float(state.get('highest_price_seen', 0))
-            else:
-                strat_info['extreme'] = float(state.get('lowest_price_seen', 0))
-
-        elif strategy_type == 'coffin':
-            strat_info['sl'] = float(state.get('stop_loss_price', 0))
-            strat_info['extreme'] = float(state.get('extreme_price', 0))
-            # 提取箱体
-            box = state.get('coffin_5m', {})
-            if box and 'top' in box and 'bottom' in box:
-                strat_info['box_5m'] = f"${box['bottom']:.2f} - ${box['top']:.2f}"
-            else:
-                strat_info['box_5m'] = "---"
-        
-        else: # FVG
-            strat_info['is_trailing'] = state.get('is_trailing_active', False)
-            if direction_display == 'LONG':
-                strat_info['extreme'] = float(state.get('highest_price_seen', 0))
-            else:
-                strat_info['extreme'] = float(state.get('lowest_price_seen', 0))
-
-        data.append({
-            'id': bot_id,
-            'name': bot.get('name') or bot['symbol'], 
-            'symbol': bot.get('symbol'), # 确保有 symbol
-            'strategy_type': strategy_type,
-            'current_profit': realized_profit,
-            'total_balance': float(bot['total_balance'] or 0),
-            'is_running': int(bot['is_running']),
-            'status_msg': bot['status_msg'] or '',
-            'pos_amt': pos_amt,
-            'avg_price': avg_price,
-            'total_cost': total_cost,
-            'floating_pnl': floating_pnl,
-            'drawdown_pct': drawdown_pct,
-            'direction': direction_display,
-            'net_pnl': net_pnl,
-            'strat_info': strat_info,
-            'market_price': market_price, # [新增] 传递市价
-            'leverage': leverage,         # [新增] 传递杠杆
-            'folder_id': bot.get('folder_id')
-        })
-        
-    return jsonify(data)
+    # 直接返回引擎维护的看板快照 (所有标签页共用同一份响应体)，内容未变化时返回 304
+    etag, body = await portfolio.get(user['id'], mode)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        portfolio.not_modified += 1
+        return Response('', status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
 
 @api_bp.route('/get_data/<int:bot_id>')
 @login_required
@@ -323,14 +245,14 @@ async def get_data(bot_id):
         msg = f"[{ts}] {row['action']}: ${float(row['price'] or 0):.2f} | {row['note'] or ''}"
         log_strs.append(msg)
 
-    rounds = await db.get_bot_rounds(bot_id)
+    rounds, rounds_next = await db.get_bot_rounds(bot_id)  # 最新一页，更早的由前端按 rounds_next 游标加载
 
     # 1. 获取数据库存的“不完全净值” (扣除了卖出费，没扣买入费)
-    db_realized_profit = await db.get_total_profit(bot_id)
-    
-    # 2. 获取手续费明细
-    total_fees = await db.get_total_fees(bot_id)
-    buy_fees = await db.get_buy_fees(bot_id)
+    # 2. 获取手续费明细 (一次聚合查询)
+    totals = await db.get_log_totals(bot_id)
+    db_realized_profit = totals['profit']
+    total_fees = totals['fees']
+    buy_fees = totals['buy_fees']
     
     # 3. 推算卖出费 (总费 - 买入费)
     sell_fees = total_fees - buy_fees
@@ -355,7 +277,8 @@ async def get_data(bot_id):
             "market_price": market_price, 
             "logs": log_strs,
             "ladder_preview": ladder,
-            "rounds": rounds
+            "rounds": rounds,
+            "rounds_next": rounds_next
         },
         "metrics": {
             "pnl": pnl,
@@ -368,6 +291,19 @@ async def get_data(bot_id):
     }
     return jsonify(response)
 
+@api_bp.route('/get_rounds/<int:bot_id>')
+@login_required
+async def get_rounds(bot_id):
+    """ 已结束回合的游标分页: before 传上一页返回的 next (即该页最小的 round_id) """
+    bot_data = await check_bot_ownership(bot_id)
+    if bot_data is False: return jsonify({"error": "Unauthorized"}), 403
+    if bot_data is None: return jsonify({"error": "Bot not found"}), 404
+
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    rounds, next_before = await db.get_bot_rounds(bot_id, before=before, limit=limit)
+    return jsonify({"rounds": rounds, "next": next_before})
+
 @api_bp.route('/update_config', methods=['POST'])
 @login_required
 async def update_config():
@@ -492,7 +428,9 @@ async def update_config():
                 final_cfg['leverage'] = 1.0
                 new_cfg['leverage'] = 1.0
             
-            await db.update_bot_config(bot_id, final_cfg)
+            # 带版本号写入: 读取之后该行被引擎改过则放弃本次保存
+            if not await bot_state_cache.save_config(bot_id, final_cfg, version=bot_data.get('state_version')):
+                return jsonify({"status": "error", "msg": f"❌ {t('save_failed')}"})
             
             # --- 3. 处理策略重置 ---
             reset_needed = False
@@ -540,11 +478,13 @@ async def update_config():
 
             if reset_needed:
                 current_profit = float(bot_data.get('current_profit', 0))
-                await db.update_bot_state(bot_id, state, reset_msg, current_profit)
+                await bot_state_cache.save_state(bot_id, state, reset_msg, current_profit)
             
             if bot_id in RUNTIME_CACHE:
                 RUNTIME_CACHE[bot_id]['last_fvg_update_time'] = 0
 
+            await bot_scheduler.refresh_bot(bot_id)
+
             return jsonify({"status": "success", "msg": t("config_saved") + (" (" + t("status_reset") + ")" if reset_needed else "")})
 
         except Exception as e:
@@ -568,7 +508,8 @@ async def toggle_bot():
         status_text = t('status_starting') if is_start else t('status_stopped')
         
         # [修改] 将翻译好的文字传给数据库
-        await db.toggle_bot_status(bot_id, is_start, status_text)
+        await bot_state_cache.set_running(bot_id, is_start, status_text)
+        await bot_scheduler.refresh_bot(bot_id)
         
         return jsonify({"status": "success"})
 @api_bp.route('/manual_buy', methods=['POST'])
@@ -584,6 +525,7 @@ async def manual_buy_route():
         amount_usd = float(data.get('amount', 0))
         if amount_usd <= 0: raise ValueError(t("amount_must_be_positive"))
         await execute_manual_buy(bot_id, amount_usd)
+        await bot_scheduler.refresh_bot(bot_id)
         return jsonify({"status": "success", "msg": f"✅ {t('manual_buy_success')}"})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -599,6 +541,7 @@ async def manual_close_route():
         
     try:
         profit = await execute_manual_close(bot_id)
+        await bot_scheduler.refresh_bot(bot_id)
 
         sign = "+" if profit >= 0 else ""
         return jsonify({"status": "success", "msg": f"✅ {t('manual_close_success')}: {sign}${profit:.2f}"})
@@ -624,7 +567,7 @@ async def deposit_route():
         if await check_bot_ownership(bot_id) is False: 
             return jsonify({"status": "error", "msg": t("flash_unauthorized_action")})
         
-        bot_data = await db.get_bot_full_data(bot_id)
+        bot_data = await bot_state_cache.get(bot_id)
         if not bot_data: return jsonify({"status": "error", "msg": t("bot_not_found")})
         
         state = bot_data['state']
@@ -640,12 +583,14 @@ async def deposit_route():
         new_capital = old_capital + amount
         config['capital'] = new_capital
         
-        # 3. 记录日志
-        await db.add_log(bot_id, t("log_deposit"), 0, amount, 0, 0, f"Deposit: +{amount} U")
-        
-        # 4. 保存 Config 和 State
-        await db.update_bot_config(bot_id, config)
-        await db.update_bot_state(bot_id, state, f"✅ {t('deposit_success')}: +{amount} U", float(bot_data.get('current_profit', 0)))
+        # 3. 保存 Config 和 State (版本冲突说明期间被其他进程修改过，放弃本次入金)
+        if not await bot_state_cache.save_config(bot_id, config, version=bot_data.get('state_version')):
+            return jsonify({"status": "error", "msg": f"❌ {t('save_failed')}"})
+        await bot_state_cache.save_state(bot_id, state, f"✅ {t('deposit_success')}: +{amount} U", float(bot_data.get('current_profit', 0)))
+
+        # 4. 记录日志
+        await db.add_log(bot_id, t("log_deposit"), 0, amount, 0, 0, f"Deposit: +{amount} U", kind='deposit')
+        await bot_scheduler.refresh_bot(bot_id)
         
         return jsonify({
             "status": "success", 
@@ -698,6 +643,7 @@ async def create_folder():
         # 如果选了机器人，批量更新
         for bid in bot_ids:
             await db.update_bot_folder(user['id'], bid, folder_id)
+            await bot_scheduler.refresh_bot(bid)
         return jsonify({"status": "success", "msg": t("folder_created")})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -712,6 +658,8 @@ async def delete_folder():
     
     try:
         await db.delete_folder(user['id'], folder_id)
+        # 文件夹内的机器人 folder_id 被置空，刷新引擎中的行数据 (看板快照随之重新加载)
+        await bot_scheduler.refresh_user(user['id'])
         return jsonify({"status": "success", "msg": t("folder_deleted")})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -727,6 +675,7 @@ async def move_bot():
     
     try:
         await db.update_bot_folder(user['id'], bot_id, folder_id)
+        await bot_scheduler.refresh_bot(bot_id)
         return jsonify({"status": "success", "msg": t("bot_moved")})
     except Exception as e:
         return jsonify({"status": "error", "msg": str(e)})
@@ -768,12 +717,17 @@ async def save_user_settings():
     if need_clear_cache:
         # 清除该用户内存中所有的旧连接实例
         await clear_user_exchange_cache(user['id'])
+
+    # 交易所偏好或 Key 变化都会影响引擎行数据，刷新该用户的调度注册表
+    if 'exchange' in data or need_clear_cache:
+        await bot_scheduler.refresh_user(user['id'])
             
     return jsonify({"status": "success", "msg": t("config_saved")})
 
 @api_bp.route('/start_backtest', methods=['POST'])
 @login_required
 async def start_backtest():
+    """ 提交后台回测任务，立即返回 job_id (进度/结果通过 /backtest_job/<job_id> 查询) """
     t = get_t()
     user = await get_current_user()
     files = await request.files
@@ -791,15 +745,87 @@ async def start_backtest():
 
     # 读取文件内容
     content = file.read()
-    
-    # 异步启动回测 (由于回测可能耗时几秒，这里直接 await 等待结果，
-    # 如果文件巨大建议用 Background Task，但为了简单我们先直接 await)
-    success, msg = await run_backtest(bot_id, content)
-    
-    if success:
-        return jsonify({"status": "success", "msg": t("backtest_success_msg")})
-    else:
-        return jsonify({"status": "error", "msg": f"{t('backtest_failed')}: {msg}"})
+
+    # dry_run: 只返回统计结果，不写入日志和状态 (实盘机器人强制 dry_run)
+    dry_run = str(form.get('dry_run', '')).lower() in ('1', 'true', 'on')
+
+    try:
+        job_id = await backtest_jobs.submit(user['id'], bot_id, content, dry_run=dry_run)
+    except Exception as e:
+        return jsonify({"status": "error", "msg": f"{t('backtest_failed')}: {e}"})
+    if job_id is None:
+        return jsonify({"status": "error", "msg": t("backtest_queue_full")})
+
+    return jsonify({"status": "success", "msg": t("backtest_queued"), "job_id": job_id})
+
+@api_bp.route('/start_optimize', methods=['POST'])
+@login_required
+async def start_optimize():
+    """
+    提交参数寻优任务 (网格搜索)，立即返回 job_id，结果通过 /backtest_job/<job_id> 查询
+    params: JSON，例如 {"grid_count": [10, 20, 30], "range_percent": {"start": 0.05, "stop": 0.3, "step": 0.05}}
+    rank_by: net_pnl / return_pct / win_rate / profit_factor / max_drawdown_pct / total_fees
+    """
+    t = get_t()
+    user = await get_current_user()
+    files = await request.files
+    form = await request.form
+
+    bot_id = form.get('bot_id')
+    file = files.get('file')
+
+    if not bot_id or not file:
+        return jsonify({"status": "error", "msg": t("missing_bot_id_or_file")})
+
+    if await check_bot_ownership(bot_id) is False:
+        return jsonify({"status": "error", "msg": t("flash_unauthorized_action")})
+
+    try:
+        ranges = json.loads(form.get('params') or '{}')
+        top = int(form.get('top', 50))
+    except Exception:
+        return jsonify({"status": "error", "msg": t("optimize_invalid_params")})
+    rank_by = form.get('rank_by', 'net_pnl')
+
+    content = file.read()
+    try:
+        job_id = await backtest_jobs.submit_sweep(user['id'], bot_id, content, ranges, rank_by=rank_by, top=top)
+    except ValueError as e:
+        return jsonify({"status": "error", "msg": f"{t('optimize_invalid_params')}: {e}"})
+    except Exception as e:
+        return jsonify({"status": "error", "msg": f"{t('backtest_failed')}: {e}"})
+    if job_id is None:
+        return jsonify({"status": "error", "msg": t("backtest_queue_full")})
+
+    return jsonify({"status": "success", "msg": t("optimize_queued"), "job_id": job_id})
+
+@api_bp.route('/backtest_job/<job_id>')
+@login_required
+async def backtest_job_status(job_id):
+    t = get_t()
+    user = await get_current_user()
+    job = backtest_jobs.get(job_id)
+    if not job or job['user_id'] != user['id']:
+        return jsonify({"status": "error", "msg": t("backtest_job_not_found")})
+    return jsonify({"status": "success", "job": backtest_jobs.public_view(job)})
+
+@api_bp.route('/backtest_job/<job_id>/cancel', methods=['POST'])
+@login_required
+async def backtest_job_cancel(job_id):
+    t = get_t()
+    user = await get_current_user()
+    job = backtest_jobs.get(job_id)
+    if not job or job['user_id'] != user['id']:
+        return jsonify({"status": "error", "msg": t("backtest_job_not_found")})
+    backtest_jobs.cancel(job_id)
+    return jsonify({"status": "success", "msg": t("backtest_cancelled")})
+
+@api_bp.route('/backtest_jobs')
+@login_required
+async def backtest_job_list():
+    user = await get_current_user()
+    jobs = [backtest_jobs.public_view(j, with_result=False) for j in backtest_jobs.list_user(user['id'])]
+    return jsonify({"status": "success", "jobs": jobs})
     
 @api_bp.route('/download_history', methods=['POST'])
 @login_required
@@ -845,4 +871,10 @@ async def download_history():
     
     return Response(csv_data, mimetype='text/csv', headers={
         "Content-Disposition": f"attachment; filename={filename}"
-    })
\ No newline at end of file
+    })
+
+@api_bp.route('/engine_stats')
+@admin_required
+async def engine_stats():
+    """ 引擎运行指标: 调度吞吐 (ticks/s) 与调度延迟 (进程级数据，涵盖所有用户，仅管理员可见) """
+    return jsonify(get_engine_stats())
@@ -3,6 +3,8 @@ from quart import Blueprint, render_template, url_for, session, request, flash,
 from modules.database import db
 from utils import get_t, get_current_user, login_required
 from modules.exchange_manager import clear_user_exchange_cache
+from modules.scheduler import bot_scheduler
+from modules.state_cache import bot_state_cache
 
 web_bp = Blueprint('web', __name__)
 
@@ -26,7 +28,7 @@ async def dashboard():
 async def bot_detail(bot_id):
     t = get_t()
     user = await get_current_user()
-    bot = await db.get_bot_full_data(bot_id)
+    bot = await bot_state_cache.get(bot_id)
     if not bot: return "Bot not found", 404
     if bot['user_id'] != user['id'] and not user.get('is_admin'):
         return t("no_permission_to_access_this_bot"), 403
@@ -74,6 +76,7 @@ async def settings():
         # 这会调用旧连接的 .close()，防止 "Unclosed client session" 报错
         # 下次机器人循环时，get_cached_exchange 发现缓存空了，就会用新 Key 创建新连接
         await clear_user_exchange_cache(user['id'])
+        await bot_scheduler.refresh_user(user['id'])
 
         await flash(t('config_saved') or "配置已保存")
         return redirect(url_for('web.settings'))
@@ -236,8 +236,44 @@ function commonGetRsiConditions() {
 
 // --- 交易记录渲染 (Render Rounds) ---
 
-function commonRenderRounds(rounds, leverage = 1, symbol = "") {
+// 轮询 /get_data 只返回最新一页回合；更早的回合点击 "加载更多" 后按游标从 /api/get_rounds 分页获取并缓存在这里
+const ROUNDS_PAGER = { older: {}, next: undefined, loading: false, args: null };
+
+function commonLoadRounds(before, limit, isGap) {
+    if (ROUNDS_PAGER.loading) return;
+    ROUNDS_PAGER.loading = true;
+    $.get(`/api/get_rounds/${CURRENT_BOT_ID}`, { before: before, limit: limit || 50 }, function(res) {
+        (res.rounds || []).forEach(r => { ROUNDS_PAGER.older[r.round_id] = r; });
+        // 补缺口 (期间又结束了新回合，最新一页整体上移) 不改变继续向前翻页的游标
+        if (!isGap) ROUNDS_PAGER.next = res.next;
+    }).always(function() {
+        ROUNDS_PAGER.loading = false;
+        if (ROUNDS_PAGER.args) commonRenderRounds(...ROUNDS_PAGER.args);
+    });
+}
+
+function commonLoadMoreRounds() {
+    const shown = $('#rounds-container').data('min-round');
+    if (shown) commonLoadRounds(shown, 50, false);
+}
+
+function commonRenderRounds(rounds, leverage = 1, symbol = "", next = null) {
     const container = $('#rounds-container');
+    ROUNDS_PAGER.args = [rounds, leverage, symbol, next];
+
+    // 合并已加载的更早回合 (只取最新一页之前的部分)
+    let cursor = next;
+    const older = Object.values(ROUNDS_PAGER.older);
+    if (rounds && older.length) {
+        const finished = rounds.filter(r => r.result !== 'running').map(r => r.round_id);
+        const pageMin = finished.length ? Math.min(...finished) : Infinity;
+        const olderRounds = older.filter(r => r.round_id < pageMin).sort((x, y) => y.round_id - x.round_id);
+        if (olderRounds.length && pageMin !== Infinity && olderRounds[0].round_id < pageMin - 1) {
+            commonLoadRounds(pageMin, Math.min(pageMin - olderRounds[0].round_id - 1, 200), true);
+        }
+        rounds = rounds.concat(olderRounds);
+        cursor = ROUNDS_PAGER.next;
+    }
     
     let baseCoin = "Units";
     if (symbol && symbol.includes('/')) {
@@ -346,9 +382,19 @@ function commonRenderRounds(rounds, leverage = 1, symbol = "") {
     });
     
     html += '</div>';
+
+    if (cursor) {
+        html += `
+            <div class="text-center p-2">
+                <button class="btn btn-sm btn-outline-secondary" onclick="commonLoadMoreRounds()" ${ROUNDS_PAGER.loading ? 'disabled' : ''}>
+                    ${I18N.load_more_rounds || 'Load older rounds'}
+                </button>
+            </div>`;
+    }
     
     const openId = container.find('.accordion-collapse.show').attr('id');
     container.html(html);
+    container.data('min-round', Math.min(...rounds.map(r => r.round_id)));
     
     if (openId) {
         const target = $('#' + openId);
@@ -469,6 +515,68 @@ function commonExecuteDeposit(botId, amountInputId, modalId, callback) {
     });
 }
 
+// --- 回测任务 (后台队列 + 进度轮询) ---
+
+function commonRunBacktest(botId) {
+    const fileInput = document.getElementById('backtest-file');
+    if (fileInput.files.length === 0) return alert(I18N.please_upload_csv || "Please upload a CSV file first!");
+
+    const formData = new FormData();
+    formData.append('bot_id', botId);
+    formData.append('file', fileInput.files[0]);
+
+    const btn = $('#btn-run-backtest');
+    const originalText = btn.text();
+    const reset = () => btn.text(originalText).prop('disabled', false);
+    btn.text("⏳ " + (I18N.running_dots || "Running...")).prop('disabled', true);
+
+    $.ajax({
+        url: '/api/start_backtest',
+        type: 'POST',
+        data: formData,
+        processData: false,
+        contentType: false,
+        success: function(res) {
+            if (res.status !== 'success') {
+                reset();
+                return alert("Error: " + res.msg);
+            }
+            commonPollBacktestJob(res.job_id, btn, reset);
+        },
+        error: function() {
+            reset();
+            alert(I18N.network_error_simple || "Network Error");
+        }
+    });
+}
+
+function commonPollBacktestJob(jobId, btn, done) {
+    $.get('/api/backtest_job/' + jobId, function(res) {
+        if (res.status !== 'success') {
+            done();
+            return alert("Error: " + res.msg);
+        }
+        const job = res.job;
+        if (job.state === 'queued' || job.state === 'running') {
+            const p = job.progress || {};
+            btn.text(`⏳ ${p.pct || 0}% · ${p.trades || 0} ${I18N.backtest_trades || "trades"}`);
+            setTimeout(() => commonPollBacktestJob(jobId, btn, done), 1000);
+            return;
+        }
+        done();
+        if (job.state === 'done') {
+            alert(I18N.backtest_success_msg || "Backtest Completed!");
+            location.reload();
+        } else if (job.state === 'cancelled') {
+            alert(I18N.backtest_cancelled || "Backtest cancelled");
+        } else {
+            alert((I18N.backtest_failed || "Backtest Failed") + ": " + (job.error || ""));
+        }
+    }).fail(function() {
+        setTimeout(() => commonPollBacktestJob(jobId, btn, done), 3000);
+    });
+}
+
 function commonInitMarketTypeListener() {
     const marketSelect = $('#cfg-market-type');
     const leverageInput = $('#cfg-leverage');
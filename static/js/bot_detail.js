@@ -217,7 +217,7 @@ function updateData() {
         $('#logs-container').html(logHtml);
 
         // 调用 Common 渲染回合
-        commonRenderRounds(g.rounds, 1, c.symbol);
+        commonRenderRounds(g.rounds, 1, c.symbol, g.rounds_next);
     });
 }
 
@@ -349,42 +349,7 @@ function checkBotMode() {
 
 // 2. 添加回测函数
 function runBacktest() {
-    const fileInput = document.getElementById('backtest-file');
-    if (fileInput.files.length === 0) {
-        return alert(I18N.please_upload_csv || "Please upload a CSV file first!");
-    }
-    
-    const file = fileInput.files[0];
-    const formData = new FormData();
-    formData.append('bot_id', CURRENT_BOT_ID);
-    formData.append('file', file);
-    
-    const btn = $('#btn-run-backtest');
-    const originalText = btn.text();
-    btn.text("⏳ " + (I18N.running_dots || "Running...")).prop('disabled', true);
-    
-    $.ajax({
-        url: '/api/start_backtest',
-        type: 'POST',
-        data: formData,
-        processData: false, // 必须
-        contentType: false, // 必须
-        success: function(res) {
-            if (res.status === 'success') {
-                alert(res.msg);
-                // 刷新页面或重新加载数据以显示回测结果
-                location.reload(); 
-            } else {
-                alert("Error: " + res.msg);
-            }
-        },
-        error: function(err) {
-            alert(I18N.network_error_simple || "Network Error");
-        },
-        complete: function() {
-            btn.text(originalText).prop('disabled', false);
-        }
-    });
+    commonRunBacktest(CURRENT_BOT_ID);
 }
 
 document.addEventListener("visibilitychange", function() {
@@ -210,7 +210,7 @@ function updateData() {
         }
         $('#logs-container').html(logHtml);
 
-        commonRenderRounds(g.rounds, 1, c.symbol);
+        commonRenderRounds(g.rounds, 1, c.symbol, g.rounds_next);
     });
 }
 
@@ -339,31 +339,7 @@ function checkBotMode() {
 }
 
 function runBacktest() {
-    const fileInput = document.getElementById('backtest-file');
-    if (fileInput.files.length === 0) return alert(I18N.please_upload_csv || "Please upload a CSV file first!");
-    
-    const file = fileInput.files[0];
-    const formData = new FormData();
-    formData.append('bot_id', CURRENT_BOT_ID);
-    formData.append('file', file);
-    
-    const btn = $('#btn-run-backtest');
-    const originalText = btn.text();
-    btn.text("⏳ " + (I18N.running_dots || "Running...")).prop('disabled', true);
-    
-    $.ajax({
-        url: '/api/start_backtest',
-        type: 'POST',
-        data: formData,
-        processData: false,
-        contentType: false,
-        success: function(res) {
-            alert(res.status === 'success' ? res.msg : "Error: " + res.msg);
-            if (res.status === 'success') location.reload();
-        },
-        error: () => alert(I18N.network_error_simple || "Network Error"),
-        complete: () => btn.text(originalText).prop('disabled', false)
-    });
+    commonRunBacktest(CURRENT_BOT_ID);
 }
 
 document.addEventListener("visibilitychange", function() {
@@ -2,6 +2,7 @@
 from quart import session, redirect, url_for, flash
 from functools import wraps
 from modules.database import db
+from modules.state_cache import bot_state_cache
 from languages import TRANSLATIONS
 
 # --- 1. 翻译辅助函数 ---
@@ -46,7 +47,7 @@ def admin_required(func):
 async def check_bot_ownership(bot_id):
     user = await get_current_user()
     if not user: return False
-    bot = await db.get_bot_full_data(bot_id)
+    bot = await bot_state_cache.get(bot_id)
     if not bot: return None
     if bot['user_id'] != user['id']: return False
     return bot
\ No newline at end of file